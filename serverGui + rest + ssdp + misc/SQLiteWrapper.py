@@ -5,55 +5,113 @@
 # provide us with some generic methods we can use to talk to a sqlite3 database
 
 
+import random
 import sqlite3
+import time
+import connection_pool
+import constants
 
 
 class SQLiteWrapper:
 
-    # keep track of whether this is the first run of this class (or its children)
-    has_been_instantiated = False
-    # we only want to create the database files once
-
-    # this is meant to be overriden by children, so if it is not, throw an exception
-    def create_database():
-        raise Exception("Create_database() must be overriden")
+    # ordered list of schema migrations, meant to be overriden by children
+    # migrations[i] takes the database from PRAGMA user_version i to i + 1, so new migrations only ever get appended to the end
+    # they are applied once at server startup (see migrate), never on the request path
+    migrations = []
 
     # constructor, takes our db file i.e user_data.db
-    def __init__(self, db_file):
-        # get database connection(finds the database) and cursor (allows us to traverse/access the database)
-        # check_same_thread=False makes it thread safe, incase we wanted multiple rest workers (we only have one because I couldn't get it to work with pyinstaller, so that flag doesn't matter)
-        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+    # immediate=True takes the write lock when the transaction begins, use it for any transaction that reads and then writes
+    # (otherwise two processes can both read, and the second one to write fails with "database is locked" instead of waiting its turn)
+    def __init__(self, db_file, immediate=False):
+        self.immediate = immediate
+        # check a database connection out of the pool for this file (finds the database) and get a cursor (allows us to traverse/access the database)
+        # the connection belongs to this object (and so this thread) until __exit__ hands it back
+        self.pool = connection_pool.get_pool(db_file)
+        self.conn = self.pool.acquire()
         self.cursor = self.conn.cursor()
         # print("connected to database, initiated cursor")
 
-        # if this is the first time running, create the database
-        if not self.has_been_instantiated:
-            # print("Trying to create database tables...")
-            self.create_database()
-
-            self.has_been_instantiated = True
-
     # this class is meant to be used within a context manager (with statemnet), this is what happens when it starts
     # it creates a database transaction, this is meant to ensure safety incase multiple people are accessing the database
     def __enter__(self):
-        self.begin()  # begin the transaction
+        try:
+            self.begin()  # begin the transaction
+        except BaseException:
+            # i.e "database is locked" on BEGIN IMMEDIATE, __exit__ won't run so give the connection back here (or it leaks out of the pool)
+            self.close()
+            raise
         return self
 
+    # gives the connection back to the pool without committing, a connection left mid transaction is thrown away instead
+    def close(self):
+        self.cursor.close()
+        if self.conn.in_transaction:
+            self.pool.discard(self.conn)
+        else:
+            self.pool.release(self.conn)
+
     def __exit__(self, exc_type, exc_value, traceback):
         # exc_type is the exception type (if there was an error thrown within the context manager (with statement))
-        if exc_type is None:
-            # print("transaction successful")
-            self.commit()  # complete the transaction (this is when all of the changes to the database actually happen)
-        else:
-            # print("transaction failed, rolling back")
-            self.conn.rollback()  # revert the transaction (because an error occured)
-        # print("Close db cursor, close db conn")
+        try:
+            if exc_type is None:
+                # print("transaction successful")
+                self.commit()  # complete the transaction (this is when all of the changes to the database actually happen)
+            else:
+                # print("transaction failed, rolling back")
+                self.conn.rollback()  # revert the transaction (because an error occured)
+        except BaseException:
+            # the commit/rollback itself failed, the connection is in an unknown state so don't put it back in the pool
+            self.cursor.close()
+            self.pool.discard(self.conn)
+            raise
+        # print("Close db cursor, return db conn to the pool")
         self.cursor.close()  # close the cursor
-        self.conn.close()  # close the connection
+        self.pool.release(self.conn)  # give the connection back to the pool (it stays open for the next request)
+
+    # brings the database schema up to date by applying every migration newer than its user_version
+    # meant to be run inside the context manager so all of the pending migrations and the version bump commit together
+    # works on existing database files too, they just start at user_version 0
+    def migrate(self):
+        self.execute("PRAGMA user_version")
+        version = self.fetchone()[0]
+        if version > len(self.migrations):
+            raise Exception("database schema version " + str(version) +
+                            " is newer than this server supports (" + str(len(self.migrations)) + ")")
+
+        for migration in self.migrations[version:]:
+            migration(self)
+            version += 1
+
+        # pragmas can't take bound parameters, version is always an int we counted ourselves
+        self.execute("PRAGMA user_version = " + str(version))
+
+    # applies any pending migrations to db_file (creating it if it doesn't exist yet) in one immediate transaction
+    @classmethod
+    def migrate_file(cls, db_file):
+        with cls(db_file, immediate=True) as db:
+            db.migrate()
+
+    # runs fn(db) in its own immediate transaction on a new cls(db_file), returns what fn returned
+    # if the database stays locked for longer than the busy timeout (i.e lots of worker processes writing at once) the whole transaction is run again,
+    # after a random backoff that doubles every attempt (random so the processes that collided don't all try again at the same moment)
+    # fn must only touch the database (it can run more than once), everything it did on a failed attempt was rolled back
+    @classmethod
+    def run_with_retry(cls, db_file, fn, attempts=constants.sqlite_busy_retries, backoff=constants.sqlite_busy_backoff):
+        for attempt in range(attempts):
+            try:
+                with cls(db_file, immediate=True) as db:
+                    return fn(db)
+            except sqlite3.OperationalError as e:
+                if attempt >= attempts - 1 or not is_busy_error(e):
+                    raise
+            time.sleep(random.uniform(0, backoff * 2 ** attempt))
 
     # begin transactions
     def begin(self):
-        self.execute("BEGIN")
+        if self.immediate:
+            self.execute("BEGIN IMMEDIATE")
+        else:
+            self.execute("BEGIN")
         # print("transaction began")
 
     # commit(end) transactions
@@ -88,3 +146,9 @@ class SQLiteWrapper:
 
     def fetchone(self):
         return self.cursor.fetchone()
+
+
+# true if a sqlite error means another connection had the database locked (SQLITE_BUSY/SQLITE_LOCKED), so trying again later can work
+def is_busy_error(e):
+    message = str(e).lower()
+    return "locked" in message or "busy" in message
@@ -0,0 +1,94 @@
+# compares the old iterrows based ingest with the column based one in database_manager
+# run it with: python benchmark_ingest.py
+# it makes fake daily histories (no internet needed), converts them both ways, writes them to a throwaway database and prints the times and peak memory
+# only the conversion is imported, no database_manager is made (that would create the price archive folder and start the caches)
+
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import constants
+from database_manager import iter_stockdf_chunks
+
+
+# the original dump_stockdf_to_list, kept here so we have something to compare against
+def dump_stockdf_to_list_iterrows(df, ticker):
+    return [
+        (
+            pd.Timestamp(index).strftime(constants.date_format),
+            ticker,
+            row["Open"],
+            row["High"],
+            row["Low"],
+            row["Close"],
+            row["Volume"],
+            row["Dividends"],
+            row["Stock Splits"],
+        )
+        for index, row in df.iterrows()
+    ]
+
+
+# a fake history that looks like what yfinance gives us (business days, exchange timezone)
+def make_history(num_rows):
+    index = pd.bdate_range(end="2023-01-01", periods=num_rows,
+                           tz="America/New_York", name="Date")
+    close = 100 + np.cumsum(np.random.default_rng(0).normal(0, 1, num_rows))
+    return pd.DataFrame({
+        "Open": close - 0.5,
+        "High": close + 1,
+        "Low": close - 1,
+        "Close": close,
+        "Volume": np.arange(num_rows) * 100,
+        "Dividends": 0.0,
+        "Stock Splits": 0.0,
+    }, index=index)
+
+
+# runs ingest(db_path) on an empty stock_data table and returns (seconds, peak memory in MiB)
+def measure(ingest):
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = os.path.join(folder, "bench.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute("""CREATE TABLE stock_data (date text NOT NULL, ticker text NOT NULL, open numeric NOT NULL, high numeric NOT NULL,
+                     low numeric NOT NULL, close numeric NOT NULL, volume numeric NOT NULL, dividends numeric NOT NULL,
+                     stock_splits numeric NOT NULL, PRIMARY KEY (ticker, date))""")
+        conn.commit()
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        ingest(conn)
+        conn.commit()
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+        conn.close()
+        return seconds, peak
+
+
+def main():
+    insert = "INSERT INTO stock_data VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+    # ~60 years of trading days, and a (made up) 200 year one
+    for num_rows in [15000, 50000]:
+        df = make_history(num_rows)
+
+        def old_ingest(conn):
+            conn.executemany(insert, dump_stockdf_to_list_iterrows(df, "BENCH"))
+
+        def new_ingest(conn):
+            for rows in iter_stockdf_chunks(df, "BENCH"):
+                conn.executemany(insert, rows)
+
+        old_seconds, old_peak = measure(old_ingest)
+        new_seconds, new_peak = measure(new_ingest)
+        print(f"{num_rows} rows: iterrows {old_seconds:.3f}s peak {old_peak:.1f}MiB | "
+              f"columns {new_seconds:.3f}s peak {new_peak:.1f}MiB | {old_seconds / new_seconds:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# converts a stock_data.db to the compact layout (stockData_manager migration 4) and vacuums it, then prints how much smaller and faster it got
+# run it with the server stopped: python compact_stock_database.py [path to stock_data.db]
+# (the server would also migrate the database when it starts, this just lets you do the slow part ahead of time and see the difference)
+
+import os
+import sqlite3
+import statistics
+import sys
+import time
+import connection_pool
+import constants
+from stockData_manager import stockData_manager
+
+# how many tickers the query timing uses, and how many times each query is run
+sample_tickers = 20
+repeats = 5
+
+
+# size of the database file (plus its WAL file if there is one) in bytes
+def database_size(path):
+    size = os.path.getsize(path)
+    if os.path.exists(path + "-wal"):
+        size += os.path.getsize(path + "-wal")
+    return size
+
+
+# true if stock_data is already in the compact layout
+def is_compact(conn):
+    return "ticker_id" in [row[1] for row in conn.execute("PRAGMA table_info(stock_data)")]
+
+
+# median time (in milliseconds) to read the whole history of a ticker and a one year slice of it, over a sample of tickers
+def time_queries(conn, tickers):
+    if is_compact(conn):
+        full = "SELECT day, open, high, low, close, volume, dividends, stock_splits FROM stock_data WHERE ticker_id=(SELECT id FROM tickers WHERE symbol=?) ORDER BY day"
+        year = "SELECT day, open, high, low, close, volume, dividends, stock_splits FROM stock_data WHERE ticker_id=(SELECT id FROM tickers WHERE symbol=?) AND day BETWEEN CAST(julianday(?) - 2440587.5 AS INTEGER) AND CAST(julianday(?) - 2440587.5 AS INTEGER) ORDER BY day"
+    else:
+        full = "SELECT date, open, high, low, close, volume, dividends, stock_splits FROM stock_data WHERE ticker=? ORDER BY date"
+        year = "SELECT date, open, high, low, close, volume, dividends, stock_splits FROM stock_data WHERE ticker=? AND date BETWEEN ? AND ? ORDER BY date"
+
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        for ticker in tickers:
+            conn.execute(full, (ticker,)).fetchall()
+            conn.execute(year, (ticker, "2020-01-01", "2020-12-31")).fetchall()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else constants.stock_data_database_path
+    if not os.path.exists(path):
+        print(path + " doesn't exist")
+        return
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    before_size = database_size(path)
+    if is_compact(conn):
+        tickers = [row[0] for row in conn.execute(
+            "SELECT symbol FROM tickers LIMIT ?", (sample_tickers,))]
+    else:
+        tickers = [row[0] for row in conn.execute(
+            "SELECT DISTINCT ticker FROM stock_data LIMIT ?", (sample_tickers,))]
+    before_time = time_queries(conn, tickers)
+    conn.close()
+
+    print("migrating " + path + "...")
+    start = time.perf_counter()
+    with stockData_manager(path, immediate=True) as db:
+        db.migrate()
+    # the pool holds connections open, close them so VACUUM has the database to itself
+    connection_pool.close_all_pools()
+    print(f"migrated in {time.perf_counter() - start:.1f}s, vacuuming...")
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("VACUUM")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    after_size = database_size(path)
+    after_time = time_queries(conn, tickers)
+    conn.close()
+
+    print(f"size: {before_size / 2 ** 20:.1f}MiB -> {after_size / 2 ** 20:.1f}MiB ({after_size / before_size:.0%})")
+    print(f"query time ({len(tickers)} tickers, full history + one year each): "
+          f"{before_time:.1f}ms -> {after_time:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
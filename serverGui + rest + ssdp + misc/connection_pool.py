@@ -0,0 +1,136 @@
+# keeps a bounded pool of long lived sqlite3 connections for each database file
+# opening a connection for every request throws away sqlite's page cache and pays the connect/teardown cost every time,
+# so instead SQLiteWrapper checks a connection out of the pool for the length of its transaction and gives it back afterwards
+
+import sqlite3
+import threading
+import constants
+
+
+class connectionPool:
+
+    def __init__(self, db_file, max_size=constants.sqlite_pool_size):
+        self.db_file = db_file
+        self.max_size = max_size
+        self.idle = []  # connections that are not checked out (used as a stack so the warmest connection is reused first)
+        self.num_open = 0  # idle + checked out connections
+        self.closed = False
+        self.lock = threading.Condition()
+
+    # opens a new connection and configures it once (these settings stick for the lifetime of the connection)
+    def _connect(self):
+        # isolation_level=None stops the sqlite3 module from starting transactions on its own, SQLiteWrapper issues BEGIN/COMMIT itself
+        # check_same_thread=False because a connection can be checked out by a different thread each time it leaves the pool
+        conn = sqlite3.connect(
+            self.db_file,
+            timeout=constants.sqlite_busy_timeout_ms / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        # WAL lets readers keep reading while a writer is in a transaction
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA busy_timeout={int(constants.sqlite_busy_timeout_ms)}")
+        conn.execute(f"PRAGMA synchronous={constants.sqlite_synchronous}")
+        # negative cache_size is in KiB instead of pages
+        conn.execute(f"PRAGMA cache_size=-{int(constants.sqlite_cache_size_kib)}")
+        return conn
+
+    # makes sure a connection that came out of the pool is still usable
+    def _is_healthy(self, conn):
+        try:
+            # a connection should never come back mid transaction, but if it did, throw away whatever it was doing
+            if conn.in_transaction:
+                conn.rollback()
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    # check a connection out of the pool, blocks (up to timeout seconds) if all max_size connections are in use
+    def acquire(self, timeout=constants.sqlite_pool_timeout):
+        with self.lock:
+            while True:
+                if self.closed:
+                    raise sqlite3.ProgrammingError(
+                        "connection pool for " + self.db_file + " is closed")
+                if len(self.idle) > 0:
+                    conn = self.idle.pop()
+                    break
+                if self.num_open < self.max_size:
+                    # reserve the slot before connecting so we never go over max_size
+                    self.num_open += 1
+                    conn = None
+                    break
+                if not self.lock.wait(timeout):
+                    raise TimeoutError(
+                        "timed out waiting for a connection to " + self.db_file)
+
+        if conn is not None and self._is_healthy(conn):
+            return conn
+
+        # either the pool had no idle connection or the idle one was broken, open a fresh one in its slot
+        if conn is not None:
+            self._close_quietly(conn)
+        try:
+            return self._connect()
+        except BaseException:
+            with self.lock:
+                self.num_open -= 1
+                self.lock.notify()
+            raise
+
+    # give a connection back to the pool
+    def release(self, conn):
+        with self.lock:
+            if self.closed:
+                self.num_open -= 1
+                self._close_quietly(conn)
+            else:
+                self.idle.append(conn)
+            self.lock.notify()
+
+    # throw away a connection instead of returning it (used when it is in an unknown state)
+    def discard(self, conn):
+        self._close_quietly(conn)
+        with self.lock:
+            self.num_open -= 1
+            self.lock.notify()
+
+    # closes all idle connections, connections that are checked out are closed when they are released
+    def close(self):
+        with self.lock:
+            self.closed = True
+            for conn in self.idle:
+                self._close_quietly(conn)
+            self.num_open -= len(self.idle)
+            self.idle = []
+            self.lock.notify_all()
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+
+# one pool per database file, shared by every SQLiteWrapper in this process
+pools = {}
+pools_lock = threading.Lock()
+
+
+# get (or create) the pool for a database file
+def get_pool(db_file):
+    with pools_lock:
+        pool = pools.get(db_file)
+        if pool is None or pool.closed:
+            pool = connectionPool(db_file)
+            pools[db_file] = pool
+        return pool
+
+
+# close every pool (called when the server stops so the database files are not held open)
+def close_all_pools():
+    with pools_lock:
+        for pool in pools.values():
+            pool.close()
+        pools.clear()
@@ -9,8 +9,87 @@ stock_data_database_path = "stock_data.db"
 user_data_database_path = "user_data.db"
 
 date_format = "%Y-%m-%d"
+# nothing is older than this, a period="max" fetch covers everything from here on
+earliest_date = "1800-01-01"
 
 starting_balance = 50000
+ledger_snapshot_interval = 50  # a user's positions are snapshotted every this many trades (see userData_manager.py)
+trades_max_page = 1000  # the most trades one get_user_trades request returns
+equity_cache_size = 1024  # users whose account value curve is kept in memory (see equity_curve.py)
+leaderboard_resync_interval = 300  # seconds between rebuilding the leaderboard from user_data.db (see leaderboard.py)
+leaderboard_max_page = 100  # the most users one get_leaderboard request returns
+
+# sqlite connection pool settings (see connection_pool.py)
+sqlite_pool_size = 8  # max open connections per database file
+sqlite_pool_timeout = 30  # seconds to wait for a free connection before giving up
+sqlite_busy_timeout_ms = 5000  # how long sqlite waits on a locked database before raising "database is locked"
+sqlite_busy_retries = 5  # times a write transaction is tried when the database stays locked (see SQLiteWrapper.run_with_retry)
+sqlite_busy_backoff = 0.05  # seconds, the most the first retry waits (doubles every retry)
+sqlite_synchronous = "NORMAL"  # NORMAL is durable across application crashes in WAL mode and skips most fsyncs
+sqlite_cache_size_kib = 16384  # page cache per connection
+
+# group commit of user_data.db writes (see write_queue.py)
+write_queue_window = 0.005  # seconds a batch stays open for more trades after its first one arrives
+write_queue_max_batch = 256  # the most trades/account creations committed in one transaction
+
+# thread pools the rest handlers run their blocking work on (see request_executor.py)
+# database work is sized to the connection pool, market data work mostly sits waiting on yahoo so it gets more threads
+db_executor_workers = sqlite_pool_size
+db_executor_max_pending = 64  # queued + running calls before we answer 503
+market_executor_workers = 16
+market_executor_max_pending = 128
+
+# number of rest server processes, 1 runs the server in a thread next to the gui like before
+# more than 1 runs that many worker processes sharing the listening socket (see uvicornServer.uvicornWorkerPool)
+rest_workers = 1
+rest_worker_check_interval = 1  # seconds between checks for crashed workers
+rest_worker_shutdown_timeout = 10  # seconds workers get to finish their requests when the server stops
+
+# current price cache (see quote_cache.py)
+quote_cache_ttl = 30  # seconds a price is served without asking yahoo again
+quote_cache_stale_ttl = 120  # seconds after that a price is still served while a fresh one is fetched in the background
+quote_cache_size = 2048  # max tickers kept in the cache
+quote_refresh_workers = 4  # threads doing background refreshes
+
+invalid_ticker_ttl = 3600  # seconds we remember that a ticker doesn't exist before asking the market data provider again
+yahoo_chart_url = "https://query2.finance.yahoo.com/v8/finance/chart/"  # asked directly to tell a ticker with no data apart from yahoo not answering
+yahoo_timeout = 10  # seconds to wait for that answer
+market_data_retry_after = 30  # seconds a client is told to wait when yahoo couldn't be reached
+
+price_store_max_bytes = 256 * 2 ** 20  # memory the in memory price histories can use (see price_history_store.py)
+# folder of memory mapped price history files shared by every server process (see price_archive.py), kept in sync with stock_data.db
+price_archive_path = "price_archive"
+
+# where market data comes from (see market_data_provider.py)
+# "yfinance" for yahoo finance, "local" for the files in local_market_data_source (no internet needed)
+market_data_provider = "yfinance"
+local_market_data_source = "market_data"  # folder of <TICKER>.csv/.parquet files, or a stock_data.db style database file
+# with the local provider, set replay_start to replay a past trading day, i.e "2020-03-16 09:30"
+replay_start = None
+replay_start_format = "%Y-%m-%d %H:%M"
+replay_speed = 60  # how many times faster than real time the replay runs
+
+ingest_chunk_size = 2000  # rows converted and inserted at a time when writing fetched history to stock_data.db
+
+# stock history responses (see history_encoding.py)
+history_chunk_rows = 5000  # bars encoded at a time while streaming a response
+history_gzip_min_bytes = 16384  # responses bigger than this (estimated) are gzipped if the client accepts it
+history_gzip_level = 6  # 1 is fastest, 9 is smallest
+# Cache-Control max-age (seconds) of a history response (see http_caching.py)
+history_immutable_max_age = 365 * 24 * 3600  # ranges that end before the last complete trading day, they never change
+history_recent_max_age = 300  # ranges with the newest bars in them
+
+# charts (see resampling.py)
+resample_cache_size = 512  # (ticker, interval) pairs of weekly/monthly/yearly bars kept in memory
+chart_max_points = 5000  # the most points a chart request can ask for
+
+# technical indicators (see indicators.py)
+indicator_cache_size = 1024  # (ticker, indicator, window) results kept in memory
+indicator_max_window = 1000  # the biggest window an indicator request can ask for
+
+adjusted_cache_size = 256  # tickers whose split and dividend adjusted history is kept in memory (see price_adjustments.py)
+
+batch_max_tickers = 100  # the most tickers one get_current_stock_prices/get_stock_histories request can ask for
 
 
 def getCurrentDate(format):
@@ -6,113 +6,611 @@
 # the context manager(with statement in python) ensures that the data in the database stays correct (can't have it change while in use)
 
 
-import yfinance as yf
-import pandas as pd
 from stockData_manager import stockData_manager
 import constants
 import datetime
+import itertools
+import logging
+import trading_calendar
 from userData_manager import userData_manager
+from quote_cache import quoteCache
+from write_queue import writeQueue
+from single_flight import singleFlight
+from ticker_registry import tickerRegistry
+from price_archive import priceArchive
+from resampling import resampleCache, lttb
+from price_adjustments import adjustmentCache, last_corporate_action
+from leaderboard import leaderboard
+from equity_curve import equityCurve, equityCache, trade_day_numbers
+import indicators
+from price_history_store import priceHistoryStore, price_columns, columns_from_dataframe, columns_from_rows, date_to_day, day_to_date
+from market_data_provider import create_provider
+
+logger = logging.getLogger(__name__)
 
 
 class database_manager:
 
+    # provider is where market data comes from, defaults to the one set in constants.py
+    def __init__(self, provider=None):
+        if provider is None:
+            provider = create_provider()
+        self.provider = provider
+        # everyone ranked by account value, revalued as quotes move (see leaderboard.py)
+        self.leaderboard = leaderboard()
+        # current prices are cached for a short time so every quote/trade doesn't have to go to yahoo
+        self.quote_cache = quoteCache(
+            self.fetch_current_stock_price, fetch_quotes=self.fetch_current_stock_prices, on_price=self.leaderboard.price_changed)
+        # merges concurrent identical upstream requests (history fetches, top ups and quotes) into one
+        self.flights = singleFlight()
+        # which tickers exist (and which recently didn't), so does_ticker_exist is a dictionary lookup
+        self.tickers = tickerRegistry()
+        # price histories of the tickers people are looking at, as numpy arrays
+        self.price_store = priceHistoryStore()
+        # the same histories on disk, memory mapped so every worker process shares one copy
+        self.price_archive = priceArchive()
+        # weekly/monthly/yearly bars for charts
+        self.resampled = resampleCache()
+        # technical indicators (moving averages, rsi, ...)
+        self.indicators = indicators.indicatorCache()
+        # split (and dividend) adjusted copies of the histories, see price_adjustments.py
+        self.adjustments = adjustmentCache()
+        # trades and new accounts are committed to user_data.db in batches (one transaction every few milliseconds)
+        self.user_writes = writeQueue(
+            constants.user_data_database_path, userData_manager)
+        # users' account values over time, extended a day at a time instead of worked out from scratch
+        self.equity_curves = equityCache()
+
+    # applies any pending schema migrations to both databases (creates them if they don't exist yet)
+    # run once when the server starts, so the request handlers never have to run DDL
+    def migrate(self):
+        stockData_manager.migrate_file(constants.stock_data_database_path)
+        userData_manager.migrate_file(constants.user_data_database_path)
+
     # start and end should be datetime objects in format constants.date_format
-    # this method gets the price history for a stock given a start and end date range.
-    # it either pulls from yfinance or accesses a local cache(stock_data)
+    # this method gets the price history for a stock given a start and end date range, as (date, ticker, open, high, low, close, volume, dividends, stock_splits) rows
+    # None if there is no data, adjustment is the same as in get_stock_history_columns
     def get_stock_history_by_ticker(
-        self, ticker, start, end
+        self, ticker, start, end, adjustment="split"
     ):  # start and end in format yyyy-mm-dd ex. 2005-02-08
-        with stockData_manager(
-            constants.stock_data_database_path
-        ) as db:  # begin transaction, close transaction when with is finished. Ensures thread safety as two threads can't both acknowledge that the database is missing data and overwrite each other
-            # check to make sure the end time is not greater or equal to today, this scraper does not provide daily info and there is no such thing as greater than today (hasn't happened)
-            if end >= constants.getCurrentDate(constants.date_format):
-                raise ValueError(
-                    "end date must not be greater than or equal today")
-
-            # if the database is not up to date
-            # if what we are saerching for is newer than what is in the database, try to fill the database with the missing data
-            # assumes that we will have prices for every single day, this is bad because if we don't this will run on each call for a ticker (spamming yahoo), need a fix
-            if not db.getLastDateForTicker(ticker) is None:
-                if end > db.getLastDateForTicker(ticker):
-
-                    # working around bug in yfinance and how it handls yahoo api, see: https://github.com/ranaroussi/yfinance/issues/1272
-                    if db.getLastDateForTicker(ticker) + datetime.timedelta(
-                        days=1
-                    ) != constants.getCurrentDate(
-                        constants.date_format
-                    ) - datetime.timedelta(
-                        days=1
-                    ):
-                        # get the missing data from yfinance (to make our cache/database up to date)
-                        df = yf.Ticker(ticker).history(
-                            start=(
-                                db.getLastDateForTicker(ticker)
-                                + datetime.timedelta(days=1)
-                            ).strftime(constants.date_format),
-                            end=constants.getCurrentDate(
-                                constants.date_format
-                            ).strftime(constants.date_format),
-                            raise_errors=False,
-                        )
-                        num_rows = len(df.index)
-                        # if we got some data
-                        if num_rows > 0:
-                            db.writeManyTickerDataEntry(
-                                self.dump_stockdf_to_list(df, ticker)
-                            )
-
-            # search the database for our ticker
-            data = db.searchForTicker(ticker, start, end)
-
-            # if our search resulted in nothing
-            if len(data) <= 0:
-                # if the end date is less than the last date in the database, assume that it is up to date and there is no data (beacuse we do period="max" when we fetch)
-                if not db.getLastDateForTicker(
-                    ticker
-                ) is None and end < db.getLastDateForTicker(ticker):
-                    return None
-                # get all the avaiable data for a ticker
-                df = yf.Ticker(ticker).history(
-                    period="max", raise_errors=False)
-                num_rows = len(df.index)
-                # if no data for ticker
-                if num_rows <= 0:
-                    return None
-                # write all of the data we retrieved to the database (cache it)
-                db.writeManyTickerDataEntry(
-                    self.dump_stockdf_to_list(df, ticker))
-                # search the database for our data (we just wrote it, so it should be there)
-                data = db.searchForTicker(
-                    ticker, start, end
-                )
-            return data
+        entry = self.get_price_history(ticker, start, end)
+        if entry is None:
+            return None
+        entry = self.adjust(ticker, entry, adjustment)
+        data = entry.rows(ticker, date_to_day(start), date_to_day(end))
+        return data if len(data) > 0 else None
+
+    # same as get_stock_history_by_ticker but as (day numbers, {column: array}) (see history_encoding.py), None if there is no data
+    # the arrays are read only views of the price store's arrays, nothing is copied
+    # fields is the columns to include (all of them by default)
+    # for paging through a long history: limit is the most bars to return, after (a datetime) skips every bar up to and including that date
+    # returns (days, columns, last date) where last date is the date to pass as after for the next page (None if this is the last page)
+    # adjustment is "split" (adjusted for splits, the default), "all" (adjusted for splits and dividends) or "raw" (see price_adjustments.py)
+    def get_stock_history_columns(self, ticker, start, end, fields=None, limit=None, after=None, adjustment="split"):
+        if after is not None:
+            # keyset pagination, the next page starts the day after the last bar we sent
+            start = max(start, after + datetime.timedelta(days=1))
+            if start > end:
+                return None
+        entry = self.get_price_history(ticker, start, end)
+        if entry is None:
+            return None
+        entry = self.adjust(ticker, entry, adjustment)
+        if fields is not None:
+            # the dates always come along (as days), only the price columns are picked
+            fields = [field for field in fields if field in price_columns]
+        # one extra bar tells us if there is another page after this one
+        days, columns = entry.slice(date_to_day(start), date_to_day(
+            end), fields, None if limit is None else limit + 1)
+        if len(days) <= 0:
+            return None
+        if limit is not None and len(days) > limit:
+            days = days[:limit]
+            columns = {column: values[:limit]
+                       for column, values in columns.items()}
+            return days, columns, day_to_date(days[-1])
+        return days, columns, None
+
+    # the history of a ticker from start to end for drawing a chart, as (day numbers, {column: array}) like get_stock_history_columns, None if there is no data
+    # interval is day, week, month or year (see resampling.py), points is the most bars to return (picked with lttb on the close), None for all of them
+    # adjustment is the same as in get_stock_history_columns
+    def get_stock_chart(self, ticker, start, end, interval, points=None, adjustment="split"):
+        entry = self.get_price_history(ticker, start, end)
+        if entry is None:
+            return None
+        entry = self.adjust(ticker, entry, adjustment)
+        lo, hi = entry.find_range(date_to_day(start), date_to_day(end))
+        if hi <= lo:
+            return None
+        if interval == "day":
+            days, columns = entry.slice(date_to_day(start), date_to_day(end))
+        else:
+            days, columns = self.resampled.get(
+                (ticker, adjustment), interval, entry).range(lo, hi)
+        if points is not None and points < len(days):
+            picked = lttb(days, columns["close"], points)
+            days = days[picked]
+            columns = {column: values[picked]
+                       for column, values in columns.items()}
+        return days, columns
+
+    # an indicator (see indicators.py) for a ticker from start to end, as (day numbers, values), None if there is no data
+    # window is the indicator's window (the number of days for sma, ema, rsi and volatility), None for its default
+    # adjustment is the prices it is worked out from, the same as in get_stock_history_columns
+    def get_stock_indicator(self, ticker, start, end, name, window=None, adjustment="split"):
+        entry = self.get_price_history(ticker, start, end)
+        if entry is None:
+            return None
+        entry = self.adjust(ticker, entry, adjustment)
+        lo, hi = entry.find_range(date_to_day(start), date_to_day(end))
+        if hi <= lo:
+            return None
+        if name in indicators.range_indicators:
+            values = indicators.range_indicators[name](
+                entry.columns["close"][lo:hi])
+        else:
+            if window is None:
+                window = indicators.cached_indicators[name][1]
+            values = self.indicators.get(
+                (ticker, adjustment), name, window, entry)[lo:hi]
+        return entry.days[lo:hi], values
+
+    # entry (a priceHistory of the bars as they were on the day) with its prices adjusted the way adjustment asks for (see price_adjustments.py)
+    def adjust(self, ticker, entry, adjustment):
+        if adjustment == "raw":
+            return entry
+        return self.adjustments.get(ticker, entry, adjustment)
+
+    # makes sure we have the price history for a ticker from start to end and returns its priceHistory (see price_history_store.py)
+    # it either pulls from the market data provider (yfinance) or accesses a local cache(stock_data)
+    # stock_coverage remembers which dates we have already fetched, so a range we have fetched before is answered from sqlite even if it has no bars in it (weekends, holidays, delisted gaps)
+    # None if the ticker has no data at all
+    def get_price_history(self, ticker, start, end):
+        today = self.provider.today()
+        # check to make sure the end time is not greater or equal to today, this scraper does not provide daily info and there is no such thing as greater than today (hasn't happened)
+        if end >= today:
+            raise ValueError(
+                "end date must not be greater than or equal today")
+        earliest = datetime.datetime.strptime(
+            constants.earliest_date, constants.date_format)
+        start = max(start, earliest)
+        yesterday = today - datetime.timedelta(days=1)
+
+        # most requests are for data we already have, answer those from a plain read transaction
+        with stockData_manager(constants.stock_data_database_path) as db:
+            coverage = db.getCoverage(ticker)
+            raw = db.isTickerRaw(ticker)
+            missing = [
+                (gap_start, gap_end)
+                for gap_start, gap_end in self.find_missing_ranges(coverage, start, end)
+                # a gap with no trading days in it has nothing to fetch
+                if trading_calendar.has_trading_day(gap_start, gap_end)
+            ]
+            if len(coverage) > 0 and len(missing) <= 0:
+                return self.read_stock_history(db, ticker, start, end, coverage)
+
+        if len(coverage) <= 0:
+            # we have never fetched this ticker, get all the avaiable data for it
+            # if no data for ticker
+            if self.fetch_full_stock_history(ticker) <= 0:
+                return None
+        elif not raw:
+            # bars from before we stored unadjusted prices, replace all of them (once) instead of adding unadjusted bars on to the end of adjusted ones
+            self.flights.do(("history", ticker, "max"), lambda: self.fetch_stock_history(
+                ticker, earliest, yesterday, replace=True, period="max"))
+        else:
+            # fetch whatever we are missing (everyone asking for the same range at the same time shares one request)
+            covered_through = max(coverage_end for coverage_start,
+                                  coverage_end in coverage)
+            for gap_start, gap_end in missing:
+                # if we are behind, catch up all the way to yesterday so the next requests don't need another top up
+                if gap_end > covered_through:
+                    gap_end = yesterday
+                self.flights.do(("history", ticker, gap_start, gap_end), lambda: self.fetch_stock_history(
+                    ticker, gap_start, gap_end))
+
+        # search for our data (we just wrote it, so it should be there)
+        with stockData_manager(constants.stock_data_database_path) as db:
+            return self.read_stock_history(db, ticker, start, end, db.getCoverage(ticker))
+
+    # get_stock_history_columns (the whole range, no paging) for several tickers, returns {ticker: (days, columns), None if there is no data or the Exception it failed with}
+    # the tickers that need data from the provider get it in as few requests as possible first (see prefetch_stock_histories)
+    def get_stock_histories(self, tickers, start, end, fields=None, adjustment="split"):
+        if end >= self.provider.today():
+            raise ValueError(
+                "end date must not be greater than or equal today")
+        try:
+            self.prefetch_stock_histories(tickers, start, end)
+        except Exception as e:
+            # nothing lost, each ticker fetches whatever it is still missing on its own below
+            logger.warning("failed to fetch histories for %s: %s", ",".join(tickers), e)
+        histories = {}
+        for ticker in tickers:
+            try:
+                page = self.get_stock_history_columns(
+                    ticker, start, end, fields, adjustment=adjustment)
+                histories[ticker] = None if page is None else page[:2]
+            except Exception as e:
+                histories[ticker] = e
+        return histories
+
+    # fetches what several tickers are missing from start to end, one provider request per group of tickers that are missing the same thing:
+    # tickers we have never fetched (everything), and tickers that are only missing their newest bars from the same day on (the usual case, topping up once a day)
+    # anything else (a gap in the middle of a history, a ticker from before we stored unadjusted bars) is left for get_price_history to fetch on its own
+    def prefetch_stock_histories(self, tickers, start, end):
+        earliest = datetime.datetime.strptime(
+            constants.earliest_date, constants.date_format)
+        start = max(start, earliest)
+        yesterday = self.provider.today() - datetime.timedelta(days=1)
+
+        new = []
+        behind = {}  # first missing day -> tickers missing everything from then on
+        with stockData_manager(constants.stock_data_database_path) as db:
+            for ticker in tickers:
+                coverage = db.getCoverage(ticker)
+                if len(coverage) <= 0:
+                    if self.tickers.lookup(ticker) is not False:
+                        new.append(ticker)
+                    continue
+                if not db.isTickerRaw(ticker):
+                    continue
+                missing = [
+                    (gap_start, gap_end)
+                    for gap_start, gap_end in self.find_missing_ranges(coverage, start, end)
+                    if trading_calendar.has_trading_day(gap_start, gap_end)
+                ]
+                covered_through = max(coverage_end for coverage_start,
+                                      coverage_end in coverage)
+                if len(missing) == 1 and missing[0][0] == covered_through + datetime.timedelta(days=1):
+                    behind.setdefault(missing[0][0], []).append(ticker)
+
+        if len(new) > 0:
+            num_rows = self.flights.do(("histories", tuple(new), "max"), lambda: self.fetch_stock_histories(
+                new, earliest, yesterday, period="max"))
+            for ticker in new:
+                if num_rows[ticker] <= 0:
+                    self.tickers.mark_invalid(ticker)
+        for gap_start, group in behind.items():
+            self.flights.do(("histories", tuple(group), gap_start, yesterday), lambda: self.fetch_stock_histories(
+                group, gap_start, yesterday))
+
+    # the date we have a ticker's bars up to (capped at end), None if we don't know the ticker
+    # only looks at memory (the price store and the ticker registry), so the rest server can use it to answer conditional requests without the database
+    def ingested_through(self, ticker, end):
+        self.tickers.load_once(self.load_known_tickers)
+        through = None
+        entry = self.price_store.get(ticker)
+        if entry is not None:
+            through = day_to_date(entry.loaded_through)
+        known = self.tickers.get(ticker)
+        if known is not None:
+            last_date = datetime.datetime.strptime(
+                known[1], constants.date_format)
+            through = last_date if through is None else max(through, last_date)
+        return None if through is None else min(end, through)
+
+    # what the ETag of a history style response for a range ending on end depends on (see http_caching.py), worked out without the database
+    # returns (the date of the last bar we have in the range, True if nothing new can show up in the response, the day number of the last split or dividend or None)
+    # an adjusted response (any adjustment but "raw") also changes when a new corporate action comes in, so it is only complete once we have every bar up to the last complete trading day
+    # None if we don't know the ticker yet (or, for adjusted, don't have its bars in memory or the archive)
+    def history_validator(self, ticker, end, adjustment="split"):
+        through = self.ingested_through(ticker, end)
+        if through is None:
+            return None
+        if adjustment == "raw":
+            return through, through >= end, None
+        entry = self.price_store.get(ticker)
+        if entry is None:
+            entry = self.price_archive.read(ticker)
+            if entry is None:
+                return None
+        last_complete = trading_calendar.last_complete_trading_day(
+            self.provider.today())
+        complete = through >= end and trading_calendar.to_date(
+            day_to_date(entry.loaded_through)) >= last_complete
+        return through, complete, last_corporate_action(entry.days, entry.columns)
+
+    # returns the priceHistory of a ticker we have fetched, with every bar up to end in it
+    # answered from the in memory price store, which maps the ticker from the price archive (or loads it from the database (db, inside the caller's transaction)) the first time
+    # and picks up any newer bars (i.e written by another worker process) once the request goes past what it has
+    def read_stock_history(self, db, ticker, start, end, coverage):
+        covered_through = date_to_day(max(coverage_end for coverage_start,
+                                          coverage_end in coverage))
+        needed_through = min(date_to_day(end), covered_through)
+
+        entry = self.price_store.get(ticker)
+        if entry is None or entry.loaded_through < needed_through:
+            # another process may have archived newer bars than we have
+            archived = self.price_archive.read(ticker)
+            if archived is not None and archived.loaded_through >= needed_through:
+                entry = self.price_store.put(
+                    ticker, archived.days, archived.columns, archived.loaded_through, mapped=True)
+            elif archived is None and entry is None:
+                # never archived (i.e a database from before the archive), archive what we load so the other processes can map it
+                days, columns = columns_from_rows(db.getTickerRows(ticker))
+                self.publish_archive(ticker, days, columns, covered_through)
+                entry = self.price_store.put(
+                    ticker, days, columns, covered_through)
+        if entry is not None and entry.loaded_through < needed_through:
+            last_day = entry.last_day()
+            after = None if last_day is None else day_to_date(last_day)
+            days, columns = columns_from_rows(db.getTickerRows(ticker, after))
+            entry = self.price_store.extend(
+                ticker, days, columns, entry.loaded_through + 1, covered_through)
+        if entry is None:
+            days, columns = columns_from_rows(db.getTickerRows(ticker))
+            entry = self.price_store.put(
+                ticker, days, columns, covered_through)
+        return entry
+
+    # gets all the avaiable data for a ticker we have never fetched before, returns how many bars there were
+    # one request no matter how many people are waiting on it, and a ticker with no data is remembered as invalid so we don't keep asking
+    # (if the provider couldn't be asked it raises marketDataUnavailable instead, which isn't remembered, the next request asks again)
+    def fetch_full_stock_history(self, ticker):
+        if self.tickers.lookup(ticker) is False:
+            return 0
+        yesterday = self.provider.today() - datetime.timedelta(days=1)
+        num_rows = self.flights.do(("history", ticker, "max"), lambda: self.fetch_stock_history(
+            ticker, datetime.datetime.strptime(constants.earliest_date, constants.date_format), yesterday, period="max"))
+        if num_rows <= 0:
+            self.tickers.mark_invalid(ticker)
+        return num_rows
+
+    # returns the parts of start to end (both inclusive) that aren't in coverage (a sorted list of (start, end) ranges from getCoverage)
+    def find_missing_ranges(self, coverage, start, end):
+        missing = []
+        for coverage_start, coverage_end in coverage:
+            if coverage_end < start:
+                continue
+            if coverage_start > end:
+                break
+            if coverage_start > start:
+                missing.append(
+                    (start, coverage_start - datetime.timedelta(days=1)))
+            start = coverage_end + datetime.timedelta(days=1)
+            if start > end:
+                return missing
+        missing.append((start, end))
+        return missing
+
+    # gets the price history from start to end (both inclusive) from the market data provider and writes it to the database (cache it)
+    # kwargs are passed to the provider's get_history instead of start/end (i.e period="max")
+    # replace=True deletes the bars we had for the ticker first
+    # the range is recorded in stock_coverage even if there were no bars, so we never ask for it again
+    # the request happens outside of any transaction, only the write takes the write lock
+    # returns how many rows the provider gave us
+    def fetch_stock_history(self, ticker, start, end, replace=False, **kwargs):
+        if len(kwargs) <= 0:
+            kwargs = self.history_request(start, end)
+        df = self.provider.get_history(ticker, **kwargs)
+        return self.save_stock_history(ticker, df, start, end, replace, "period" in kwargs)
+
+    # same as fetch_stock_history for several tickers, with one request to the provider for all of them
+    # returns {ticker: how many rows the provider gave us}
+    def fetch_stock_histories(self, tickers, start, end, **kwargs):
+        if len(kwargs) <= 0:
+            kwargs = self.history_request(start, end)
+        histories = self.provider.get_histories(tickers, **kwargs)
+        return {ticker: self.save_stock_history(ticker, histories[ticker], start, end, full="period" in kwargs) for ticker in tickers}
+
+    # the start/end arguments to ask the provider for start to end (both inclusive)
+    # the request always runs up to today (the bars after end are dropped when we write them): yahoo's prices are adjusted for every split up to today,
+    # and the provider can only put them back to what they were on the day for the splits it sees (see yfinanceProvider.undo_split_adjustment)
+    def history_request(self, start, end):
+        fetch_start = start
+        fetch_end = max(end, self.provider.today())
+        # working around bug in yfinance and how it handls yahoo api, see: https://github.com/ranaroussi/yfinance/issues/1272
+        # (asking for a single day fails, so ask for one more, the day we already have is ignored when we write)
+        if fetch_start == fetch_end:
+            fetch_start -= datetime.timedelta(days=1)
+        return {
+            "start": fetch_start.strftime(constants.date_format),
+            # the provider's end is exclusive
+            "end": (fetch_end + datetime.timedelta(days=1)).strftime(constants.date_format),
+        }
+
+    # writes a history the provider gave us for start to end to the database, the price archive and the price store
+    # full is True if it was asked for with period= (everything the provider has), an empty one of those isn't remembered
+    # returns how many rows there were
+    def save_stock_history(self, ticker, df, start, end, replace=False, full=False):
+        if len(df.index) > 0:
+            # today's bar is still changing, only keep bars up to the end of our range
+            df = df[df.index.strftime(constants.date_format)
+                    <= end.strftime(constants.date_format)]
+            df = self.drop_incomplete_bars(df)
+        num_rows = len(df.index)
+        if num_rows <= 0 and full:
+            # nothing at all for this ticker, there is nothing to remember
+            return 0
 
+        days, columns = columns_from_dataframe(
+            df) if num_rows > 0 else columns_from_rows([])
+        # new daily bars go on to the end of the archive's current version, that version is written before we take the write lock
+        prepared = None
+        if not replace:
+            try:
+                prepared = self.price_archive.prepare_append(
+                    ticker, days, columns, date_to_day(start), date_to_day(end))
+            except OSError as e:
+                logger.warning("failed to archive %s: %s", ticker, e)
+        with stockData_manager(constants.stock_data_database_path, immediate=True) as db:
+            if replace:
+                db.replaceTickerData(ticker)
+            # an empty history (i.e yfinance's empty frame for a range with no bars) may not even have all of the columns, there is nothing to write but the coverage
+            if num_rows > 0:
+                for rows in self.iter_stockdf_chunks(df, ticker):
+                    db.writeManyTickerDataEntry(rows)
+            db.addCoverage(ticker, start, end)
+            if num_rows > 0:
+                first_date = df.index.min().strftime(constants.date_format)
+                last_date = df.index.max().strftime(constants.date_format)
+                db.addKnownTicker(ticker, first_date, last_date)
+            # swap the archive over while we still hold the write lock, so its versions go in the same order as the writes
+            # anything that can't be appended (the first fetch, a gap in the middle, replacing the bars, or another write got in first) rebuilds it from the database,
+            # that has to see our own rows so it is written here (it is rare, every daily top up is an append)
+            try:
+                appended = prepared is not None and self.price_archive.commit_append(
+                    ticker, prepared)
+            except OSError as e:
+                logger.warning("failed to archive %s: %s", ticker, e)
+                appended = False
+            if not appended:
+                all_days, all_columns = columns_from_rows(
+                    db.getTickerRows(ticker))
+                self.publish_archive(ticker, all_days, all_columns, date_to_day(
+                    max(coverage_end for coverage_start, coverage_end in db.getCoverage(ticker))))
+        if num_rows > 0:
+            self.tickers.add(ticker, first_date, last_date)
+        # swap the price store over to the new version (it is mapped, so this doesn't copy anything)
+        archived = self.price_archive.read(ticker)
+        if archived is not None:
+            self.price_store.put(ticker, archived.days, archived.columns,
+                                 archived.loaded_through, mapped=True)
+        else:
+            self.price_store.extend(ticker, days, columns,
+                                    date_to_day(start), date_to_day(end))
+        return num_rows
+
+    # writes a ticker's history to the price archive
+    # the archive is only a copy of the database, if it can't be written (i.e the disk is full) we keep going and the price store falls back to reading the database
+    def publish_archive(self, ticker, days, columns, loaded_through):
+        try:
+            self.price_archive.publish(ticker, days, columns, loaded_through)
+        except OSError as e:
+            logger.warning("failed to archive %s: %s", ticker, e)
 
     # wraps the userData buy_stock method and also provides it with the current market value of the stock you're buying
     def buy_stock(self, id, ticker, amount):
+        intent = self.prepare_buy_stock(id, ticker, amount)
+        if intent is None:
+            return None
+        return self.user_writes.submit(intent).result()
+
+    # everything a buy needs before it writes: returns the write (an intent for the write queue, see write_queue.py), None if the ticker doesn't exist
+    # the price is fetched here, before the write, so other traders aren't stuck waiting on our yahoo request
+    def prepare_buy_stock(self, id, ticker, amount):
         if (not self.does_ticker_exist(ticker)):
             return None
-        with userData_manager(constants.user_data_database_path) as db:
-            return db.buy_stock(id, ticker, amount, self.get_current_stock_price(ticker))
+        stockPrice = self.get_current_stock_price(ticker, allow_stale=False)
+        return lambda db: db.buy_stock(id, ticker, amount, stockPrice)
+
     # wraps the userData sell_stock method and provides it with the current market value of the stock you're selling
     def sell_stock(self, id, ticker, amount):
+        intent = self.prepare_sell_stock(id, ticker, amount)
+        if intent is None:
+            return None
+        return self.user_writes.submit(intent).result()
+
+    # same as prepare_buy_stock for a sell
+    def prepare_sell_stock(self, id, ticker, amount):
         if (not self.does_ticker_exist(ticker)):
             return None
+        stockPrice = self.get_current_stock_price(ticker, allow_stale=False)
+        return lambda db: db.sell_stock(id, ticker, stockPrice, amount)
+
+    # wraps the userData get_user_trades method, time in the rows is a datetime
+    def get_user_trades(self, id, after=0, limit=None):
+        with userData_manager(constants.user_data_database_path) as db:
+            trades = db.get_user_trades(id, after, limit)
+        if trades is None:
+            return None
+        return [(trade_id, datetime.datetime.fromtimestamp(time / 1000), ticker, amount, price)
+                for trade_id, time, ticker, amount, price in trades]
+
+    # wraps the userData get_user_state_at method, at is a datetime
+    def get_user_state_at(self, id, at):
         with userData_manager(constants.user_data_database_path) as db:
-            return db.sell_stock(id, ticker, self.get_current_stock_price(ticker), amount)
+            return db.get_user_state_at(id, int(at.timestamp() * 1000))
+
+    # a user's account value at the close of every trading day from when their ledger starts to the last complete trading day
+    # returns (days, values, cash) (days are day numbers, cash is what part of the value was cash), None if the user doesn't exist
+    # trades made today show up once today is a complete trading day
+    def get_user_equity_curve(self, id):
+        yesterday = self.provider.today() - datetime.timedelta(days=1)
+        curve = self.equity_curves.get(id)
+        with userData_manager(constants.user_data_database_path) as db:
+            ledger = db.get_user_ledger(
+                id, 0 if curve is None else curve.last_trade_id)
+            # a new trade dated on a day the curve already has (i.e the server clock went back) means the curve is wrong, start over
+            if ledger is not None and curve is not None and len(ledger[1]) > 0 and \
+                    trade_day_numbers([ledger[1][0][1]])[0] <= curve.last_day():
+                curve = None
+                ledger = db.get_user_ledger(id)
+        if ledger is None:
+            return None
+        (start_time, balance, positions), trades = ledger
+
+        how = "extend"
+        if curve is None:
+            how = "miss"
+            curve = equityCurve(int(trade_day_numbers([start_time])[0]), balance, positions)
+        days = trading_calendar.trading_days(
+            day_to_date(curve.last_day() + 1), yesterday)
+        if len(days) <= 0:
+            how = "hit" if how == "extend" else how
+        else:
+            start = day_to_date(curve.start_day)
+            histories = {}
+            for ticker in curve.tickers_for(trades):
+                try:
+                    histories[ticker] = self.get_price_history(
+                        ticker, start, yesterday)
+                except Exception as e:
+                    # valued at the price it last traded at instead
+                    logger.warning("equity curve couldn't get history for %s: %s", ticker, e)
+                    histories[ticker] = None
+            curve = curve.extend(days, trades, histories)
+        self.equity_curves.put(id, curve, how)
+        return curve.days, curve.values, curve.cash
+
+    # brings the leaderboard up to date: rebuilt from user_data.db the first time and every leaderboard_resync_interval seconds, otherwise just the new users and trades are added
+    # then makes sure it has the current price of everything people hold (only the holders of a ticker whose price moved are revalued)
+    # the username of id is looked up in the same transaction and returned (None if id is None or doesn't exist)
+    def refresh_leaderboard(self, id=None):
+        with userData_manager(constants.user_data_database_path) as db:
+            if self.leaderboard.needs_resync():
+                self.leaderboard.load(*db.get_leaderboard_state())
+            else:
+                self.leaderboard.apply_changes(
+                    *db.get_leaderboard_changes(*self.leaderboard.position()))
+            username = None if id is None else db.get_user_from_id(id)
+        self.leaderboard.prices_changed(
+            self.get_current_stock_prices(self.leaderboard.tickers()))
+        return username
+
+    # up to count (rank, username, value) of the leaderboard starting at rank start + 1, and how many users there are
+    def get_leaderboard(self, start, count):
+        self.refresh_leaderboard()
+        return self.leaderboard.top(start, count), self.leaderboard.size()
+
+    # (rank, value) of a user on the leaderboard and how many users there are, None if the user doesn't exist
+    def get_user_rank(self, id):
+        username = self.refresh_leaderboard(id)
+        rank = None if username is None else self.leaderboard.rank_of(username)
+        if rank is None:
+            return None
+        return rank, self.leaderboard.size()
+
     # wraps the userData get_user_ticker_data method
     def get_user_ticker_data(self, id):
         with userData_manager(constants.user_data_database_path) as db:
             return db.get_user_ticker_data(id)
-    # returns the current stock price of a given ticker
-    def get_current_stock_price(self, ticker):
-        # implement this in a cached way!!!!!
-        df = yf.Ticker(ticker).history(period='1d')  # ['Close'][0]
-        num_rows = len(df.index)
-        if num_rows <= 0:
-            return None
-        return df['Close'][0]
+    # returns the current stock price of a given ticker (cached, see quote_cache.py)
+    # allow_stale=False never returns a price past the cache's ttl, trades use it so they aren't filled at a price that is minutes old
+    def get_current_stock_price(self, ticker, allow_stale=True):
+        return self.quote_cache.get(ticker, allow_stale)
+
+    # gets the current stock price of a given ticker from the market data provider (what the quote cache calls when it needs a fresh price)
+    def fetch_current_stock_price(self, ticker):
+        return self.flights.do(("quote", ticker), lambda: self.provider.get_current_price(ticker))
+
+    # returns {ticker: price or None} for several tickers (cached, see quote_cache.get_many), a ticker whose price couldn't be fetched is left out
+    def get_current_stock_prices(self, tickers):
+        return self.quote_cache.get_many(tickers)
+
+    # gets the current prices of several tickers from the market data provider in one request (what the quote cache calls for the ones it doesn't have)
+    def fetch_current_stock_prices(self, tickers):
+        return self.flights.do(("quotes", tuple(tickers)), lambda: self.provider.get_current_prices(tickers))
     # wraps the userData get_suer_balance method
     def get_user_balance(self, id):
         with userData_manager(constants.user_data_database_path) as db:
@@ -120,10 +618,26 @@ class database_manager:
 
     # checks if a given ticker exists
     # useful to run before we do anything with tickers so ensure that there will be data for them
+    # known (and recently invalid) tickers are answered from memory, only a ticker we have never seen goes to the database or the market data provider
     def does_ticker_exist(self, ticker):
-        if (self.get_stock_history_by_ticker(ticker, start=datetime.datetime.strptime("1800-01-01", constants.date_format), end=(constants.getCurrentDate(constants.date_format) - datetime.timedelta(days=1))) is None):
-            return False
-        return True
+        self.tickers.load_once(self.load_known_tickers)
+        exists = self.tickers.lookup(ticker)
+        if exists is not None:
+            return exists
+
+        # another worker process may have fetched it since we loaded the registry
+        with stockData_manager(constants.stock_data_database_path) as db:
+            known = db.getKnownTicker(ticker)
+        if known is not None:
+            self.tickers.add(ticker, known[0], known[1])
+            return True
+
+        return self.fetch_full_stock_history(ticker) > 0
+
+    # every ticker in known_tickers, used to fill the ticker registry
+    def load_known_tickers(self):
+        with stockData_manager(constants.stock_data_database_path) as db:
+            return db.getKnownTickers()
 
     # wraps the userData login_user method
     def login_user(self, username, password):
@@ -132,26 +646,40 @@ class database_manager:
     # wraps the userData creater_user method
 
     def create_user(self, username, password):
-        with userData_manager(constants.user_data_database_path) as db:
-            return db.create_user(username, password)
+        return self.user_writes.submit(lambda db: db.create_user(username, password)).result()
+
+    # yahoo sometimes sends a bar with no prices (NaN), sqlite would store those as NULL (which stock_data doesn't allow) while the price store would keep the NaN
+    # so the database, the archive and the price store all get the same bars, those are dropped here first
+    # a missing volume, dividend or split just means there wasn't one (0)
+    def drop_incomplete_bars(self, df):
+        df = df.dropna(subset=["Open", "High", "Low", "Close"])
+        return df.fillna({"Volume": 0.0, "Dividends": 0.0, "Stock Splits": 0.0})
 
     # the yfinance library returns a pandas dataframe, before putting it in the database we need to convert it to a list
-    # this loops through the dataframe and just transfers all of the data into a python list aka an array
+    # this transfers all of the data into a python list aka an array of (date, ticker, open, high, low, close, volume, dividends, stock_splits) tuples
     def dump_stockdf_to_list(self, df, ticker):
+        values = []
+        for chunk in self.iter_stockdf_chunks(df, ticker):
+            values.extend(chunk)
+        return values
 
-        values = [
-            (
-                pd.Timestamp(index).strftime(constants.date_format),
-                ticker,
-                row["Open"],
-                row["High"],
-                row["Low"],
-                row["Close"],
-                row["Volume"],
-                row["Dividends"],
-                row["Stock Splits"],
-            )
-            for index, row in df.iterrows()
-        ]
+    # same rows as dump_stockdf_to_list, but handed out chunk_size rows at a time (see iter_stockdf_chunks below)
+    def iter_stockdf_chunks(self, df, ticker, chunk_size=constants.ingest_chunk_size):
+        return iter_stockdf_chunks(df, ticker, chunk_size)
 
-        return values
+
+# the rows of a yfinance dataframe as (date, ticker, open, high, low, close, volume, dividends, stock_splits) tuples, chunk_size rows at a time so a huge history never has to be converted all at once
+# works on whole columns instead of looping over df.iterrows() (which builds a pandas Series for every single row)
+# a plain function (no database_manager needed) so benchmark_ingest.py can time it on its own
+def iter_stockdf_chunks(df, ticker, chunk_size=constants.ingest_chunk_size):
+    dates = df.index
+    columns = [df[column].to_numpy() for column in ["Open", "High",
+                                                    "Low", "Close", "Volume", "Dividends", "Stock Splits"]]
+    for chunk_start in range(0, len(dates), chunk_size):
+        chunk_end = chunk_start + chunk_size
+        # tolist() turns the numpy values into plain python numbers (which is what sqlite3 knows how to store)
+        yield list(zip(
+            dates[chunk_start:chunk_end].strftime(constants.date_format),
+            itertools.repeat(ticker),
+            *[column[chunk_start:chunk_end].tolist() for column in columns],
+        ))
@@ -15,8 +15,8 @@ def __dump_database_to_csv(database_path):
     conn = sqlite3.connect(database_path)
     c = conn.cursor()
 
-    # Get all table names
-    c.execute("SELECT name FROM sqlite_master WHERE type='table';")
+    # Get all table names (and views, stock_history shows stock_data with readable dates and tickers)
+    c.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view');")
     table_names = [x[0] for x in c.fetchall()]
 
     # go through each table and write each row into a csv file
@@ -0,0 +1,149 @@
+# a user's account value (cash + their shares at each day's close) for every trading day since their ledger starts (see userData_manager.py)
+# worked out with numpy from the ledger and the price store's closes instead of a query per day:
+#   positions[d, t] = shares of ticker t at the end of day d (the starting positions + the cumsum of the trades up to day d)
+#   cash[d] = the starting balance + the cumsum of what the trades paid/cost
+#   value[d] = cash[d] + the sum over t of positions[d, t] * close[d, t] (close is the last close on or before day d)
+# curves are cached per user and extended as new trading days (and the trades made on them) come in, only the new days are worked out
+
+import datetime
+import threading
+from collections import OrderedDict
+import numpy as np
+import constants
+from price_history_store import date_to_day
+
+
+# the day number each trade time (unix milliseconds, server time) falls on
+def trade_day_numbers(times):
+    return np.array([date_to_day(datetime.datetime.fromtimestamp(time / 1000)) for time in times], dtype=np.int64)
+
+
+# the close of every ticker on every day (a row per day, a column per ticker), the last close on or before the day
+# histories[t] is the priceHistory of ticker t, None if we have none (then it is worth fallback[t], the price it last traded at)
+def close_matrix(days, histories, fallback):
+    closes = np.empty((len(days), len(histories)))
+    for t, history in enumerate(histories):
+        if history is None or len(history.days) <= 0:
+            closes[:, t] = fallback[t]
+            continue
+        index = np.searchsorted(history.days, days, side="right") - 1
+        # a day before the ticker's first bar gets its first close
+        closes[:, t] = history.columns["close"][np.maximum(index, 0)]
+    return closes
+
+
+# a user's curve up to the last day worked out, never changed once made (extend returns a new one) so requests can share it without a lock
+class equityCurve:
+
+    # start_day is the day the ledger starts, balance and positions ({ticker: amount}) are what the user had then
+    def __init__(self, start_day, balance, positions):
+        self.start_day = start_day
+        self.days = np.empty(0, dtype=np.int32)
+        self.values = np.empty(0)
+        self.cash = np.empty(0)
+        self.tickers = list(positions)  # the order of the position columns
+        self.positions = np.array([positions[ticker] for ticker in self.tickers], dtype=np.float64)  # at the end of the last day
+        self.balance = balance  # cash at the end of the last day
+        self.last_trade_id = 0  # the last trade included
+        self.last_prices = {}  # ticker -> the price it last traded at
+
+    # the last day worked out (the day before the ledger starts if there are none yet)
+    def last_day(self):
+        return int(self.days[-1]) if len(self.days) > 0 else self.start_day - 1
+
+    # the tickers the curve needs closes for to take these trades
+    def tickers_for(self, trades):
+        return list(dict.fromkeys(self.tickers + [trade[2] for trade in trades]))
+
+    # returns a new curve with days (trading days after last_day) added
+    # trades are the ledger's (trade id, time, ticker, amount, price) rows after last_trade_id, only the ones up to the last of the days are taken
+    # (later ones, i.e made today, are left for the next extend), histories is {ticker: priceHistory or None} for tickers_for(trades)
+    def extend(self, days, trades, histories):
+        curve = equityCurve.__new__(equityCurve)
+        curve.__dict__.update(self.__dict__)
+        curve.tickers = list(self.tickers)
+        curve.last_prices = dict(self.last_prices)
+        if len(days) <= 0:
+            return curve
+
+        trade_days = trade_day_numbers([trade[1] for trade in trades])
+        later = np.flatnonzero(trade_days > days[-1])
+        num_trades = later[0] if len(later) > 0 else len(trades)
+        trades = trades[:num_trades]
+        trade_days = trade_days[:num_trades]
+
+        for trade in trades:
+            if trade[2] not in curve.tickers:
+                curve.tickers.append(trade[2])
+            curve.last_prices[trade[2]] = trade[4]
+        positions = np.append(self.positions, np.zeros(
+            len(curve.tickers) - len(self.tickers)))
+
+        # the row (day) and column (ticker) of every trade, a trade on a day the market was closed counts from the next trading day
+        rows = np.searchsorted(days, trade_days, side="left")
+        columns = np.array([curve.tickers.index(trade[2]) for trade in trades], dtype=np.int64)
+        amounts = np.array([trade[3] for trade in trades], dtype=np.float64)
+        prices = np.array([trade[4] for trade in trades], dtype=np.float64)
+
+        changes = np.zeros((len(days), len(curve.tickers)))
+        np.add.at(changes, (rows, columns), amounts)
+        daily_positions = positions + np.cumsum(changes, axis=0)
+        cash_changes = np.zeros(len(days))
+        np.add.at(cash_changes, rows, -amounts * prices)
+        daily_cash = self.balance + np.cumsum(cash_changes)
+
+        closes = close_matrix(days, [histories.get(ticker) for ticker in curve.tickers],
+                              [curve.last_prices.get(ticker, 0.0) for ticker in curve.tickers])
+        values = daily_cash + (daily_positions * closes).sum(axis=1)
+
+        curve.days = np.concatenate([self.days, np.asarray(days, dtype=np.int32)])
+        curve.values = np.concatenate([self.values, values])
+        curve.cash = np.concatenate([self.cash, daily_cash])
+        curve.positions = daily_positions[-1]
+        curve.balance = daily_cash[-1]
+        if len(trades) > 0:
+            curve.last_trade_id = trades[-1][0]
+        return curve
+
+
+class equityCache:
+
+    def __init__(self, max_size=constants.equity_cache_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # user id -> equityCurve, least recently used first
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.extends = 0
+        self.misses = 0
+
+    # the cached curve of a user, None if we don't have one
+    def get(self, id):
+        with self.lock:
+            curve = self.entries.get(id)
+            if curve is not None:
+                self.entries.move_to_end(id)
+            return curve
+
+    # stores a user's curve, how is "hit", "extend" or "miss" (how we got it, for the stats)
+    def put(self, id, curve, how):
+        with self.lock:
+            if how == "hit":
+                self.hits += 1
+            elif how == "extend":
+                self.extends += 1
+            else:
+                self.misses += 1
+            self.entries[id] = curve
+            self.entries.move_to_end(id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "extends": self.extends,
+                "misses": self.misses,
+            }
@@ -0,0 +1,203 @@
+# turns a stock history (day numbers and price columns, see database_manager.get_stock_history_columns) into a response body
+# the body is built chunk_rows bars at a time by a generator (the rest server streams it), so a 40 year history never sits in memory as one big string
+#
+# formats:
+#   rows     the original {"valid": "true", "<TICKER>": [[date, ticker, open, high, low, close, volume, dividends, stock_splits], ...]}
+#            (what the java REST_client reads, so it stays the default)
+#   columns  {"valid": "true", "<TICKER>": {"date": [...], "open": [...], ...}}, the ticker and the column names are only sent once
+#   binary   little endian: uint32 number of bars, uint8 number of arrays, then for each array:
+#            uint8 name length, the name (utf-8), a type character ("i" int32 or "d" float64), uint32 length in bytes, the array
+#            the first array is "day" (days since 1970-01-01), then one per price column
+#
+# fields=date,close style projection picks which of the columns are sent (rows then only has those, and no ticker)
+# a long history can be sent in pages, the json formats end with "next_cursor" when there is another page (see rest.py)
+#
+# any of them can be gzipped as it streams (see gzip_chunks)
+#
+# encode_histories sends several tickers at once (the batch endpoint), each one as a columns object with its own status
+
+import itertools
+import json
+import struct
+import zlib
+import numpy as np
+import constants
+from price_history_store import price_columns, days_to_strings, column_to_python
+
+formats = ["rows", "columns", "binary"]
+media_types = {
+    "rows": "application/json",
+    "columns": "application/json",
+    "binary": "application/octet-stream",
+}
+
+
+# picks the format for a request, the format url parameter wins, otherwise an Accept header asking for octet-stream gets binary
+# returns None for a format we don't know
+def choose_format(format, accept):
+    if format is not None:
+        return format if format in formats else None
+    if accept is not None and "application/octet-stream" in accept:
+        return "binary"
+    return "rows"
+
+
+# true if the client said it can take a gzipped body
+def accepts_gzip(accept_encoding):
+    if accept_encoding is None:
+        return False
+    for encoding in accept_encoding.lower().split(","):
+        name, _, params = encoding.partition(";")
+        if name.strip() == "gzip":
+            # gzip;q=0 means "anything but gzip"
+            params = params.replace(" ", "")
+            if params.startswith("q="):
+                try:
+                    return float(params[2:]) > 0
+                except ValueError:
+                    return False
+            return True
+    return False
+
+
+# turns the fields url parameter (i.e "date,close") into a list of fields, None if it names a field we don't have
+# fields are sent in the order they are asked for
+def parse_fields(text):
+    fields = [field.strip() for field in text.split(",") if field.strip() != ""]
+    if len(fields) <= 0 or len(set(fields)) != len(fields):
+        return None
+    for field in fields:
+        if field != "date" and field not in price_columns:
+            return None
+    return fields
+
+
+# roughly how big the (uncompressed) body will be, used to decide whether it is worth gzipping
+def estimate_size(format, num_rows, fields=None):
+    num_fields = len(price_columns) + 1 if fields is None else len(fields)
+    if format == "binary":
+        return num_rows * 8 * num_fields
+    if format == "columns":
+        return num_rows * 10 * num_fields
+    return num_rows * 12 * (num_fields + 1)
+
+
+# returns a generator of the body's bytes, history is (days, columns) or None (no data)
+# fields is what parse_fields returned, None sends every field the way the format always has (rows also has the ticker in every row then)
+# next_cursor is added to the json formats when there is another page (the rest server also sends it as a header, which is the only place binary has it)
+def encode_history(format, ticker, history, fields=None, next_cursor=None, chunk_rows=constants.history_chunk_rows):
+    if format == "binary":
+        return encode_binary(history, fields)
+    if format == "columns":
+        return encode_columns(ticker, history, fields, next_cursor, chunk_rows)
+    return encode_rows(ticker, history, fields, next_cursor, chunk_rows)
+
+
+# the body starts with this in both json formats (json.dumps so a strange ticker is still escaped properly)
+def json_prefix(ticker):
+    return '{"valid": "true", ' + json.dumps(ticker) + ": "
+
+
+# and ends with this
+def json_suffix(next_cursor):
+    if next_cursor is None:
+        return "}"
+    return ', "next_cursor": ' + json.dumps(next_cursor) + "}"
+
+
+# the python values of one field for the bars lo to hi
+def field_values(field, days, columns, lo, hi):
+    if field == "date":
+        return days_to_strings(days[lo:hi]).tolist()
+    return column_to_python(columns[field][lo:hi])
+
+
+def encode_rows(ticker, history, fields, next_cursor, chunk_rows):
+    if history is None:
+        yield (json_prefix(ticker) + "null" + json_suffix(next_cursor)).encode()
+        return
+    days, columns = history
+    yield (json_prefix(ticker) + "[").encode()
+    for lo in range(0, len(days), chunk_rows):
+        hi = lo + chunk_rows
+        if fields is None:
+            rows = zip(days_to_strings(days[lo:hi]).tolist(), itertools.repeat(ticker),
+                       *[column_to_python(columns[column][lo:hi]) for column in price_columns])
+        else:
+            rows = zip(*[field_values(field, days, columns, lo, hi)
+                       for field in fields])
+        # json.dumps of the chunk without its [ ], joined with ", " exactly like json.dumps of the whole list would be
+        text = json.dumps(list(rows))[1:-1]
+        yield ((", " if lo > 0 else "") + text).encode()
+    yield ("]" + json_suffix(next_cursor)).encode()
+
+
+def encode_columns(ticker, history, fields, next_cursor, chunk_rows):
+    if history is None:
+        yield (json_prefix(ticker) + "null" + json_suffix(next_cursor)).encode()
+        return
+    yield json_prefix(ticker).encode()
+    yield from columns_object(history, fields, chunk_rows)
+    yield json_suffix(next_cursor).encode()
+
+
+# the {"date": [...], "open": [...], ...} object of a history
+def columns_object(history, fields, chunk_rows):
+    days, columns = history
+    yield b"{"
+    for i, field in enumerate(["date"] + price_columns if fields is None else fields):
+        yield ((", " if i > 0 else "") + json.dumps(field) + ": [").encode()
+        for lo in range(0, len(days), chunk_rows):
+            values = field_values(field, days, columns, lo, lo + chunk_rows)
+            yield ((", " if lo > 0 else "") + json.dumps(values)[1:-1]).encode()
+        yield b"]"
+    yield b"}"
+
+
+# several histories, histories is {ticker: (days, columns), None (no data) or the Exception getting it failed with}
+# {"valid": "true", "histories": {"<TICKER>": {"status": "ok", "history": {"date": [...], ...}}, "<TICKER>": {"status": "no_data"}, ...}}
+# a ticker that failed has "status": "error"
+def encode_histories(histories, fields=None, chunk_rows=constants.history_chunk_rows):
+    yield b'{"valid": "true", "histories": {'
+    for i, (ticker, history) in enumerate(histories.items()):
+        yield ((", " if i > 0 else "") + json.dumps(ticker) + ": ").encode()
+        if isinstance(history, Exception):
+            yield b'{"status": "error"}'
+        elif history is None:
+            yield b'{"status": "no_data"}'
+        else:
+            yield b'{"status": "ok", "history": '
+            yield from columns_object(history, fields, chunk_rows)
+            yield b"}"
+    yield b"}}"
+
+
+def encode_binary(history, fields):
+    if history is None:
+        yield struct.pack("<IB", 0, 0)
+        return
+    days, columns = history
+    arrays = []
+    for field in ["date"] + price_columns if fields is None else fields:
+        if field == "date":
+            arrays.append(("day", "i", np.asarray(days, dtype="<i4")))
+        else:
+            arrays.append(
+                (field, "d", np.asarray(columns[field], dtype="<f8")))
+    yield struct.pack("<IB", len(days), len(arrays))
+    for name, kind, array in arrays:
+        name = name.encode()
+        yield struct.pack("<B", len(name)) + name + kind.encode() + struct.pack("<I", array.nbytes)
+        # the arrays are already little endian, so this is just a copy of their memory
+        yield array.tobytes()
+
+
+# gzips a stream of chunks as they go by
+def gzip_chunks(chunks, level=constants.history_gzip_level):
+    # wbits=31 writes the gzip header and trailer (not just raw deflate)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if len(compressed) > 0:
+            yield compressed
+    yield compressor.flush()
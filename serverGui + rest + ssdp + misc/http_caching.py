@@ -0,0 +1,52 @@
+# ETag and Cache-Control headers for the history style responses (history, chart, indicator) and the quotes
+#
+# a history response only depends on the request (its url parameters, the format and whether the client takes gzip) and the bars we had for the range,
+# and past daily bars never change, so the ETag is a hash of the request and the last date we have bars for (capped at the end of the range)
+# a range we already have every bar for can be answered with 304 Not Modified straight from the ticker registry, without touching the database
+# a range that ends before the last complete trading day can't get new bars either, so once we have all of it clients and proxies may keep it for a long time
+# adjusted prices are the exception, a new split or dividend changes every adjusted bar before it, so their ETag also has the day of the ticker's last corporate action
+# and they are only ever kept for a short time
+
+import hashlib
+import trading_calendar
+import constants
+
+
+# the (strong) ETag of a history response
+# params are the request's url parameters, representation is anything else the body depends on (the format an Accept header picked, whether it is gzipped)
+# through is the date of the last bar we have in the range, actions is the day number of the ticker's last split or dividend (for adjusted responses, None otherwise)
+def history_etag(path, params, representation, through, actions=None):
+    key = "\n".join([path, repr(sorted(params)), repr(representation),
+                    through.strftime(constants.date_format), repr(actions)])
+    return '"' + hashlib.sha1(key.encode()).hexdigest() + '"'
+
+
+# true if an If-None-Match header matches etag (it can be a list of ETags, or * for anything)
+def etag_matches(if_none_match, etag):
+    if if_none_match is None or etag is None:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        # a weak comparison, W/"..." matches "..." (If-None-Match is allowed to compare that way)
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == etag:
+            return True
+    return False
+
+
+# the Cache-Control header for a history range that ends on end
+# complete is True if we have every bar of the range (see database_manager.history_validator), found is False for a response with no history in it (i.e a ticker we don't know)
+# only a complete range that ends before the last complete trading day is kept for a long time, a response with no history isn't kept at all (the ticker may have data next time)
+def history_cache_control(end, today, complete, adjusted=False, found=True):
+    if not found:
+        return "no-store"
+    if complete and not adjusted and trading_calendar.to_date(end) < trading_calendar.last_complete_trading_day(today):
+        return "public, max-age=" + str(constants.history_immutable_max_age) + ", immutable"
+    # the newest bars may still be on their way
+    return "public, max-age=" + str(constants.history_recent_max_age)
+
+
+# the Cache-Control header for a quote, a client can reuse it for as long as the quote cache would
+def quote_cache_control():
+    return "public, max-age=" + str(constants.quote_cache_ttl)
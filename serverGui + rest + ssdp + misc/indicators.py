@@ -0,0 +1,222 @@
+# technical indicators worked out on the server from the price store's close prices (see price_history_store.py), with numpy
+#
+# sma, ema, rsi and volatility are worked out over a ticker's whole history and cached per (ticker, indicator, window),
+# when the ticker gets new daily bars only the new values are worked out (from the bars before them and what we remembered about the last value)
+# returns and drawdown depend on where the range starts (returns since the start, drawdown from the highest close since the start),
+# so they are worked out for each request (they are a single pass over the range anyway)
+#
+# values that don't exist yet (i.e a 20 day average before the 20th bar) are nan
+
+import math
+import threading
+from collections import OrderedDict
+import numpy as np
+import constants
+
+trading_days_per_year = 252
+
+
+# exponential moving average of x, y[i] = (1 - alpha) * y[i - 1] + alpha * x[i]
+# previous is y[-1] (the value before x starts), if there isn't one y[0] = x[0]
+# the recursion is unrolled into y[i] = decay^(i + 1) * (previous + alpha * sum(x[k] / decay^(k + 1))) so it can be done with a cumsum,
+# a chunk at a time so decay^-(k + 1) never gets too big for a float
+def exponential_average(x, alpha, previous=None):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.empty(len(x))
+    if len(x) <= 0:
+        return y
+    decay = 1.0 - alpha
+    if decay <= 0:
+        y[:] = x
+        return y
+    start = 0
+    if previous is None:
+        y[0] = x[0]
+        previous = x[0]
+        start = 1
+    chunk_size = max(1, int(200 / -math.log10(decay)))
+    for lo in range(start, len(x), chunk_size):
+        chunk = x[lo:lo + chunk_size]
+        powers = decay ** np.arange(1, len(chunk) + 1)
+        y[lo:lo + len(chunk)] = powers * \
+            (previous + alpha * np.cumsum(chunk / powers))
+        previous = y[lo + len(chunk) - 1]
+    return y
+
+
+# every indicator below takes the whole close array, the index to start at, what it remembered at the end of the last run (None the first time)
+# and its window, and returns (the values from start on, what to remember for next time)
+
+# simple moving average of the last window closes
+def sma(close, start, state, window):
+    values = np.full(len(close) - start, np.nan)
+    lo = max(0, start - window + 1)
+    sums = np.cumsum(np.concatenate([[0.0], close[lo:]]))
+    averages = (sums[window:] - sums[:-window]) / window
+    # averages[j] is the average ending at lo + window - 1 + j
+    first = lo + window - 1
+    if len(averages) > 0:
+        skip = max(0, start - first)
+        values[max(first, start) - start:] = averages[skip:]
+    return values, None
+
+
+# exponential moving average with the usual alpha = 2 / (window + 1)
+def ema(close, start, state, window):
+    values = exponential_average(close[start:], 2.0 / (window + 1), state)
+    return values, values[-1] if len(values) > 0 else state
+
+
+# relative strength index (wilder's smoothing, alpha = 1 / window, started from the plain average of the first window gains/losses)
+# remembers the average gain and loss
+def rsi(close, start, state, window):
+    if state is None:
+        # first run, work out the whole thing
+        values = np.full(len(close), np.nan)
+        if len(close) <= window:
+            return values[start:], None
+        changes = np.diff(close)
+        gains = np.maximum(changes, 0.0)
+        losses = np.maximum(-changes, 0.0)
+        first_gain = gains[:window].mean()
+        first_loss = losses[:window].mean()
+        average_gain = np.concatenate([[first_gain], exponential_average(
+            gains[window:], 1.0 / window, first_gain)])
+        average_loss = np.concatenate([[first_loss], exponential_average(
+            losses[window:], 1.0 / window, first_loss)])
+        values[window:] = relative_strength(average_gain, average_loss)
+        return values[start:], (average_gain[-1], average_loss[-1])
+
+    changes = close[start:] - close[start - 1:-1]
+    average_gain = exponential_average(
+        np.maximum(changes, 0.0), 1.0 / window, state[0])
+    average_loss = exponential_average(
+        np.maximum(-changes, 0.0), 1.0 / window, state[1])
+    if len(changes) <= 0:
+        return np.empty(0), state
+    return relative_strength(average_gain, average_loss), (average_gain[-1], average_loss[-1])
+
+
+def relative_strength(average_gain, average_loss):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = 100.0 - 100.0 / (1.0 + average_gain / average_loss)
+    # no losses at all is an rsi of 100
+    return np.where(average_loss == 0, 100.0, values)
+
+
+# annualized standard deviation of the daily log returns over the last window days
+def volatility(close, start, state, window):
+    values = np.full(len(close) - start, np.nan)
+    # the return for day i needs close[i - 1], the volatility for day i needs the returns for the window days up to it
+    lo = max(1, start - window + 1)
+    if len(close) - lo < window:
+        return values, None
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = np.log(close[lo:] / close[lo - 1:-1])
+    windows = np.lib.stride_tricks.sliding_window_view(returns, window)
+    deviations = windows.std(axis=1, ddof=1) * math.sqrt(trading_days_per_year)
+    first = lo + window - 1
+    skip = max(0, start - first)
+    values[max(first, start) - start:] = deviations[skip:]
+    return values, None
+
+
+# indicators that are cached, name -> (function, default window)
+cached_indicators = {
+    "sma": (sma, 20),
+    "ema": (ema, 20),
+    "rsi": (rsi, 14),
+    "volatility": (volatility, 20),
+}
+
+
+# returns since the first close of the range (0.05 is +5%)
+def returns(close):
+    return close / close[0] - 1.0
+
+
+# how far below the highest close so far (in the range) each close is (-0.2 is 20% below)
+def drawdown(close):
+    return close / np.maximum.accumulate(close) - 1.0
+
+
+range_indicators = {
+    "returns": returns,
+    "drawdown": drawdown,
+}
+
+indicator_names = list(cached_indicators) + list(range_indicators)
+
+
+# an indicator worked out over a ticker's whole history
+class indicatorValues:
+
+    def __init__(self, entry, values, state):
+        self.entry = entry  # the priceHistory the values are for
+        self.values = values
+        self.state = state
+
+
+class indicatorCache:
+
+    def __init__(self, max_size=constants.indicator_cache_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # (ticker, name, window) -> indicatorValues, least recently used first
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.extends = 0
+        self.misses = 0
+
+    # the values of an indicator for every bar of entry (the priceHistory the price store has for the ticker now)
+    def get(self, ticker, name, window, entry):
+        key = (ticker, name, window)
+        function = cached_indicators[name][0]
+        close = entry.columns["close"]
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached is not None:
+                self.entries.move_to_end(key)
+
+        if cached is not None and cached.entry is entry:
+            with self.lock:
+                self.hits += 1
+            return cached.values
+
+        if cached is not None and self.extends_from(cached.entry, entry):
+            # the new priceHistory is the old one with new bars on the end, only work out the values for those
+            start = len(cached.entry.days)
+            new_values, state = function(close, start, cached.state, window)
+            result = indicatorValues(entry, np.concatenate(
+                [cached.values, new_values]), state)
+            with self.lock:
+                self.extends += 1
+        else:
+            values, state = function(close, 0, None, window)
+            result = indicatorValues(entry, values, state)
+            with self.lock:
+                self.misses += 1
+
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return result.values
+
+    # true if new_entry starts with exactly the bars of old_entry (new daily bars were added on the end)
+    def extends_from(self, old_entry, new_entry):
+        num = len(old_entry.days)
+        if num <= 0 or len(new_entry.days) < num:
+            return False
+        return (new_entry.days[0] == old_entry.days[0] and new_entry.days[num - 1] == old_entry.days[num - 1]
+                and new_entry.columns["close"][num - 1] == old_entry.columns["close"][num - 1])
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "extends": self.extends,
+                "misses": self.misses,
+            }
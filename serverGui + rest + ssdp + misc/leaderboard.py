@@ -0,0 +1,265 @@
+# classroom leaderboard, every user ranked by what their account is worth (balance + their stocks at the current price)
+# pricing every holding of every user on each request would be a quote per holding, so instead the leaderboard keeps everyone's balance and holdings in memory:
+# - when a quote changes (see quote_cache.py) only the users holding that ticker are revalued
+# - new users and trades are picked up from user_data.db (the trades ledger, see userData_manager.py) by id, so trades made by other worker processes count too
+# - the ranks are kept in an indexable skiplist, so the top N and the rank of one user are O(log n) instead of a sort
+# user_pass_bal and user_ticker stay the source of truth, the whole thing is rebuilt from them every constants.leaderboard_resync_interval seconds
+
+import random
+import threading
+import time
+import constants
+
+
+class skipNode:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels  # how many places forward next is on each level
+
+
+# a sorted list of keys (an indexable skiplist), insert/remove/rank/at are O(log n)
+class rankList:
+
+    def __init__(self, max_levels=32):
+        self.max_levels = max_levels
+        self.head = skipNode(None, max_levels)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    # the node before where key goes on every level and its position (the head is 0, the first key is 1)
+    def find(self, key):
+        chain = [None] * self.max_levels
+        positions = [0] * self.max_levels
+        node = self.head
+        position = 0
+        for level in reversed(range(self.max_levels)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+            positions[level] = position
+        return chain, positions
+
+    def insert(self, key):
+        chain, positions = self.find(key)
+        levels = 1
+        while levels < self.max_levels and random.random() < 0.5:
+            levels += 1
+        node = skipNode(key, levels)
+        position = positions[0] + 1
+        for level in range(self.max_levels):
+            before = chain[level]
+            if level < levels:
+                node.next[level] = before.next[level]
+                if before.next[level] is not None:
+                    node.width[level] = positions[level] + \
+                        before.width[level] - position + 1
+                before.next[level] = node
+                before.width[level] = position - positions[level]
+            elif before.next[level] is not None:
+                before.width[level] += 1
+        self.size += 1
+
+    # removes key, returns False if it wasn't there
+    def remove(self, key):
+        chain, positions = self.find(key)
+        node = chain[0].next[0]
+        if node is None or node.key != key:
+            return False
+        for level in range(self.max_levels):
+            before = chain[level]
+            if before.next[level] is node:
+                before.width[level] += node.width[level] - 1
+                before.next[level] = node.next[level]
+            elif before.next[level] is not None:
+                before.width[level] -= 1
+        self.size -= 1
+        return True
+
+    # how many keys are smaller than key (the index of key if it is in the list)
+    def rank(self, key):
+        chain, positions = self.find(key)
+        return positions[0]
+
+    # up to count keys starting at index start
+    def slice(self, start, count):
+        node = self.head
+        position = 0
+        for level in reversed(range(self.max_levels)):
+            while node.next[level] is not None and position + node.width[level] <= start + 1:
+                position += node.width[level]
+                node = node.next[level]
+        keys = []
+        while node is not None and position == start + 1 and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class leaderboard:
+
+    def __init__(self, resync_interval=constants.leaderboard_resync_interval):
+        self.resync_interval = resync_interval
+        self.balances = {}  # username -> balance
+        self.positions = {}  # username -> {ticker: amount}, only tickers they have some of
+        self.holders = {}  # ticker -> set of usernames that have some of it
+        self.prices = {}  # ticker -> the price the values are worked out with
+        self.values = {}  # username -> what their account is worth
+        self.ranks = rankList()  # (-value, username), so the most valuable account is first
+        self.last_user_rowid = 0  # the last user_pass_bal rowid we have
+        self.last_trade_id = 0  # the last trade we have
+        self.synced_at = None  # time.monotonic() of the last rebuild
+        self.lock = threading.Lock()
+
+        self.resyncs = 0
+        self.users_added = 0
+        self.trades_applied = 0
+        self.price_changes = 0
+        self.revaluations = 0
+
+    # true if it is time to rebuild from the tables
+    def needs_resync(self):
+        with self.lock:
+            return self.synced_at is None or time.monotonic() - self.synced_at >= self.resync_interval
+
+    # the user rowid and trade id to ask for changes after
+    def position(self):
+        with self.lock:
+            return self.last_user_rowid, self.last_trade_id
+
+    # every ticker someone holds
+    def tickers(self):
+        with self.lock:
+            return list(self.holders)
+
+    # rebuilds everything from userData_manager.get_leaderboard_state
+    # prices we already have are kept, a ticker we have no price for yet is worth the price it last traded at until its quote comes in
+    def load(self, users, holdings, last_trade_id, last_prices):
+        with self.lock:
+            self.balances = {}
+            self.positions = {}
+            self.holders = {}
+            self.values = {}
+            self.ranks = rankList()
+            # the snapshot's own position, even if it goes back (then the changes after it are picked up again)
+            self.last_user_rowid = 0
+            for rowid, username, balance in users:
+                self.balances[username] = balance
+                self.positions[username] = {}
+                self.last_user_rowid = max(self.last_user_rowid, rowid)
+            for username, ticker, amount in holdings:
+                if username in self.positions and amount != 0:
+                    self.positions[username][ticker] = amount
+                    self.holders.setdefault(ticker, set()).add(username)
+            for ticker, price in last_prices.items():
+                self.prices.setdefault(ticker, price)
+            for username in self.balances:
+                self.revalue(username)
+            self.last_trade_id = last_trade_id
+            self.synced_at = time.monotonic()
+            self.resyncs += 1
+
+    # applies userData_manager.get_leaderboard_changes, anything we already have (i.e picked up by a resync in the meantime) is skipped
+    def apply_changes(self, users, trades):
+        with self.lock:
+            for rowid, username, balance, positions in users:
+                if rowid <= self.last_user_rowid or username in self.balances:
+                    continue
+                self.balances[username] = balance
+                self.positions[username] = {}
+                for ticker, amount in positions.items():
+                    self.set_amount(username, ticker, amount)
+                self.revalue(username)
+                self.last_user_rowid = rowid
+                self.users_added += 1
+            for trade_id, username, ticker, amount, price in trades:
+                if trade_id <= self.last_trade_id:
+                    continue
+                self.last_trade_id = trade_id
+                if username not in self.balances:
+                    continue
+                self.balances[username] -= amount * price
+                self.set_amount(username, ticker,
+                                self.positions[username].get(ticker, 0) + amount)
+                self.prices.setdefault(ticker, price)
+                self.revalue(username)
+                self.trades_applied += 1
+
+    # a ticker's price changed (what the quote cache calls), revalues only the users holding it
+    def price_changed(self, ticker, price):
+        with self.lock:
+            if price is None or self.prices.get(ticker) == price:
+                return
+            self.prices[ticker] = price
+            self.price_changes += 1
+            for username in self.holders.get(ticker, ()):
+                self.revalue(username)
+
+    # price_changed for {ticker: price}
+    def prices_changed(self, prices):
+        for ticker, price in prices.items():
+            self.price_changed(ticker, price)
+
+    # sets how much of a ticker a user has (the lock must be held)
+    def set_amount(self, username, ticker, amount):
+        if amount != 0:
+            self.positions[username][ticker] = amount
+            self.holders.setdefault(ticker, set()).add(username)
+            return
+        self.positions[username].pop(ticker, None)
+        holders = self.holders.get(ticker)
+        if holders is not None:
+            holders.discard(username)
+            if len(holders) <= 0:
+                del self.holders[ticker]
+
+    # works out what a user's account is worth and moves them to their new rank (the lock must be held)
+    def revalue(self, username):
+        value = float(self.balances[username]) + sum(
+            amount * self.prices.get(ticker, 0.0) for ticker, amount in self.positions[username].items())
+        old = self.values.get(username)
+        if old == value:
+            return
+        if old is not None:
+            self.ranks.remove((-old, username))
+        self.ranks.insert((-value, username))
+        self.values[username] = value
+        self.revaluations += 1
+
+    # up to count (rank, username, value) starting at rank start + 1, ranks start at 1
+    def top(self, start, count):
+        with self.lock:
+            return [(start + i + 1, username, -value)
+                    for i, (value, username) in enumerate(self.ranks.slice(start, count))]
+
+    # (rank, value) of a user, None if we don't have them
+    def rank_of(self, username):
+        with self.lock:
+            value = self.values.get(username)
+            if value is None:
+                return None
+            return self.ranks.rank((-value, username)) + 1, value
+
+    # how many users are ranked
+    def size(self):
+        with self.lock:
+            return len(self.ranks)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "users": len(self.ranks),
+                "tickers_held": len(self.holders),
+                "last_trade_id": self.last_trade_id,
+                "seconds_since_resync": None if self.synced_at is None else time.monotonic() - self.synced_at,
+                "resyncs": self.resyncs,
+                "users_added": self.users_added,
+                "trades_applied": self.trades_applied,
+                "price_changes": self.price_changes,
+                "revaluations": self.revaluations,
+            }
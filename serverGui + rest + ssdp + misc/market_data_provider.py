@@ -0,0 +1,294 @@
+# where the server gets its market data from
+# database_manager only talks to a marketDataProvider, so we can swap yahoo finance out for local files
+# (no internet in the classroom, load testing, benchmarks, replaying an old trading day, ...)
+
+import datetime
+import os
+import time
+import numpy as np
+import pandas as pd
+import requests
+import yfinance as yf
+from yfinance.utils import user_agent_headers
+import constants
+from stockData_manager import stockData_manager
+
+# the columns every provider returns, in yfinance's format
+history_columns = ["Open", "High", "Low", "Close",
+                   "Volume", "Dividends", "Stock Splits"]
+
+
+# raised by a provider that couldn't get an answer (no internet, rate limited, yahoo is down), so nothing is known about the ticker
+# as opposed to an empty history, which means the ticker really has no data (and can be remembered as invalid)
+class marketDataUnavailable(Exception):
+    pass
+
+
+# parent class for the providers, children override the methods that raise
+class marketDataProvider:
+
+    # returns the daily price history of a ticker as a dataframe in yfinance's format
+    # (one row per day indexed by date, with the history_columns), an empty dataframe if there is none
+    # raises marketDataUnavailable if the provider couldn't be asked
+    # prices are what they actually were on the day (not adjusted for later splits and dividends), price_adjustments.py adjusts them when asked to
+    # takes the same arguments as yfinance: either period (i.e "max", "1d") or start (inclusive) and end (exclusive) dates
+    def get_history(self, ticker, start=None, end=None, period=None):
+        raise Exception("get_history() must be overriden")
+
+    # returns the current price of a ticker, None if there isn't one
+    def get_current_price(self, ticker):
+        raise Exception("get_current_price() must be overriden")
+
+    # get_history for several tickers at once, returns {ticker: dataframe}
+    # providers that can ask for many tickers in one request override this, by default it is one get_history per ticker
+    def get_histories(self, tickers, start=None, end=None, period=None):
+        return {ticker: self.get_history(ticker, start, end, period) for ticker in tickers}
+
+    # get_current_price for several tickers at once, returns {ticker: price or None}
+    def get_current_prices(self, tickers):
+        return {ticker: self.get_current_price(ticker) for ticker in tickers}
+
+    # today's date (with no time) as far as this provider is concerned
+    def today(self):
+        return constants.getCurrentDate(constants.date_format)
+
+
+# gets everything from yahoo finance
+class yfinanceProvider(marketDataProvider):
+
+    def get_history(self, ticker, start=None, end=None, period=None):
+        # auto_adjust=False so the prices aren't adjusted for dividends
+        if period is not None:
+            df = yf.Ticker(ticker).history(
+                period=period, auto_adjust=False, raise_errors=False)
+        else:
+            df = yf.Ticker(ticker).history(
+                start=start, end=end, auto_adjust=False, raise_errors=False)
+        if len(df.index) <= 0:
+            self.confirm_no_data(ticker)
+        return self.undo_split_adjustment(df)
+
+    # yfinance returns the same empty dataframe when yahoo says a ticker has no data as when it couldn't reach yahoo at all (raise_errors doesn't tell them apart either)
+    # so when a history comes back empty we ask yahoo about the ticker ourselves, an answer (the ticker, or yahoo saying it doesn't know it) means there really is no data
+    # no answer raises marketDataUnavailable
+    def confirm_no_data(self, ticker):
+        try:
+            response = requests.get(constants.yahoo_chart_url + ticker, params={"range": "1d", "interval": "1d"},
+                                    headers=user_agent_headers, timeout=constants.yahoo_timeout)
+        except requests.RequestException as e:
+            raise marketDataUnavailable(ticker + ": " + str(e))
+        # 404 is yahoo not knowing the ticker
+        if response.status_code != 200 and response.status_code != 404:
+            raise marketDataUnavailable(
+                ticker + ": yahoo answered " + str(response.status_code))
+
+    # yahoo always adjusts prices (and volumes and dividends) for splits, even with auto_adjust=False
+    # this puts them back to what they were on the day using the splits in the dataframe
+    # (a range that ends before today can't see the splits after it, so database_manager always asks for ranges that run up to today)
+    def undo_split_adjustment(self, df):
+        if len(df.index) <= 0:
+            return df
+        splits = df["Stock Splits"].to_numpy(dtype=float)
+        ratios = np.where(splits != 0, splits, 1.0)
+        # factor[i] is the product of the splits after day i
+        factor = np.append(np.cumprod(ratios[::-1])[::-1][1:], 1.0)
+        df = df[history_columns].copy()
+        for column in ["Open", "High", "Low", "Close", "Dividends"]:
+            df[column] = df[column] * factor
+        df["Volume"] = df["Volume"] / factor
+        return df
+
+    def get_current_price(self, ticker):
+        df = yf.Ticker(ticker).history(period='1d')  # ['Close'][0]
+        num_rows = len(df.index)
+        if num_rows <= 0:
+            return None
+        return df['Close'][0]
+
+    # one yf.download for all of the tickers (it fetches them on its own threads and returns them side by side)
+    def get_histories(self, tickers, start=None, end=None, period=None):
+        if len(tickers) <= 1:
+            return super().get_histories(tickers, start, end, period)
+        if period is not None:
+            df = self.download(tickers, period=period, actions=True)
+        else:
+            df = self.download(tickers, start=start, end=end, actions=True)
+        histories = {}
+        for ticker in tickers:
+            history = self.ticker_frame(df, ticker)
+            if len(history.index) > 0:
+                # download lines the tickers up on the same dates, a ticker that didn't trade on one of them has a row of nan there
+                history = history.dropna(subset=["Close"])
+                history[["Dividends", "Stock Splits"]] = history[[
+                    "Dividends", "Stock Splits"]].fillna(0.0)
+            if len(history.index) <= 0:
+                self.confirm_no_data(ticker)
+            histories[ticker] = self.undo_split_adjustment(history)
+        return histories
+
+    def get_current_prices(self, tickers):
+        if len(tickers) <= 1:
+            return super().get_current_prices(tickers)
+        df = self.download(tickers, period="1d")
+        prices = {}
+        for ticker in tickers:
+            close = self.ticker_frame(df, ticker)["Close"].dropna()
+            prices[ticker] = float(close.iloc[-1]) if len(
+                close.index) > 0 else None
+        return prices
+
+    def download(self, tickers, **kwargs):
+        return yf.download(tickers, group_by="ticker", auto_adjust=False, threads=True,
+                           progress=False, show_errors=False, **kwargs)
+
+    # the columns of one ticker out of a multi ticker download, empty (with the history_columns) if it isn't there
+    def ticker_frame(self, df, ticker):
+        if ticker not in df.columns.get_level_values(0):
+            return pd.DataFrame(columns=history_columns)
+        return df[ticker].reindex(columns=history_columns)
+
+
+# a clock that starts at a given date and time and runs speed times faster than real time
+# i.e simulatedClock(datetime.datetime(2020, 3, 16, 9, 30), 60) replays the 2020-03-16 trading session in 6.5 minutes
+class simulatedClock:
+
+    def __init__(self, start, speed=1):
+        self.start = start
+        self.speed = speed
+        self.real_start = time.monotonic()
+
+    def now(self):
+        return self.start + datetime.timedelta(seconds=(time.monotonic() - self.real_start) * self.speed)
+
+
+# serves price history from local files instead of the internet
+# source is either a folder of <TICKER>.csv / <TICKER>.parquet files (the format you get from yfinance's df.to_csv()/to_parquet(), saved with auto_adjust=False)
+# or a database file in the stock_data.db format (i.e a copy of another server's cache)
+# with a clock, it pretends it is the clock's date: nothing after that day exists, and the current price moves through the day's bar as the clock runs
+class localProvider(marketDataProvider):
+
+    # trading session the intraday replay runs over
+    session_open = datetime.time(9, 30)
+    session_close = datetime.time(16, 0)
+
+    def __init__(self, source, clock=None):
+        self.source = source
+        self.clock = clock
+        self.histories = {}  # ticker -> full dataframe, files are only read once
+
+        if not os.path.isdir(source):
+            # a database file, make sure its schema matches what stockData_manager expects
+            with stockData_manager(source, immediate=True) as db:
+                db.migrate()
+
+    # the current (possibly simulated) date and time
+    def now(self):
+        if self.clock is None:
+            return datetime.datetime.now()
+        return self.clock.now()
+
+    def today(self):
+        now = self.now()
+        return datetime.datetime(now.year, now.month, now.day)
+
+    # loads every row we have for a ticker (cached), indexed by date with no time/timezone
+    def load(self, ticker):
+        if ticker in self.histories:
+            return self.histories[ticker]
+
+        if os.path.isdir(self.source):
+            df = self.load_file(ticker)
+        else:
+            df = self.load_database(ticker)
+
+        if df is None:
+            df = pd.DataFrame(columns=history_columns,
+                              index=pd.DatetimeIndex([]), dtype=float)
+        df = df.sort_index()
+        self.histories[ticker] = df
+        return df
+
+    def load_file(self, ticker):
+        csv_path = os.path.join(self.source, ticker + ".csv")
+        parquet_path = os.path.join(self.source, ticker + ".parquet")
+        if os.path.exists(csv_path):
+            df = pd.read_csv(csv_path)
+        elif os.path.exists(parquet_path):
+            df = pd.read_parquet(parquet_path).reset_index()  # needs pyarrow (or fastparquet) installed
+        else:
+            return None
+
+        # yfinance writes the date with the exchange's timezone (i.e 2020-01-02 00:00:00-05:00), we only want the date part
+        date_column = "Date" if "Date" in df.columns else df.columns[0]
+        df.index = pd.DatetimeIndex(pd.to_datetime(
+            df[date_column].astype(str).str[:10], format=constants.date_format))
+        for column in history_columns:
+            if column not in df.columns:
+                df[column] = 0.0
+        return df[history_columns]
+
+    def load_database(self, ticker):
+        with stockData_manager(self.source) as db:
+            rows = db.searchForTicker(ticker, datetime.datetime(1800, 1, 1), datetime.datetime(9999, 1, 1))
+        if len(rows) <= 0:
+            return None
+        df = pd.DataFrame([row[2:] for row in rows], columns=history_columns, index=pd.DatetimeIndex(
+            pd.to_datetime([row[0] for row in rows], format=constants.date_format)))
+        return df
+
+    def get_history(self, ticker, start=None, end=None, period=None):
+        df = self.load(ticker)
+        # with a clock, only finished days exist (same as yahoo, we never store today's bar)
+        df = df[df.index < self.today()]
+        if period == "1d":
+            return df.iloc[-1:]
+        if period is not None:
+            return df
+        if start is not None:
+            df = df[df.index >= pd.Timestamp(start)]
+        if end is not None:
+            df = df[df.index < pd.Timestamp(end)]
+        return df
+
+    def get_current_price(self, ticker):
+        df = self.load(ticker)
+        now = self.now()
+        today = self.today()
+
+        if self.clock is not None and today in df.index:
+            # replaying a trading day, walk the price through the day's bar: open -> low -> high -> close on an up day, open -> high -> low -> close on a down day
+            bar = df.loc[today]
+            session_start = datetime.datetime.combine(
+                today.date(), self.session_open)
+            session_end = datetime.datetime.combine(
+                today.date(), self.session_close)
+            progress = (now - session_start) / (session_end - session_start)
+            progress = min(max(progress, 0), 1)
+
+            if bar["Close"] >= bar["Open"]:
+                path = [bar["Open"], bar["Low"], bar["High"], bar["Close"]]
+            else:
+                path = [bar["Open"], bar["High"], bar["Low"], bar["Close"]]
+            segment = min(int(progress * 3), 2)
+            fraction = progress * 3 - segment
+            return float(path[segment] + (path[segment + 1] - path[segment]) * fraction)
+
+        # otherwise the last close we have
+        df = df[df.index <= today]
+        if len(df.index) <= 0:
+            return None
+        return float(df["Close"].iloc[-1])
+
+
+# creates the provider that is set in constants.py
+def create_provider():
+    if constants.market_data_provider == "yfinance":
+        return yfinanceProvider()
+    if constants.market_data_provider == "local":
+        clock = None
+        if constants.replay_start is not None:
+            clock = simulatedClock(datetime.datetime.strptime(
+                constants.replay_start, constants.replay_start_format), constants.replay_speed)
+        return localProvider(constants.local_market_data_source, clock)
+    raise ValueError("unknown market data provider " +
+                     str(constants.market_data_provider))
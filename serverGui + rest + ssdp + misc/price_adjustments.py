@@ -0,0 +1,147 @@
+# split and dividend adjusted prices, worked out from the dividends and stock_splits we store with every bar
+# the stored bars are what the prices actually were on the day, so a chart over a split has a cliff in it and returns over a dividend look worse than they were
+#
+# every bar gets an adjustment factor, the product of a multiplier for every corporate action after it:
+#   a split of ratio r multiplies by 1 / r
+#   a dividend d with an ex date of day i multiplies by 1 - d / close[i - 1] (yahoo's method, the same as their "Adj Close")
+# adjusted prices are the prices times the factor, adjusted volume is the volume divided by the split part of it (the number of shares changes, not their value)
+#
+# the factors are worked out once per ticker and cached, new daily bars with no dividends or splits in them just get a factor of 1
+# (nothing before them changes), only new corporate actions make us work them out again
+#
+# a history can be asked for in three ways (the adjustment):
+#   "split" adjusted for splits only, what yahoo gives out and what the server has always sent (the default)
+#   "all" adjusted for splits and dividends (adjusted=true)
+#   "raw" what the prices actually were on the day, the prices buy_stock/sell_stock trade at (raw=true)
+
+import threading
+from collections import OrderedDict
+import numpy as np
+import constants
+from price_history_store import priceHistory, price_columns
+
+adjustments = ["split", "all", "raw"]
+
+
+# the adjustment a request's adjusted and raw url parameters ask for, None if it asks for both
+def adjustment_from_params(adjusted, raw):
+    if adjusted and raw:
+        return None
+    if adjusted:
+        return "all"
+    if raw:
+        return "raw"
+    return "split"
+
+
+# the multipliers for every bar (1 if nothing happened that day) -> (price factor, split factor) of every bar
+def adjustment_factors(close, dividends, splits):
+    split_multipliers = np.where(splits != 0, 1.0 / np.where(splits != 0, splits, 1.0), 1.0)
+    previous_close = np.concatenate([[np.nan], close[:-1]])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dividend_multipliers = np.where(
+            (dividends != 0) & (previous_close > 0), 1.0 - dividends / previous_close, 1.0)
+    # factor[i] is the product of the multipliers after bar i, the reversed cumprod gives the product from bar i on
+    split_factor = np.append(np.cumprod(split_multipliers[::-1])[::-1][1:], 1.0)
+    price_factor = split_factor * \
+        np.append(np.cumprod(dividend_multipliers[::-1])[::-1][1:], 1.0)
+    return price_factor, split_factor
+
+
+# applies the factors to the bars of a priceHistory, returns the adjusted columns
+def adjust_columns(columns, price_factor, split_factor):
+    adjusted = {}
+    for column in ["open", "high", "low", "close"]:
+        adjusted[column] = columns[column] * price_factor
+    adjusted["volume"] = columns["volume"] / split_factor
+    # dividends are per share, so they change with the splits
+    adjusted["dividends"] = columns["dividends"] * split_factor
+    adjusted["stock_splits"] = np.asarray(columns["stock_splits"])
+    return adjusted
+
+
+# true if any of the bars from start on had a split or a dividend
+def has_corporate_actions(columns, start):
+    return bool(np.any(columns["dividends"][start:] != 0) or np.any(columns["stock_splits"][start:] != 0))
+
+
+# the day number of the last bar with a split or a dividend, -1 if there are none
+def last_corporate_action(days, columns):
+    actions = np.flatnonzero((columns["dividends"] != 0) | (columns["stock_splits"] != 0))
+    return int(days[actions[-1]]) if len(actions) > 0 else -1
+
+
+# the adjusted history of a ticker
+class adjustedHistory:
+
+    def __init__(self, entry, adjusted, price_factor, split_factor):
+        self.entry = entry  # the (unadjusted) priceHistory it was worked out from
+        self.adjusted = adjusted  # a priceHistory of the adjusted bars
+        self.price_factor = price_factor
+        self.split_factor = split_factor
+
+
+class adjustmentCache:
+
+    def __init__(self, max_size=constants.adjusted_cache_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # ticker -> adjustedHistory, least recently used first
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.extends = 0
+        self.misses = 0
+
+    # returns a priceHistory of entry's bars adjusted for splits (adjustment "split") or splits and dividends ("all")
+    # the same priceHistory object as long as the ticker doesn't change, so the caches keyed on it (resampling, indicators) keep working
+    def get(self, ticker, entry, adjustment="all"):
+        key = (ticker, adjustment)
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached is not None:
+                self.entries.move_to_end(key)
+        if cached is not None and cached.entry is entry:
+            with self.lock:
+                self.hits += 1
+            return cached.adjusted
+
+        num = 0 if cached is None else len(cached.entry.days)
+        if (cached is not None and num > 0 and len(entry.days) >= num and entry.days[num - 1] == cached.entry.days[num - 1]
+                and not has_corporate_actions(entry.columns, num)):
+            # only new bars with nothing happening in them, the factors before them stay the same and theirs are 1
+            new_bars = len(entry.days) - num
+            price_factor = np.append(cached.price_factor, np.ones(new_bars))
+            split_factor = np.append(cached.split_factor, np.ones(new_bars))
+            new_columns = adjust_columns({column: entry.columns[column][num:] for column in price_columns},
+                                         price_factor[num:], split_factor[num:])
+            adjusted_columns = {column: np.concatenate([cached.adjusted.columns[column], new_columns[column]])
+                                for column in price_columns}
+            with self.lock:
+                self.extends += 1
+        else:
+            dividends = entry.columns["dividends"] if adjustment == "all" else np.zeros(
+                len(entry.days))
+            price_factor, split_factor = adjustment_factors(
+                entry.columns["close"], dividends, entry.columns["stock_splits"])
+            adjusted_columns = adjust_columns(
+                entry.columns, price_factor, split_factor)
+            with self.lock:
+                self.misses += 1
+
+        adjusted = priceHistory(entry.days, adjusted_columns, entry.loaded_through)
+        with self.lock:
+            self.entries[key] = adjustedHistory(
+                entry, adjusted, price_factor, split_factor)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return adjusted
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "extends": self.extends,
+                "misses": self.misses,
+            }
@@ -0,0 +1,214 @@
+# on disk copy of the price histories in stock_data.db, in a format we can memory map
+# every worker process (or every classroom server on the same computer) maps the same files read only,
+# so the operating system keeps one copy of a hot ticker in its page cache instead of every process keeping its own
+#
+# each ticker has data files named <ticker>.<version>.cols and a <ticker>.current file holding the name of the one in use
+# a data file is never changed after it is written, new bars go in a new version and then <ticker>.current is swapped over to it (os.replace is atomic),
+# so a reader always sees one complete version
+#
+# data file layout (little endian):
+#   64 byte header: magic, number of bars, loaded_through (day number we had fetched up to), the rest is padding
+#   day numbers as int32 (padded to a multiple of 8 bytes)
+#   then open, high, low, close, volume, dividends, stock_splits as float64, one after the other
+
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import numpy as np
+import constants
+from price_history_store import price_columns
+
+magic = b"SSPARCH1"
+header_format = "<8sqq"
+header_size = 64
+
+
+# turns a ticker into something safe to use as a file name (on windows too, where AAPL and aapl would be the same file)
+# uppercase letters, digits and -_ stay as they are, everything else becomes %XX
+# "." is escaped too, it separates the name from the version (otherwise BRK's files would look like versions of BRK.B's)
+def archive_name(ticker):
+    safe = b"ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_"
+    return "".join(chr(byte) if byte in safe else "%{:02X}".format(byte) for byte in ticker.encode("utf-8"))
+
+
+# a version of a ticker's history that has been mapped into memory
+class archivedHistory:
+    def __init__(self, days, columns, loaded_through, file_name):
+        self.days = days
+        self.columns = columns
+        self.loaded_through = loaded_through
+        self.file_name = file_name
+
+
+class priceArchive:
+
+    def __init__(self, folder=constants.price_archive_path):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self.lock = threading.Lock()
+
+        self.reads = 0
+        self.publishes = 0
+        self.appends = 0
+
+    def pointer_path(self, ticker):
+        return os.path.join(self.folder, archive_name(ticker) + ".current")
+
+    # maps the current version of a ticker's history, None if it hasn't been archived
+    # the arrays point straight into the mapped file (no copy), and are read only
+    def read(self, ticker):
+        file_name = self.current_file_name(ticker)
+        if file_name is None:
+            return None
+        try:
+            with open(os.path.join(self.folder, file_name), "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+
+        found_magic, num_rows, loaded_through = struct.unpack_from(
+            header_format, mapped, 0)
+        if found_magic != magic:
+            raise ValueError(file_name + " is not a price archive file")
+
+        # the arrays keep a reference to the mmap object, so it stays mapped as long as someone is using them
+        offset = header_size
+        days = np.frombuffer(mapped, dtype="<i4", count=num_rows, offset=offset)
+        offset += self.padded(num_rows * 4)
+        columns = {}
+        for column in price_columns:
+            columns[column] = np.frombuffer(
+                mapped, dtype="<f8", count=num_rows, offset=offset)
+            offset += num_rows * 8
+
+        with self.lock:
+            self.reads += 1
+        return archivedHistory(days, columns, loaded_through, file_name)
+
+    # writes a ticker's whole history as a new version and makes it the current one
+    def publish(self, ticker, days, columns, loaded_through):
+        self.make_current(ticker, self.write_version(
+            ticker, days, columns, loaded_through))
+
+    # writes a ticker's whole history as a new version without making it the current one (see make_current), returns its file name
+    # this is the slow part (the whole file is written and synced to disk)
+    def write_version(self, ticker, days, columns, loaded_through):
+        # unique across processes, so two servers publishing at once never write the same file
+        file_name = "{}.{}-{}.cols".format(archive_name(ticker), time.time_ns(), os.getpid())
+        path = os.path.join(self.folder, file_name)
+
+        num_rows = len(days)
+        with open(path + ".tmp", "wb") as f:
+            header = struct.pack(header_format, magic,
+                                 num_rows, int(loaded_through))
+            f.write(header.ljust(header_size, b"\0"))
+            day_bytes = np.asarray(days, dtype="<i4").tobytes()
+            f.write(day_bytes.ljust(self.padded(len(day_bytes)), b"\0"))
+            for column in price_columns:
+                f.write(np.asarray(columns[column], dtype="<f8").tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        return file_name
+
+    # swaps the pointer over to a version from write_version
+    def make_current(self, ticker, file_name):
+        pointer = self.pointer_path(ticker)
+        with open(pointer + "." + str(os.getpid()) + ".tmp", "w") as f:
+            f.write(file_name)
+            f.flush()
+            os.fsync(f.fileno())
+        self.replace_with_retry(pointer + "." + str(os.getpid()) + ".tmp", pointer)
+
+        with self.lock:
+            self.publishes += 1
+        self.remove_old_versions(archive_name(ticker), file_name)
+
+    # the file name of a ticker's current version, None if it hasn't been archived
+    def current_file_name(self, ticker):
+        try:
+            with open(self.pointer_path(ticker), "r") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    # writes the version that adds new bars (fetched for start_day to end_day) on to the end of a ticker's current version, without making it current yet
+    # so it can be done before the caller takes the stock_data write lock, and only commit_append has to happen while it is held
+    # returns (the current version's file name, the new version's file name or None if there is nothing new),
+    # None if there is no current version or the bars don't follow on from it, the caller then publishes the whole history instead
+    def prepare_append(self, ticker, days, columns, start_day, end_day):
+        current = self.read(ticker)
+        if current is None or start_day > current.loaded_through + 1:
+            return None
+        if len(days) <= 0 and end_day <= current.loaded_through:
+            # nothing new
+            return current.file_name, None
+        if len(days) > 0 and len(current.days) > 0 and days[0] <= current.days[-1]:
+            return None
+        file_name = self.write_version(
+            ticker,
+            np.concatenate([current.days, days]),
+            {column: np.concatenate([current.columns[column], columns[column]])
+             for column in price_columns},
+            max(current.loaded_through, end_day),
+        )
+        return current.file_name, file_name
+
+    # makes a version from prepare_append the current one, if the version it was built on still is
+    # returns False (and deletes the new version) if another write published in the meantime, the caller then publishes the whole history instead
+    def commit_append(self, ticker, prepared):
+        base_file_name, file_name = prepared
+        if self.current_file_name(ticker) != base_file_name:
+            if file_name is not None:
+                self.remove_version(file_name)
+            return False
+        if file_name is not None:
+            self.make_current(ticker, file_name)
+        with self.lock:
+            self.appends += 1
+        return True
+
+    # prepare_append and commit_append in one go
+    def append(self, ticker, days, columns, start_day, end_day):
+        prepared = self.prepare_append(
+            ticker, days, columns, start_day, end_day)
+        return prepared is not None and self.commit_append(ticker, prepared)
+
+    # on windows a file can't be replaced while someone has it open, readers only hold the pointer file for a moment so just try again
+    def replace_with_retry(self, source, destination):
+        for attempt in range(50):
+            try:
+                os.replace(source, destination)
+                return
+            except PermissionError:
+                time.sleep(0.01)
+        os.replace(source, destination)
+
+    # deletes the versions of a ticker that aren't current anymore
+    def remove_old_versions(self, name, current_file_name):
+        version = re.compile(re.escape(name) + r"\.\d+-\d+\.cols")
+        for file_name in os.listdir(self.folder):
+            if version.fullmatch(file_name) and file_name != current_file_name:
+                self.remove_version(file_name)
+
+    # a version some process still has mapped can't be deleted on windows, it gets cleaned up by a later publish instead
+    def remove_version(self, file_name):
+        try:
+            os.remove(os.path.join(self.folder, file_name))
+        except OSError:
+            pass
+
+    # rounds a byte count up to a multiple of 8, so every column starts 8 byte aligned
+    def padded(self, num_bytes):
+        return (num_bytes + 7) // 8 * 8
+
+    def stats(self):
+        with self.lock:
+            return {
+                "reads": self.reads,
+                "publishes": self.publishes,
+                "appends": self.appends,
+            }
@@ -0,0 +1,217 @@
+# in memory cache of price histories, one set of numpy arrays per ticker
+# the same popular tickers get asked for over and over during a class, this saves going to sqlite (and building tuples) every time
+# dates are stored as day numbers (days since 1970-01-01), so a date range is found with a binary search (searchsorted) and sliced out
+# the store holds at most max_bytes of arrays, the least recently used ticker is dropped when it is full
+# (arrays mapped from the price archive count towards that too, each one keeps a file open)
+
+import datetime
+import threading
+from collections import OrderedDict
+import numpy as np
+import constants
+
+# the price columns of a history, in the same order as stock_data
+price_columns = ["open", "high", "low", "close",
+                 "volume", "dividends", "stock_splits"]
+# the matching columns in a yfinance style dataframe
+dataframe_columns = ["Open", "High", "Low", "Close",
+                     "Volume", "Dividends", "Stock Splits"]
+
+epoch = datetime.datetime(1970, 1, 1)
+
+
+# datetime -> day number
+def date_to_day(date):
+    return (date - epoch).days
+
+
+# day number -> datetime
+def day_to_date(day):
+    return epoch + datetime.timedelta(days=int(day))
+
+
+# array of day numbers -> array of yyyy-mm-dd strings
+def days_to_strings(days):
+    return np.datetime_as_string(days.astype("datetime64[D]"), unit="D")
+
+
+# yfinance style dataframe -> (days, {column: array})
+def columns_from_dataframe(df):
+    days = np.asarray(df.index.strftime(constants.date_format),
+                      dtype="datetime64[D]").astype(np.int32)
+    columns = {
+        column: df[df_column].to_numpy(dtype=np.float64)
+        for column, df_column in zip(price_columns, dataframe_columns)
+    }
+    return days, columns
+
+
+# (day number, open, high, low, close, volume, dividends, stock_splits) rows (what getTickerRows returns) -> (days, {column: array})
+def columns_from_rows(rows):
+    if len(rows) <= 0:
+        return np.empty(0, dtype=np.int32), {column: np.empty(0, dtype=np.float64) for column in price_columns}
+    values = list(zip(*rows))
+    days = np.array(values[0], dtype=np.int32)
+    columns = {
+        column: np.array(values[i + 1], dtype=np.float64)
+        for i, column in enumerate(price_columns)
+    }
+    return days, columns
+
+
+# converts a numpy column to python numbers the way sqlite would give them back
+# (sqlite stores whole numbers in numeric columns as integers, so 0.0 comes back as 0), keeps the json we send the same as it always was
+def column_to_python(column):
+    whole = column == np.floor(column)
+    if whole.all():
+        return column.astype(np.int64).tolist()
+    if not whole.any():
+        return column.tolist()
+    return np.where(whole, column.astype(np.int64).astype(object), column.astype(object)).tolist()
+
+
+# the arrays for one ticker
+class priceHistory:
+
+    def __init__(self, days, columns, loaded_through, mapped=False):
+        self.days = days
+        self.columns = columns
+        # every bar up to this day number is in the arrays (we had fetched up to here when we loaded them)
+        self.loaded_through = loaded_through
+        # true if the arrays are a read only mapping of a price archive file (see price_archive.py) instead of our own memory
+        self.mapped = mapped
+        self.nbytes = days.nbytes + \
+            sum(column.nbytes for column in columns.values())
+
+    def last_day(self):
+        if len(self.days) <= 0:
+            return None
+        return int(self.days[-1])
+
+    # returns the index range [lo, hi) of the bars from start_day to end_day (both inclusive)
+    def find_range(self, start_day, end_day):
+        lo = np.searchsorted(self.days, start_day, side="left")
+        hi = np.searchsorted(self.days, end_day, side="right")
+        return lo, hi
+
+    # returns the bars from start_day to end_day as (days, {column: array}), views of our arrays (not copies)
+    # fields picks which price columns to include (all of them by default), limit is the most bars to return (the first ones)
+    def slice(self, start_day, end_day, fields=None, limit=None):
+        lo, hi = self.find_range(start_day, end_day)
+        if limit is not None:
+            hi = min(hi, lo + limit)
+        if fields is None:
+            fields = price_columns
+        return self.days[lo:hi], {column: self.columns[column][lo:hi] for column in fields}
+
+    # returns the bars from start_day to end_day as (date, ticker, open, high, low, close, volume, dividends, stock_splits) tuples (what searchForTicker returns)
+    def rows(self, ticker, start_day, end_day):
+        lo, hi = self.find_range(start_day, end_day)
+        if hi <= lo:
+            return []
+        columns = [column_to_python(self.columns[column][lo:hi])
+                   for column in price_columns]
+        return list(zip(days_to_strings(self.days[lo:hi]).tolist(), [ticker] * (hi - lo), *columns))
+
+
+class priceHistoryStore:
+
+    def __init__(self, max_bytes=constants.price_store_max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # ticker -> priceHistory, least recently used first
+        self.nbytes = 0
+        self.mapped_bytes = 0  # the part of nbytes that is mapped from the price archive (shared with the other processes)
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.extends = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    # returns the priceHistory for a ticker (None if we don't have it)
+    def get(self, ticker):
+        with self.lock:
+            entry = self.entries.get(ticker)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(ticker)
+            return entry
+
+    # stores a ticker's full history, loaded_through is the day number we have every bar up to
+    # mapped is true for arrays from the price archive
+    def put(self, ticker, days, columns, loaded_through, mapped=False):
+        entry = priceHistory(days, columns, loaded_through, mapped)
+        with self.lock:
+            self.replace(ticker, entry)
+        return entry
+
+    # adds bars that come after the ones we have (new daily bars) to a ticker's history
+    # start_day to end_day is the range the bars were fetched for, if it doesn't line up with what we have we just drop the ticker and load it again next time
+    # returns the new priceHistory, None if the ticker isn't (or is no longer) in the store
+    def extend(self, ticker, days, columns, start_day, end_day):
+        with self.lock:
+            entry = self.entries.get(ticker)
+            if entry is None:
+                return None
+            last_day = entry.last_day()
+            if start_day > entry.loaded_through + 1 or (len(days) > 0 and last_day is not None and days[0] <= last_day):
+                self.remove(ticker)
+                self.invalidations += 1
+                return None
+            # new arrays instead of changing the old ones, anyone still reading the old entry keeps a consistent copy
+            new_entry = priceHistory(
+                np.concatenate([entry.days, days]),
+                {column: np.concatenate([entry.columns[column], columns[column]])
+                 for column in price_columns},
+                max(entry.loaded_through, end_day),
+            )
+            self.replace(ticker, new_entry)
+            self.extends += 1
+            return new_entry
+
+    # drops a ticker from the store
+    def invalidate(self, ticker):
+        with self.lock:
+            if ticker in self.entries:
+                self.remove(ticker)
+                self.invalidations += 1
+
+    # the lock must be held for these two
+    def replace(self, ticker, entry):
+        if ticker in self.entries:
+            self.remove(ticker)
+        self.entries[ticker] = entry
+        self.nbytes += entry.nbytes
+        if entry.mapped:
+            self.mapped_bytes += entry.nbytes
+        # drop the least recently used tickers until we fit (always keep the one we just added)
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            oldest = next(iter(self.entries))
+            self.remove(oldest)
+            self.evictions += 1
+
+    def remove(self, ticker):
+        entry = self.entries.pop(ticker)
+        self.nbytes -= entry.nbytes
+        if entry.mapped:
+            self.mapped_bytes -= entry.nbytes
+
+    # memory use and hit rate
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "tickers": len(self.entries),
+                "bytes": self.nbytes,
+                "mapped_bytes": self.mapped_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups > 0 else None,
+                "extends": self.extends,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,165 @@
+# in memory cache for current stock prices
+# every quote (and every buy/sell) used to be its own request to yahoo, this keeps recent prices around for a short time instead
+# - prices younger than ttl seconds are returned straight from the cache
+# - prices older than that (but within stale_ttl more seconds) are still returned right away, and a background thread fetches a fresh one (stale while revalidate)
+# - anything older is fetched before returning
+# get(ticker, allow_stale=False) never serves a stale price, a trade has to be priced with a fresh one
+# the cache holds at most max_size tickers, the least recently used one is dropped when it is full
+# get_many does the same for a list of tickers, with every ticker it has to fetch in one request
+# on_price (if given) is called with (ticker, price) whenever a price is stored, so the leaderboard hears about prices that moved
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import constants
+
+logger = logging.getLogger(__name__)
+
+
+class quoteCache:
+
+    # fetch_quote is any function that takes a ticker and returns its current price (or None if there isn't one)
+    # so tests (or an offline server) can pass in their own instead of going to yahoo
+    # fetch_quotes takes a list of tickers and returns {ticker: price or None}, by default it calls fetch_quote for each of them
+    def __init__(self, fetch_quote, ttl=constants.quote_cache_ttl, stale_ttl=constants.quote_cache_stale_ttl, max_size=constants.quote_cache_size, fetch_quotes=None, on_price=None):
+        self.fetch_quote = fetch_quote
+        self.on_price = on_price
+        if fetch_quotes is None:
+            def fetch_quotes(tickers):
+                return {ticker: fetch_quote(ticker) for ticker in tickers}
+        self.fetch_quotes = fetch_quotes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_size = max_size
+
+        self.entries = OrderedDict()  # ticker -> (price, time it was fetched), ordered from least to most recently used
+        self.refreshing = set()  # tickers that already have a background refresh queued
+        self.refresh_pool = ThreadPoolExecutor(
+            max_workers=constants.quote_refresh_workers, thread_name_prefix="quote-refresh")
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.evictions = 0
+        self.batches = 0
+        self.batch_failures = 0
+
+    # returns the price for a ticker, from the cache if we can
+    # allow_stale=False fetches a stale price again before returning it (instead of in the background)
+    def get(self, ticker, allow_stale=True):
+        with self.lock:
+            found, price = self.lookup(ticker, time.monotonic(), allow_stale)
+        if found:
+            return price
+
+        price = self.fetch_quote(ticker)
+        if price is not None:
+            self.put(ticker, price)
+        return price
+
+    # returns {ticker: price or None} for a list of tickers, the ones that aren't in the cache (or have expired) are fetched with one fetch_quotes call
+    # if that call fails, the tickers it was for are left out of the result (the ones we had are still there)
+    def get_many(self, tickers):
+        prices = {}
+        missing = []
+        with self.lock:
+            now = time.monotonic()
+            for ticker in tickers:
+                found, price = self.lookup(ticker, now)
+                if found:
+                    prices[ticker] = price
+                else:
+                    missing.append(ticker)
+            if len(missing) > 0:
+                self.batches += 1
+        if len(missing) <= 0:
+            return prices
+
+        try:
+            fetched = self.fetch_quotes(missing)
+        except Exception as e:
+            logger.warning("failed to fetch quotes for %s: %s", ",".join(missing), e)
+            with self.lock:
+                self.batch_failures += 1
+            return prices
+        for ticker in missing:
+            price = fetched.get(ticker)
+            if price is not None:
+                self.put(ticker, price)
+            prices[ticker] = price
+        return prices
+
+    # checks the cache for a ticker (the lock must be held), returns (True, price) if it can be served from the cache, (False, None) if it has to be fetched
+    # a stale price is served (if allow_stale), and a background refresh is queued for it
+    def lookup(self, ticker, now, allow_stale=True):
+        entry = self.entries.get(ticker)
+        if entry is not None:
+            price, fetched_at = entry
+            age = now - fetched_at
+            if age < self.ttl:
+                self.hits += 1
+                self.entries.move_to_end(ticker)
+                return True, price
+            if allow_stale and age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self.entries.move_to_end(ticker)
+                if ticker not in self.refreshing:
+                    self.refreshing.add(ticker)
+                    self.refresh_pool.submit(self.refresh, ticker)
+                return True, price
+        self.misses += 1
+        return False, None
+
+    # stores a price for a ticker (dropping the least recently used ticker if we are full)
+    def put(self, ticker, price):
+        with self.lock:
+            self.entries[ticker] = (price, time.monotonic())
+            self.entries.move_to_end(ticker)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        # outside the lock, the listener takes its own
+        if self.on_price is not None:
+            self.on_price(ticker, price)
+
+    # runs on the refresh pool, gets a fresh price for a stale ticker
+    def refresh(self, ticker):
+        try:
+            price = self.fetch_quote(ticker)
+            if price is not None:
+                self.put(ticker, price)
+            with self.lock:
+                self.refreshes += 1
+        except Exception as e:
+            # keep serving the stale price, the next request after it expires will try again
+            logger.warning("failed to refresh quote for %s: %s", ticker, e)
+            with self.lock:
+                self.refresh_failures += 1
+        finally:
+            with self.lock:
+                self.refreshing.discard(ticker)
+
+    # hit/miss/staleness counters so the ttl and size can be tuned
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "stale_ttl": self.stale_ttl,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits + self.stale_hits) / lookups if lookups > 0 else None,
+                "refreshes": self.refreshes,
+                "refresh_failures": self.refresh_failures,
+                "evictions": self.evictions,
+                "batches": self.batches,
+                "batch_failures": self.batch_failures,
+            }
@@ -0,0 +1,52 @@
+# bounded thread pools for the blocking work behind the rest handlers
+# sqlite3 and yfinance both block, so calling them straight from an async handler freezes the event loop (and every other client) until they return
+# the handlers hand that work to one of these executors instead and await the result
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# raised when an executor already has as much queued work as it is allowed, rest.py turns this into a 503
+class executorSaturated(Exception):
+    pass
+
+
+class boundedExecutor:
+
+    # max_workers is how many calls run at once, max_pending is how many can be running or waiting in total before we start refusing work
+    def __init__(self, name, max_workers, max_pending):
+        self.name = name
+        self.max_pending = max_pending
+        self.pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=name)
+        self.pending = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    # runs fn(*args) on the pool and waits for it without blocking the event loop
+    async def run(self, fn, *args):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise executorSaturated(self.name + " executor is full")
+            self.pending += 1
+
+        return await asyncio.wrap_future(self.pool.submit(self._call, fn, args))
+
+    # runs on the pool thread, the slot is only freed once the work is actually done (even if the client gave up waiting on it)
+    def _call(self, fn, args):
+        try:
+            return fn(*args)
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    # current queue depth and how many calls have been turned away (useful to tune the pool sizes)
+    def stats(self):
+        with self.lock:
+            return {
+                "pending": self.pending,
+                "max_pending": self.max_pending,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,171 @@
+# turns daily bars into weekly, monthly or yearly ones, and picks a few points out of a long series for drawing a chart
+# everything works on the price store's arrays (see price_history_store.py) with numpy, no python loop over the bars
+#
+# a resampled bar has the open of its first day, the close of its last day, the highest high, the lowest low, the total volume and dividends,
+# and the combined split ratio of any splits in it (0 if there weren't any, same as a daily bar), its date is its first trading day
+# weeks start on monday
+#
+# the resampled bars of a ticker's whole history are cached per (ticker, interval), a request for part of the history slices them out
+# (only the first and last bar are worked out again if the range starts or ends in the middle of a week/month/year)
+
+import threading
+from collections import OrderedDict
+import numpy as np
+import constants
+from price_history_store import price_columns
+
+intervals = ["day", "week", "month", "year"]
+
+
+# the week/month/year each day number is in, as a number that goes up by one for every new period
+def period_keys(days, interval):
+    if interval == "week":
+        # day 0 (1970-01-01) was a thursday, +3 makes the weeks start on monday
+        return (days.astype(np.int64) + 3) // 7
+    if interval == "month":
+        return days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    if interval == "year":
+        return days.astype("datetime64[D]").astype("datetime64[Y]").astype(np.int64)
+    raise ValueError("unknown interval " + str(interval))
+
+
+# combines the bars of days/columns into one bar per group, starts is the index of the first bar of each group (groups are back to back and cover every bar)
+# returns (days, columns) of the combined bars
+def aggregate(days, columns, starts):
+    ends = np.append(starts[1:], len(days))
+    splits = columns["stock_splits"]
+    had_split = np.add.reduceat((splits != 0).astype(np.int64), starts) > 0
+    combined = {
+        "open": columns["open"][starts],
+        "high": np.maximum.reduceat(columns["high"], starts),
+        "low": np.minimum.reduceat(columns["low"], starts),
+        "close": columns["close"][ends - 1],
+        "volume": np.add.reduceat(columns["volume"], starts),
+        "dividends": np.add.reduceat(columns["dividends"], starts),
+        "stock_splits": np.where(had_split, np.multiply.reduceat(np.where(splits != 0, splits, 1.0), starts), 0.0),
+    }
+    return days[starts], combined
+
+
+# the resampled bars of a ticker's whole history
+class resampledHistory:
+
+    def __init__(self, entry, interval):
+        # the priceHistory these came from, if the price store has a different one for the ticker now these are out of date
+        self.entry = entry
+        keys = period_keys(entry.days, interval)
+        # index (into the daily arrays) of the first and one past the last bar of each period
+        self.starts = np.flatnonzero(np.diff(keys)) + 1
+        self.starts = np.insert(self.starts, 0, 0) if len(
+            entry.days) > 0 else self.starts
+        self.ends = np.append(self.starts[1:], len(entry.days))
+        if len(entry.days) > 0:
+            self.days, self.columns = aggregate(
+                entry.days, entry.columns, self.starts)
+        else:
+            self.days = entry.days
+            self.columns = entry.columns
+
+    # the resampled bars for the daily bars lo to hi (index range [lo, hi) of the daily arrays)
+    def range(self, lo, hi):
+        if hi <= lo:
+            return self.days[:0], {column: self.columns[column][:0] for column in price_columns}
+        first = np.searchsorted(self.starts, lo, side="right") - 1
+        last = np.searchsorted(self.starts, hi - 1, side="right") - 1
+        days = self.days[first:last + 1].copy()
+        columns = {column: self.columns[column][first:last + 1].copy()
+                   for column in price_columns}
+        # the periods at the edges only count the days inside the range
+        if self.starts[first] != lo or (first == last and self.ends[last] != hi):
+            self.replace_bar(days, columns, 0, lo, min(self.ends[first], hi))
+        if last != first and self.ends[last] != hi:
+            self.replace_bar(days, columns, len(days) - 1,
+                             self.starts[last], hi)
+        return days, columns
+
+    # works out bar i again from just the daily bars lo to hi
+    def replace_bar(self, days, columns, i, lo, hi):
+        bar_days, bar = aggregate(self.entry.days[lo:hi], {column: self.entry.columns[column][lo:hi]
+                                                           for column in price_columns}, np.array([0]))
+        days[i] = bar_days[0]
+        for column in price_columns:
+            columns[column][i] = bar[column][0]
+
+
+# largest triangle three buckets: picks points of the series (x, y) that keep its shape when it is drawn with only that many points
+# returns the indexes of the points it picked (always the first and the last)
+def lttb(x, y, points):
+    num = len(x)
+    if points >= num:
+        return np.arange(num)
+    if points < 3:
+        return np.array([0, num - 1])[:points]
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # the points between the first and the last are split into points - 2 buckets, bucket i is edges[i] to edges[i + 1]
+    edges = (np.floor(np.arange(points - 1) * (num - 2) / (points - 2)) + 1).astype(np.int64)
+    edges[-1] = num - 1
+    sizes = np.diff(edges)
+    # the average point of every bucket (what the triangle for the bucket before it points at), then the last point
+    average_x = np.append(np.add.reduceat(
+        x[:num - 1], edges[:-1]) / sizes, x[-1])
+    average_y = np.append(np.add.reduceat(
+        y[:num - 1], edges[:-1]) / sizes, y[-1])
+
+    picked = np.empty(points, dtype=np.int64)
+    picked[0] = 0
+    picked[-1] = num - 1
+    previous = 0
+    # each pick depends on the one before it, so this loops over the buckets (not the points)
+    for i in range(points - 2):
+        lo = edges[i]
+        hi = edges[i + 1]
+        next_x = average_x[i + 1]
+        next_y = average_y[i + 1]
+        areas = np.abs((x[previous] - next_x) * (y[lo:hi] - y[previous]) -
+                       (x[previous] - x[lo:hi]) * (next_y - y[previous]))
+        previous = lo + int(np.argmax(areas))
+        picked[i + 1] = previous
+    return picked
+
+
+class resampleCache:
+
+    def __init__(self, max_size=constants.resample_cache_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # (ticker, interval) -> resampledHistory, least recently used first
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    # the resampled bars of a ticker for the priceHistory the price store has for it now (entry)
+    # worked out again if the ticker got new bars since (the price store gives it a new priceHistory)
+    def get(self, ticker, interval, entry):
+        key = (ticker, interval)
+        with self.lock:
+            resampled = self.entries.get(key)
+            if resampled is not None and resampled.entry is entry:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return resampled
+            self.misses += 1
+
+        resampled = resampledHistory(entry, interval)
+        with self.lock:
+            self.entries[key] = resampled
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return resampled
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups > 0 else None,
+            }
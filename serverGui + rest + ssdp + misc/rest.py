@@ -5,45 +5,286 @@
 # Exposes web headers that we can make requests to for data
 # essentially allowing us to use all of the database manager methods over a web request
 
-from fastapi import FastAPI, Query, Response, status
+from fastapi import FastAPI, Header, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
 import database_manager
+import history_encoding
+import http_caching
+import resampling
+import indicators
+import price_adjustments
+from market_data_provider import marketDataUnavailable
+from price_history_store import days_to_strings, date_to_day
+from request_executor import boundedExecutor, executorSaturated
 from typing import List
 import json
 import datetime
+import math
+import numpy as np
 import constants
 
 app = FastAPI()  # instance of the FastAPI library
 # my database manager class (lets us manager the user_daata and stock_data databases)
 database = database_manager.database_manager()
 
+# every database_manager call blocks, so the handlers run them on these pools instead of on the event loop
+# db_executor is for calls that only touch sqlite, market_executor is for calls that can end up waiting on yahoo finance
+# they are separate so a slow yahoo fetch can't use up the threads that logins and balance checks need
+db_executor = boundedExecutor(
+    "db", constants.db_executor_workers, constants.db_executor_max_pending)
+market_executor = boundedExecutor(
+    "market", constants.market_executor_workers, constants.market_executor_max_pending)
+
+
+# when an executor already has too much queued work, tell the client to try again instead of letting the queue grow forever
+@app.exception_handler(executorSaturated)
+async def executor_saturated_handler(request: Request, exc: executorSaturated):
+    return Response(content=json.dumps({"valid": "false"}), media_type="application/json",
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
+
+
+# same when yahoo couldn't be reached, we don't know anything about the ticker so it can't be answered either way
+@app.exception_handler(marketDataUnavailable)
+async def market_data_unavailable_handler(request: Request, exc: marketDataUnavailable):
+    return Response(content=json.dumps({"valid": "false"}), media_type="application/json",
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": str(constants.market_data_retry_after)})
+
+
+# streams a history (days, columns) back in body_format (see history_encoding.py), gzipped if it is big and the client accepts gzip
+# starlette runs a plain generator on its thread pool, so the encoding (and gzipping) doesn't happen on the event loop
+def history_response(body_format, ticker, history, field_list, accept_encoding, next_cursor=None):
+    body = history_encoding.encode_history(
+        body_format, ticker, history, field_list, next_cursor)
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = next_cursor
+    num_rows = 0 if history is None else len(history[0])
+    if history_encoding.accepts_gzip(accept_encoding) and history_encoding.estimate_size(body_format, num_rows, field_list) >= constants.history_gzip_min_bytes:
+        body = history_encoding.gzip_chunks(body)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type=history_encoding.media_types[body_format], headers=headers)
+
+
+# the ETag of a history style request (see http_caching.py) and whether nothing new can show up in the response (see database_manager.history_validator)
+# (None, False) if we don't know the ticker yet
+# on the db executor, the first call loads the ticker registry and adjusted ones may read the price archive
+async def request_etag(request, ticker, end, representation, adjustment="split"):
+    validator = await db_executor.run(database.history_validator, ticker, end, adjustment)
+    if validator is None:
+        return None, False
+    through, complete, actions = validator
+    etag = http_caching.history_etag(
+        request.url.path, request.query_params.multi_items(), representation, through, actions)
+    return etag, complete
+
+
+# request_etag before the data is fetched, only worth working out for a conditional request (it may let us answer 304 without fetching anything)
+# otherwise (None, False), and the ETag is worked out once after the fetch
+async def early_etag(request, ticker, end, representation, adjustment, if_none_match):
+    if if_none_match is None:
+        return None, False
+    return await request_etag(request, ticker, end, representation, adjustment)
+
+
+# adds the ETag and Cache-Control headers to a history style response
+# complete is from request_etag, found is False if the response has no history in it
+def add_cache_headers(response, etag, complete, end, adjustment="split", found=True):
+    if etag is not None:
+        response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = http_caching.history_cache_control(
+        end, database.provider.today(), complete and etag is not None, adjustment != "raw", found)
+    return response
+
+
+# the response to a conditional request whose ETag matched, the client already has the body
+# vary is the Vary header the full response would have had
+def not_modified(etag, complete, end, vary=None, adjustment="split"):
+    headers = {} if vary is None else {"Vary": vary}
+    return add_cache_headers(Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers), etag, complete, end, adjustment)
+
+
+# turns the tickers url parameter (i.e "AAPL,MSFT") into a list of tickers (duplicates dropped), None if there are none or more than constants.batch_max_tickers
+def parse_tickers(text):
+    tickers = list(dict.fromkeys(
+        ticker.strip() for ticker in text.split(",") if ticker.strip() != ""))
+    if len(tickers) <= 0 or len(tickers) > constants.batch_max_tickers:
+        return None
+    return tickers
+
+
 # example of url paramters: /get_stock_history_by_ticker?ticker=AAPL&start=2022-01-01&end=2023-01-26
 
 # this header allows you pass a ticker, start and end date (format yyyy-mm-dd) as url paramtere and receive the history for a stock ticker
+# format picks how the history is sent: rows (default), columns or binary (see history_encoding.py), an Accept: application/octet-stream header also gets binary
+# fields picks which columns are sent, i.e fields=date,close
+# limit sends the history in pages of at most limit bars, pass the next_cursor from a page (also in the X-Next-Cursor header) as cursor to get the next one
+# the body is streamed, and gzipped when it is big and the client sends Accept-Encoding: gzip
+# the response has an ETag, send it back in If-None-Match to get a 304 if nothing changed (see http_caching.py)
+# prices are adjusted for splits (the way yahoo sends them), adjusted=true adjusts them for dividends too
+# and raw=true sends what they actually were on the day (the same prices buy_stock/sell_stock trade at), see price_adjustments.py
 
 
 @app.get("/get_stock_history_by_ticker")
 async def get_stock_history_by_ticker(
+    request: Request,
     response: Response,
     ticker: str = Query(None),
     start: str = Query(
         default=None, regex="^\d{4}-\d{2}-\d{2}$", format="date"),  # the regex ensures that the passed argument matches yyyy-mm-dd
-    end: str = Query(default=None, regex="^\d{4}-\d{2}-\d{2}$", format="date")
+    end: str = Query(default=None, regex="^\d{4}-\d{2}-\d{2}$", format="date"),
+    format: str = Query(None),
+    fields: str = Query(None),
+    limit: int = Query(None),
+    cursor: str = Query(default=None, regex="^\d{4}-\d{2}-\d{2}$"),
+    adjusted: bool = Query(False),
+    raw: bool = Query(False),
+    accept: str = Header(None),
+    accept_encoding: str = Header(None),
+    if_none_match: str = Header(None)
 ):
     # data is our response object, valid=false means that it didn't complete the request properly, true means it did
     data = {"valid": "true"}
-    if ticker is None or start is None or end is None:
+    body_format = history_encoding.choose_format(format, accept)
+    field_list = None if fields is None else history_encoding.parse_fields(fields)
+    adjustment = price_adjustments.adjustment_from_params(adjusted, raw)
+    if (ticker is None or start is None or end is None or body_format is None or (fields is not None and field_list is None) or (limit is not None and limit < 1)
+            or adjustment is None):
         data["valid"] = "false"
         # return status code 422 when data received is invalid
         response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
         return Response(content=json.dumps(data), media_type="application/json")
     start = datetime.datetime.strptime(start, constants.date_format)
     end = datetime.datetime.strptime(end, constants.date_format)
+    # the cursor is the date of the last bar of the previous page
+    after = None if cursor is None else datetime.datetime.strptime(
+        cursor, constants.date_format)
+    # past bars never change, if we have every bar of the range and the client has this exact response already, tell it to use that
+    representation = (body_format, history_encoding.accepts_gzip(accept_encoding))
+    etag, complete = await early_etag(request, ticker, end, representation, adjustment, if_none_match)
+    if complete and http_caching.etag_matches(if_none_match, etag):
+        return not_modified(etag, complete, end, "Accept, Accept-Encoding", adjustment)
     # need proper error checking, yfinance could fail, sqlite3 could fail, ...
-    # call our get_stock_history_by_ticker method from our database manager
-    ticker_data = database.get_stock_history_by_ticker(ticker, start, end)
-    data[ticker] = ticker_data  # add the data to the data object
-    # return the data in a json format
-    return Response(content=json.dumps(data), media_type="application/json")
+    # call our get_stock_history_columns method from our database manager (the arrays, the response is built from them as it is sent)
+    page = await market_executor.run(database.get_stock_history_columns, ticker, start, end, field_list, limit, after, adjustment)
+    history = None if page is None else page[:2]
+    next_cursor = None if page is None or page[2] is None else page[2].strftime(
+        constants.date_format)
+
+    if not complete:
+        # we may have just fetched new bars, so work the ETag out now
+        etag, complete = await request_etag(request, ticker, end, representation, adjustment)
+        if http_caching.etag_matches(if_none_match, etag):
+            return not_modified(etag, complete, end, "Accept, Accept-Encoding", adjustment)
+    return add_cache_headers(history_response(body_format, ticker, history, field_list, accept_encoding, next_cursor), etag, complete, end, adjustment, history is not None)
+
+
+# example of url paramters: /get_stock_chart?ticker=AAPL&start=2000-01-01&end=2023-01-26&interval=month&points=200
+
+# this header returns a ticker's history for drawing a chart, resampled to interval (day, week, month or year) bars
+# points (optional) is the most bars to send, they are picked to keep the shape of the close price (lttb, see resampling.py)
+# format, fields, adjusted, raw and the ETag work the same as in get_stock_history_by_ticker, the date of a week/month/year bar is its first trading day
+
+
+@app.get("/get_stock_chart")
+async def get_stock_chart(
+    request: Request,
+    response: Response,
+    ticker: str = Query(None),
+    start: str = Query(
+        default=None, regex="^\d{4}-\d{2}-\d{2}$", format="date"),
+    end: str = Query(default=None, regex="^\d{4}-\d{2}-\d{2}$", format="date"),
+    interval: str = Query("day"),
+    points: int = Query(None),
+    format: str = Query(None),
+    fields: str = Query(None),
+    adjusted: bool = Query(False),
+    raw: bool = Query(False),
+    accept: str = Header(None),
+    accept_encoding: str = Header(None),
+    if_none_match: str = Header(None)
+):
+    data = {"valid": "true"}
+    body_format = history_encoding.choose_format(format, accept)
+    field_list = None if fields is None else history_encoding.parse_fields(fields)
+    adjustment = price_adjustments.adjustment_from_params(adjusted, raw)
+    if (ticker is None or start is None or end is None or body_format is None or (fields is not None and field_list is None)
+            or interval not in resampling.intervals or (points is not None and (points < 2 or points > constants.chart_max_points)) or adjustment is None):
+        data["valid"] = "false"
+        response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+        return Response(content=json.dumps(data), media_type="application/json")
+    start = datetime.datetime.strptime(start, constants.date_format)
+    end = datetime.datetime.strptime(end, constants.date_format)
+    representation = (body_format, history_encoding.accepts_gzip(accept_encoding))
+    etag, complete = await early_etag(request, ticker, end, representation, adjustment, if_none_match)
+    if complete and http_caching.etag_matches(if_none_match, etag):
+        return not_modified(etag, complete, end, "Accept, Accept-Encoding", adjustment)
+    history = await market_executor.run(database.get_stock_chart, ticker, start, end, interval, points, adjustment)
+    if not complete:
+        etag, complete = await request_etag(request, ticker, end, representation, adjustment)
+        if http_caching.etag_matches(if_none_match, etag):
+            return not_modified(etag, complete, end, "Accept, Accept-Encoding", adjustment)
+    return add_cache_headers(history_response(body_format, ticker, history, field_list, accept_encoding), etag, complete, end, adjustment, history is not None)
+
+
+# example of url paramters: /get_stock_indicator?ticker=AAPL&start=2022-01-01&end=2023-01-26&indicator=sma&window=50
+
+# this header returns a technical indicator for a ticker: sma, ema, rsi, volatility (annualized), returns or drawdown (see indicators.py)
+# window is the number of days for sma, ema, rsi and volatility (defaults 20, 20, 14 and 20)
+# it is worked out from prices adjusted for splits (a split is otherwise a huge drop in the price), adjusted=true adjusts them for dividends too and raw=true doesn't adjust them
+# the ETag works the same as in get_stock_history_by_ticker
+# the result is {"valid": "true", "<TICKER>": {"date": [...], "<indicator>": [...]}}, a value that doesn't exist yet (i.e before the window is full) is null
+
+
+@app.get("/get_stock_indicator")
+async def get_stock_indicator(
+    request: Request,
+    response: Response,
+    ticker: str = Query(None),
+    start: str = Query(
+        default=None, regex="^\d{4}-\d{2}-\d{2}$", format="date"),
+    end: str = Query(default=None, regex="^\d{4}-\d{2}-\d{2}$", format="date"),
+    indicator: str = Query(None),
+    window: int = Query(None),
+    adjusted: bool = Query(False),
+    raw: bool = Query(False),
+    if_none_match: str = Header(None)
+):
+    data = {"valid": "true"}
+    adjustment = price_adjustments.adjustment_from_params(adjusted, raw)
+    if (ticker is None or start is None or end is None or indicator not in indicators.indicator_names
+            or (window is not None and (window < 1 or window > constants.indicator_max_window)) or adjustment is None):
+        data["valid"] = "false"
+        response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+        return Response(content=json.dumps(data), media_type="application/json")
+    start = datetime.datetime.strptime(start, constants.date_format)
+    end = datetime.datetime.strptime(end, constants.date_format)
+    etag, complete = await early_etag(request, ticker, end, None, adjustment, if_none_match)
+    if complete and http_caching.etag_matches(if_none_match, etag):
+        return not_modified(etag, complete, end, adjustment=adjustment)
+    body, found = await market_executor.run(indicator_json, ticker, start, end, indicator, window, adjustment)
+    if not complete:
+        etag, complete = await request_etag(request, ticker, end, None, adjustment)
+        if http_caching.etag_matches(if_none_match, etag):
+            return not_modified(etag, complete, end, adjustment=adjustment)
+    return add_cache_headers(Response(content=body, media_type="application/json"), etag, complete, end, adjustment, found)
+
+
+# works out an indicator and turns it into get_stock_indicator's json body, returns (the body, False if there was no history for it)
+# the series can be decades of days long, so the json is built here on the market executor instead of on the event loop
+def indicator_json(ticker, start, end, indicator, window, adjustment):
+    data = {"valid": "true"}
+    result = database.get_stock_indicator(
+        ticker, start, end, indicator, window, adjustment)
+    if result is None:
+        data[ticker] = None
+        return json.dumps(data), False
+    days, values = result
+    data[ticker] = {
+        "date": days_to_strings(days).tolist(),
+        # nan isn't valid json, send null instead
+        indicator: [None if math.isnan(value) else value for value in values.tolist()],
+    }
+    return json.dumps(data), True
 
 
 # get_balance header returns the balance for a user. Takes the id as a url paramter
@@ -54,7 +295,7 @@ async def get_balance(response: Response, id: str = Query(None)):
         data["valid"] = "false"
         response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
         return Response(content=json.dumps(data), media_type="application/json")
-    balance = database.get_user_balance(id)
+    balance = await db_executor.run(database.get_user_balance, id)
     data["balance"] = balance
     return Response(content=json.dumps(data), media_type="application/json")
 
@@ -68,7 +309,9 @@ async def buy_stock(response: Response, id: str = Query(None), ticker: str = Que
         data["valid"] = "false"
         response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
         return Response(content=json.dumps(data), media_type="application/json")
-    response = database.buy_stock(id, ticker, amount)
+    # the checks and the price lookup run on the market executor, then the write waits for its batch on the write queue (see write_queue.py)
+    intent = await market_executor.run(database.prepare_buy_stock, id, ticker, amount)
+    response = None if intent is None else await database.user_writes.run(intent)
     if response is None:
         response = "false"
     data["valid"] = str(response).lower()
@@ -84,7 +327,8 @@ async def sell_stock(response: Response, id: str = Query(None), ticker: str = Qu
         data["valid"] = "false"
         response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
         return Response(content=json.dumps(data), media_type="application/json")
-    response = database.sell_stock(id, ticker, amount)
+    intent = await market_executor.run(database.prepare_sell_stock, id, ticker, amount)
+    response = None if intent is None else await database.user_writes.run(intent)
     if response is None:
         response = "false"
     data["valid"] = str(response).lower()
@@ -100,12 +344,83 @@ async def get_current_stock_price(response: Response, ticker: str = Query(None))
         data["valid"] = "false"
         response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
         return Response(content=json.dumps(data), media_type="application/json")
-    price = database.get_current_stock_price(ticker)
+    price = await market_executor.run(database.get_current_stock_price, ticker)
     if price is None:
         data["valid"] = "false"
         return Response(content=json.dumps(data), media_type="application/json")
     data["price"] = price
-    return Response(content=json.dumps(data), media_type="application/json")
+    # a client (or proxy) can reuse the price for as long as we would
+    return Response(content=json.dumps(data), media_type="application/json", headers={"Cache-Control": http_caching.quote_cache_control()})
+
+# example of url paramters: /get_current_stock_prices?tickers=AAPL,MSFT,TSLA
+
+# this header returns the current price of several tickers (i.e everything in a portfolio) in one request
+# prices we have cached are answered straight away, the rest are fetched together in one request to yahoo
+# the result is {"valid": "true", "prices": {"<TICKER>": {"status": "ok", "price": 123.4}, ...}},
+# status is "no_data" for a ticker with no price and "error" if fetching it failed
+
+
+@app.get("/get_current_stock_prices")
+async def get_current_stock_prices(response: Response, tickers: str = Query(None)):
+    data = {"valid": "true"}
+    ticker_list = None if tickers is None else parse_tickers(tickers)
+    if ticker_list is None:
+        data["valid"] = "false"
+        response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+        return Response(content=json.dumps(data), media_type="application/json")
+    prices = await market_executor.run(database.get_current_stock_prices, ticker_list)
+    data["prices"] = {}
+    for ticker in ticker_list:
+        if ticker not in prices:
+            data["prices"][ticker] = {"status": "error"}
+        elif prices[ticker] is None:
+            data["prices"][ticker] = {"status": "no_data"}
+        else:
+            data["prices"][ticker] = {"status": "ok", "price": prices[ticker]}
+    return Response(content=json.dumps(data), media_type="application/json", headers={"Cache-Control": http_caching.quote_cache_control()})
+
+
+# example of url paramters: /get_stock_histories?tickers=AAPL,MSFT&start=2022-01-01&end=2023-01-26&fields=date,close
+
+# this header returns the history of several tickers from start to end in one request, fields, adjusted and raw work the same as in get_stock_history_by_ticker
+# tickers that need new bars from yahoo get them together (one request for all of them where we can)
+# the result is {"valid": "true", "histories": {"<TICKER>": {"status": "ok", "history": {"date": [...], "close": [...], ...}}, ...}}
+# status is "no_data" for a ticker with no bars in the range (or that doesn't exist) and "error" if getting it failed
+
+
+@app.get("/get_stock_histories")
+async def get_stock_histories(
+    response: Response,
+    tickers: str = Query(None),
+    start: str = Query(
+        default=None, regex="^\d{4}-\d{2}-\d{2}$", format="date"),
+    end: str = Query(default=None, regex="^\d{4}-\d{2}-\d{2}$", format="date"),
+    fields: str = Query(None),
+    adjusted: bool = Query(False),
+    raw: bool = Query(False),
+    accept_encoding: str = Header(None)
+):
+    data = {"valid": "true"}
+    ticker_list = None if tickers is None else parse_tickers(tickers)
+    field_list = None if fields is None else history_encoding.parse_fields(fields)
+    adjustment = price_adjustments.adjustment_from_params(adjusted, raw)
+    if ticker_list is None or start is None or end is None or (fields is not None and field_list is None) or adjustment is None:
+        data["valid"] = "false"
+        response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+        return Response(content=json.dumps(data), media_type="application/json")
+    start = datetime.datetime.strptime(start, constants.date_format)
+    end = datetime.datetime.strptime(end, constants.date_format)
+    histories = await market_executor.run(database.get_stock_histories, ticker_list, start, end, field_list, adjustment)
+
+    body = history_encoding.encode_histories(histories, field_list)
+    headers = {"Vary": "Accept-Encoding"}
+    num_rows = sum(len(history[0]) for history in histories.values()
+                   if isinstance(history, tuple))
+    if history_encoding.accepts_gzip(accept_encoding) and history_encoding.estimate_size("columns", num_rows, field_list) >= constants.history_gzip_min_bytes:
+        body = history_encoding.gzip_chunks(body)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type="application/json", headers=headers)
+
 
 # login_user header logs in user (returns the id) takes username and password as url params
 
@@ -117,7 +432,7 @@ async def login_user(response: Response, username: str = Query(None), password:
         data["valid"] = "false"
         response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
         return Response(content=json.dumps(data), media_type="application/json")
-    sessionKey = database.login_user(username, password)
+    sessionKey = await db_executor.run(database.login_user, username, password)
     if sessionKey is None:
         data["valid"] = "false"
         return Response(content=json.dumps(data), media_type="application/json")
@@ -134,7 +449,7 @@ async def login_user(response: Response, username: str = Query(None), password:
         data["valid"] = "false"
         response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
         return Response(content=json.dumps(data), media_type="application/json")
-    sessionKey = database.create_user(username, password)
+    sessionKey = await database.user_writes.run(lambda db: db.create_user(username, password))
     if sessionKey is None:
         data["valid"] = "false"
         return Response(content=json.dumps(data), media_type="application/json")
@@ -150,9 +465,143 @@ async def get_user_ticker_data(response: Response, id: str = Query(None)):
         data["valid"] = "false"
         response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
         return Response(content=json.dumps(data), media_type="application/json")
-    user_ticker_data = database.get_user_ticker_data(id)
+    user_ticker_data = await db_executor.run(database.get_user_ticker_data, id)
     if user_ticker_data is None:  # id/username doesn't exist
         data["valid"] = "false"
         return Response(content=json.dumps(data), media_type="application/json")
     data["user_ticker_data"] = user_ticker_data
     return Response(content=json.dumps(data), media_type="application/json")
+
+
+# example of url paramters: /get_user_trades?id=1A2B3C4D&limit=100
+
+# get_user_trades header returns a user's trades, oldest first, as [trade id, time (yyyy-mm-ddThh:mm:ss.sss, server time), ticker, amount, price] rows
+# amount is negative for a sell, limit is the most trades to return (at most constants.trades_max_page)
+# when there are more, next_cursor is in the result, pass it as cursor to get the next page
+@app.get("/get_user_trades")
+async def get_user_trades(response: Response, id: str = Query(None), limit: int = Query(None), cursor: int = Query(0)):
+    data = {"valid": "true"}
+    if id is None or (limit is not None and (limit < 1 or limit > constants.trades_max_page)):
+        data["valid"] = "false"
+        response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+        return Response(content=json.dumps(data), media_type="application/json")
+    limit = constants.trades_max_page if limit is None else limit
+    trades = await db_executor.run(database.get_user_trades, id, cursor, limit)
+    if trades is None:  # id doesn't exist
+        data["valid"] = "false"
+        return Response(content=json.dumps(data), media_type="application/json")
+    data["trades"] = [[trade_id, time.isoformat(timespec="milliseconds"), ticker, amount, price]
+                      for trade_id, time, ticker, amount, price in trades]
+    if len(trades) >= limit:
+        data["next_cursor"] = trades[-1][0]
+    return Response(content=json.dumps(data), media_type="application/json")
+
+
+# example of url paramters: /get_user_state_at?id=1A2B3C4D&time=2023-01-26T10:30:00
+
+# get_user_state_at header returns what a user had at a given time (yyyy-mm-dd or yyyy-mm-ddThh:mm:ss, server time): their balance and {ticker: amount}
+# valid is false if the user doesn't exist or the time is from before we kept a ledger for them
+@app.get("/get_user_state_at")
+async def get_user_state_at(response: Response, id: str = Query(None), time: str = Query(None)):
+    data = {"valid": "true"}
+    try:
+        at = None if time is None else datetime.datetime.fromisoformat(time)
+    except ValueError:
+        at = None
+    if id is None or at is None:
+        data["valid"] = "false"
+        response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+        return Response(content=json.dumps(data), media_type="application/json")
+    state = await db_executor.run(database.get_user_state_at, id, at)
+    if state is None:
+        data["valid"] = "false"
+        return Response(content=json.dumps(data), media_type="application/json")
+    data["balance"], data["positions"] = state
+    return Response(content=json.dumps(data), media_type="application/json")
+
+
+# example of url paramters: /get_user_equity_curve?id=1A2B3C4D&start=2023-01-01&end=2023-06-30
+
+# get_user_equity_curve header returns a user's account value (cash + their stocks at the day's close) at the end of every trading day since their ledger starts
+# as {"date": [...], "value": [...], "cash": [...]}, start and end (yyyy-mm-dd, optional) cut it down to a range
+# the last day is the last complete trading day, trades made today show up tomorrow
+@app.get("/get_user_equity_curve")
+async def get_user_equity_curve(
+    response: Response,
+    id: str = Query(None),
+    start: str = Query(default=None, regex="^\d{4}-\d{2}-\d{2}$"),
+    end: str = Query(default=None, regex="^\d{4}-\d{2}-\d{2}$")
+):
+    data = {"valid": "true"}
+    if id is None:
+        data["valid"] = "false"
+        response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+        return Response(content=json.dumps(data), media_type="application/json")
+    curve = await market_executor.run(database.get_user_equity_curve, id)
+    if curve is None:
+        data["valid"] = "false"
+        return Response(content=json.dumps(data), media_type="application/json")
+    days, values, cash = curve
+    first = 0 if start is None else np.searchsorted(
+        days, date_to_day(datetime.datetime.strptime(start, constants.date_format)), side="left")
+    last = len(days) if end is None else np.searchsorted(
+        days, date_to_day(datetime.datetime.strptime(end, constants.date_format)), side="right")
+    data["date"] = days_to_strings(days[first:last]).tolist()
+    data["value"] = values[first:last].tolist()
+    data["cash"] = cash[first:last].tolist()
+    return Response(content=json.dumps(data), media_type="application/json")
+
+
+# example of url paramters: /get_leaderboard?start=0&count=10
+
+# get_leaderboard header returns the users ranked by what their account is worth (balance + their stocks at the current price), best first
+# count (at most constants.leaderboard_max_page, default 10) users starting after the first start of them, as [{"rank", "username", "value"}, ...], and how many users there are
+@app.get("/get_leaderboard")
+async def get_leaderboard(response: Response, start: int = Query(0), count: int = Query(10)):
+    data = {"valid": "true"}
+    if start < 0 or count <= 0 or count > constants.leaderboard_max_page:
+        data["valid"] = "false"
+        response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+        return Response(content=json.dumps(data), media_type="application/json")
+    # on the market executor, it may have to fetch quotes
+    top, users = await market_executor.run(database.get_leaderboard, start, count)
+    data["leaderboard"] = [{"rank": rank, "username": username, "value": value}
+                           for rank, username, value in top]
+    data["users"] = users
+    return Response(content=json.dumps(data), media_type="application/json")
+
+
+# get_user_rank header returns where a user is on the leaderboard: their rank (1 is first), what their account is worth and how many users there are
+@app.get("/get_user_rank")
+async def get_user_rank(response: Response, id: str = Query(None)):
+    data = {"valid": "true"}
+    if id is None:
+        data["valid"] = "false"
+        response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+        return Response(content=json.dumps(data), media_type="application/json")
+    rank = await market_executor.run(database.get_user_rank, id)
+    if rank is None:
+        data["valid"] = "false"
+        return Response(content=json.dumps(data), media_type="application/json")
+    (data["rank"], data["value"]), data["users"] = rank
+    return Response(content=json.dumps(data), media_type="application/json")
+
+
+# get_server_stats header returns the cache and executor counters (useful for tuning the sizes in constants.py)
+@app.get("/get_server_stats")
+async def get_server_stats(response: Response):
+    data = {"valid": "true"}
+    data["quote_cache"] = database.quote_cache.stats()
+    data["single_flight"] = database.flights.stats()
+    data["ticker_registry"] = database.tickers.stats()
+    data["price_store"] = database.price_store.stats()
+    data["price_archive"] = database.price_archive.stats()
+    data["resample_cache"] = database.resampled.stats()
+    data["indicator_cache"] = database.indicators.stats()
+    data["adjustment_cache"] = database.adjustments.stats()
+    data["write_queue"] = database.user_writes.stats()
+    data["equity_cache"] = database.equity_curves.stats()
+    data["leaderboard"] = database.leaderboard.stats()
+    data["db_executor"] = db_executor.stats()
+    data["market_executor"] = market_executor.stats()
+    return Response(content=json.dumps(data), media_type="application/json")
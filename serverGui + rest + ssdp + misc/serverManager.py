@@ -8,7 +8,11 @@ import socket
 from multiprocessing import Process, freeze_support
 from ssdpy import SSDPServer
 import uvicorn
-from uvicornServer import uvicornServer
+from uvicornServer import uvicornServer, uvicornWorkerPool
+import constants
+import connection_pool
+from stockData_manager import stockData_manager
+from userData_manager import userData_manager
 
 
 class serverManager:
@@ -76,11 +80,15 @@ class serverManager:
             host=str(ipAddress),
             port=int(port),
             reload=False,
-            # more than one worker does not work with pyinstaller (compiling to exe)
-            workers=1,
+            workers=constants.rest_workers,
         )
         # start the uvicorn (rest) server
-        self.uvicornServerManager = uvicornServer(config=config)
+        # uvicorn's own multi worker mode takes over the main thread and doesn't work with pyinstaller (compiling to exe),
+        # so with more than one worker we start and supervise the worker processes ourselves
+        if constants.rest_workers > 1:
+            self.uvicornServerManager = uvicornWorkerPool(config=config)
+        else:
+            self.uvicornServerManager = uvicornServer(config=config)
 
         self.uvicornServerManager.start()
 
@@ -88,6 +96,11 @@ class serverManager:
     def start(self):
         self.isRunning = True
 
+        # bring the database schemas up to date before anything can make a request
+        # (just the two databases, a whole database_manager would start its thread pools, caches and write queue here for nothing)
+        stockData_manager.migrate_file(constants.stock_data_database_path)
+        userData_manager.migrate_file(constants.user_data_database_path)
+
         location = self.get_location()
         self.start_uvicorn_process(location)
         self.start_SSDP_process(location)
@@ -99,3 +112,6 @@ class serverManager:
         self.SSDPProcess.join()
 
         self.uvicornServerManager.stop()
+
+        # the rest server is stopped, so nothing is using the pooled database connections anymore
+        connection_pool.close_all_pools()
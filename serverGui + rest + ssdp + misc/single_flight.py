@@ -0,0 +1,71 @@
+# makes sure only one upstream (yahoo) request is running for the same thing at a time
+# if 30 students ask for the same uncached ticker at once, the first request does the fetch and the other 29 wait for it and get the same result
+
+import threading
+
+
+# one in-flight call, the waiters block on done until the leader has a result (or an error)
+class flightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class singleFlight:
+
+    def __init__(self):
+        self.calls = {}  # key -> flightCall that is currently running
+        self.lock = threading.Lock()
+
+        self.executions = 0  # how many times fn actually ran
+        self.coalesced = 0  # how many calls waited on someone else's fn instead of running their own
+        self.max_waiters = 0  # most callers that ever shared one call
+
+    # runs fn() for key, unless a call for key is already running, in which case it waits for that one and returns its result
+    # exceptions are shared the same way
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                self.max_waiters = max(self.max_waiters, call.waiters)
+                leader = False
+            else:
+                call = flightCall()
+                self.calls[key] = call
+                self.executions += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            # remove it before waking the waiters, so anyone who shows up after this starts a fresh call
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    # how often concurrent calls were merged
+    def stats(self):
+        with self.lock:
+            total = self.executions + self.coalesced
+            return {
+                "in_flight": len(self.calls),
+                "waiting": sum(call.waiters for call in self.calls.values()),
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "coalescing_ratio": self.coalesced / total if total > 0 else None,
+                "max_waiters": self.max_waiters,
+            }
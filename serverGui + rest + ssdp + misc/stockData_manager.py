@@ -7,11 +7,23 @@
 import constants
 import datetime
 from SQLiteWrapper import SQLiteWrapper
+from price_history_store import date_to_day
+
+
+# sql that turns a yyyy-mm-dd value into a day number (2440587.5 is the julian day number of 1970-01-01)
+def day_from_text(value):
+    return "CAST(julianday(" + value + ") - 2440587.5 AS INTEGER)"
+
+
+# sql that turns a day number back into yyyy-mm-dd
+def text_from_day(value):
+    return "date(" + value + " * 86400, 'unixepoch')"
 
 
 class stockData_manager(SQLiteWrapper):  # inherit SQLiteWrapper
 
-    # creates the database and the corresponding table for it
+    # migration 1: creates the database and the corresponding table for it
+    # (IF NOT EXISTS so it also applies cleanly to stock_data.db files made before migrations existed)
     def create_database(self):
 
         # executive the sql statements to create the table
@@ -35,37 +47,188 @@ class stockData_manager(SQLiteWrapper):  # inherit SQLiteWrapper
             "create UNIQUE index IF NOT EXISTS stock_data_by_date on stock_data (date, ticker)"
         )
 
+    # migration 2: table of the date ranges we have already asked the market data provider for (whether or not it had any bars)
+    # weekends, holidays and gaps never show up in stock_data, so without this the last date always looks out of date
+    def create_coverage_table(self):
+        self.execute(
+            """CREATE TABLE IF NOT EXISTS stock_coverage (
+                    ticker text NOT NULL,
+                    start_date text NOT NULL,
+                    end_date text NOT NULL,
+                    PRIMARY KEY (ticker, start_date))
+                    """
+        )
+        # every ticker already in the cache was fetched with period="max", so it is covered from the beginning up to its last bar
+        self.execute(
+            "INSERT OR IGNORE INTO stock_coverage (ticker, start_date, end_date) SELECT ticker, ?, MAX(date) FROM stock_data GROUP BY ticker",
+            (constants.earliest_date,),
+        )
+
+    # migration 3: index of every ticker we have bars for, with its first and last date
+    def create_known_tickers_table(self):
+        self.execute(
+            """CREATE TABLE IF NOT EXISTS known_tickers (
+                    ticker text PRIMARY KEY,
+                    first_date text NOT NULL,
+                    last_date text NOT NULL)
+                    """
+        )
+        self.execute(
+            "INSERT OR IGNORE INTO known_tickers (ticker, first_date, last_date) SELECT ticker, MIN(date), MAX(date) FROM stock_data GROUP BY ticker"
+        )
+
+    # migration 4: compact layout for stock_data
+    # the ticker is stored once in the tickers table and referenced by id, dates are day numbers (days since 1970-01-01),
+    # the prices are REAL and the table is clustered on (ticker_id, day) with no rowid (and no second index), so a ticker's bars sit next to each other on disk
+    # stock_history is a view that looks like the old table, for dump_database_to_csv and anyone looking at the database by hand
+    def compact_stock_data(self):
+        self.execute(
+            """CREATE TABLE IF NOT EXISTS tickers (
+                    id INTEGER PRIMARY KEY,
+                    symbol text NOT NULL UNIQUE)
+                    """
+        )
+        self.execute(
+            """CREATE TABLE stock_data_compact (
+                    ticker_id INTEGER NOT NULL REFERENCES tickers (id),
+                    day INTEGER NOT NULL,
+                    open REAL NOT NULL,
+                    high REAL NOT NULL,
+                    low REAL NOT NULL,
+                    close REAL NOT NULL,
+                    volume REAL NOT NULL,
+                    dividends REAL NOT NULL,
+                    stock_splits REAL NOT NULL,
+                    PRIMARY KEY (ticker_id, day)) WITHOUT ROWID
+                    """
+        )
+        self.execute(
+            "INSERT OR IGNORE INTO tickers (symbol) SELECT DISTINCT ticker FROM stock_data")
+        # ORDER BY so the rows go in in primary key order (appending to the b-tree instead of inserting all over it)
+        self.execute(
+            "INSERT INTO stock_data_compact SELECT tickers.id, " + day_from_text("stock_data.date") +
+            """, CAST(open AS REAL), CAST(high AS REAL), CAST(low AS REAL), CAST(close AS REAL),
+            CAST(volume AS REAL), CAST(dividends AS REAL), CAST(stock_splits AS REAL)
+            FROM stock_data JOIN tickers ON tickers.symbol = stock_data.ticker ORDER BY tickers.id, stock_data.date"""
+        )
+        # dropping the table drops stock_data_by_date with it
+        self.execute("DROP TABLE stock_data")
+        self.execute("ALTER TABLE stock_data_compact RENAME TO stock_data")
+        self.execute(
+            "CREATE VIEW IF NOT EXISTS stock_history AS SELECT " + text_from_day("stock_data.day") +
+            """ AS date, tickers.symbol AS ticker, open, high, low, close, volume, dividends, stock_splits
+            FROM stock_data JOIN tickers ON tickers.id = stock_data.ticker_id"""
+        )
+
+    # migration 5: remembers which tickers have unadjusted bars
+    # bars used to be fetched adjusted for splits and dividends (as of the day they were fetched), they are fetched unadjusted now (see price_adjustments.py)
+    # tickers added from now on are unadjusted (raw = 1), the ones already here are fetched again (unadjusted) the next time they need new bars
+    def add_raw_column(self):
+        self.execute(
+            "ALTER TABLE tickers ADD COLUMN raw INTEGER NOT NULL DEFAULT 1")
+        self.execute("UPDATE tickers SET raw = 0")
+
+    # schema migrations in the order they are applied (see SQLiteWrapper.migrate)
+    migrations = [create_database, create_coverage_table,
+                  create_known_tickers_table, compact_stock_data, add_raw_column]
+
     # constructor takes the database path and calls the SQlitewrapper super constructor
-    def __init__(self, database_path):
-        super().__init__(database_path)
-        self.insert_statement = "INSERT INTO stock_data (date, ticker, open, high, low, close, volume, dividends, stock_splits) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    def __init__(self, database_path, immediate=False):
+        super().__init__(database_path, immediate)
+        # DO NOTHING on a (ticker_id, day) conflict because two workers can fetch the same missing days at the same time, the second write just has nothing to add
+        # (only that conflict, a bar with a missing value still fails instead of quietly not being written, see database_manager.drop_incomplete_bars)
+        # it takes the same (date, ticker, ...) rows as always, sqlite works out the ticker id and the day number
+        self.insert_statement = "INSERT INTO stock_data (ticker_id, day, open, high, low, close, volume, dividends, stock_splits) VALUES ((SELECT id FROM tickers WHERE symbol=?2), " + day_from_text(
+            "?1") + ", ?3, ?4, ?5, ?6, ?7, ?8, ?9) ON CONFLICT (ticker_id, day) DO NOTHING"
 
     # searches for a ticker in the database
+    # returns (date, ticker, open, high, low, close, volume, dividends, stock_splits) rows, the same as before the compact layout
     def searchForTicker(self, ticker, start, end):
-        start = start.strftime(constants.date_format)
-        end = end.strftime(constants.date_format)
-
         self.execute(
-            "SELECT * FROM stock_data WHERE ticker=? AND date BETWEEN ? AND ?",
-            (ticker, start, end),
+            "SELECT " + text_from_day("day") +
+            ", ?, open, high, low, close, volume, dividends, stock_splits FROM stock_data WHERE ticker_id=(SELECT id FROM tickers WHERE symbol=?) AND day BETWEEN ? AND ? ORDER BY day",
+            (ticker, ticker, date_to_day(start), date_to_day(end)),
         )
 
         return self.fetchall()
 
+    # returns every bar for a ticker (after a given date if there is one) as (day number, open, high, low, close, volume, dividends, stock_splits) rows, oldest first
+    def getTickerRows(self, ticker, after=None):
+        if after is None:
+            after = datetime.datetime.strptime(
+                constants.earliest_date, constants.date_format) - datetime.timedelta(days=1)
+        self.execute(
+            "SELECT day, open, high, low, close, volume, dividends, stock_splits FROM stock_data WHERE ticker_id=(SELECT id FROM tickers WHERE symbol=?) AND day>? ORDER BY day",
+            (ticker, date_to_day(after)),
+        )
+        return self.fetchall()
+
     # write many ticker data entries to database (date, ticker, open, high, low, close, volume, dividends, stock_splits)
     def writeManyTickerDataEntry(self, arrOfRowTuple):
         statement = self.insert_statement
 
+        # a ticker needs an id before its rows can use it
+        self.executemany("INSERT OR IGNORE INTO tickers (symbol) VALUES (?)", list(
+            {(row[1],) for row in arrOfRowTuple}))
         self.executemany(statement, arrOfRowTuple)
 
-    # returns the last date in the database for a given ticker (allows us to check if we have the latest data for a ticker)
-    def getLastDateForTicker(self, ticker):
-        self.execute(
-            "SELECT MAX(date) FROM stock_data WHERE ticker=?", (ticker,))
+    # false if the ticker's bars were fetched before we stored unadjusted bars (true for a ticker we don't have)
+    def isTickerRaw(self, ticker):
+        self.execute("SELECT raw FROM tickers WHERE symbol=?", (ticker,))
         data = self.fetchone()
-        if data[0] is None:
-            return None
-        return datetime.datetime.strptime(
-            data[0],
-            constants.date_format,
+        return data is None or data[0] == 1
+
+    # deletes every bar of a ticker (to replace them with unadjusted ones), it is marked as unadjusted
+    def replaceTickerData(self, ticker):
+        self.execute(
+            "DELETE FROM stock_data WHERE ticker_id=(SELECT id FROM tickers WHERE symbol=?)", (ticker,))
+        self.execute("UPDATE tickers SET raw = 1 WHERE symbol=?", (ticker,))
+
+    # returns the ranges of dates we have fetched for a ticker as a sorted list of (start, end) datetimes (both inclusive)
+    def getCoverage(self, ticker):
+        self.execute(
+            "SELECT start_date, end_date FROM stock_coverage WHERE ticker=? ORDER BY start_date", (ticker,))
+        return [
+            (datetime.datetime.strptime(start, constants.date_format),
+             datetime.datetime.strptime(end, constants.date_format))
+            for start, end in self.fetchall()
+        ]
+
+    # records that we have fetched start to end (both inclusive) for a ticker
+    # merges it with any ranges it overlaps or touches, so a ticker usually just has one row
+    def addCoverage(self, ticker, start, end):
+        # the ranges we can merge with are the ones that start by the day after our end and end by the day before our start
+        self.execute(
+            "SELECT start_date, end_date FROM stock_coverage WHERE ticker=? AND start_date<=? AND end_date>=?",
+            (ticker, (end + datetime.timedelta(days=1)).strftime(constants.date_format),
+             (start - datetime.timedelta(days=1)).strftime(constants.date_format)),
+        )
+        start = start.strftime(constants.date_format)
+        end = end.strftime(constants.date_format)
+        for other_start, other_end in self.fetchall():
+            start = min(start, other_start)
+            end = max(end, other_end)
+            self.execute(
+                "DELETE FROM stock_coverage WHERE ticker=? AND start_date=?", (ticker, other_start))
+
+        self.execute(
+            "INSERT INTO stock_coverage (ticker, start_date, end_date) VALUES (?, ?, ?)", (ticker, start, end))
+
+    # records that a ticker has bars from first_date to last_date (yyyy-mm-dd strings), widening what we already had
+    def addKnownTicker(self, ticker, first_date, last_date):
+        self.execute(
+            """INSERT INTO known_tickers (ticker, first_date, last_date) VALUES (?, ?, ?)
+            ON CONFLICT (ticker) DO UPDATE SET first_date=MIN(first_date, excluded.first_date), last_date=MAX(last_date, excluded.last_date)""",
+            (ticker, first_date, last_date),
         )
+
+    # returns (first date, last date) for a ticker, None if we have never had bars for it
+    def getKnownTicker(self, ticker):
+        self.execute(
+            "SELECT first_date, last_date FROM known_tickers WHERE ticker=?", (ticker,))
+        return self.fetchone()
+
+    # returns every (ticker, first date, last date) we know about
+    def getKnownTickers(self):
+        self.execute("SELECT ticker, first_date, last_date FROM known_tickers")
+        return self.fetchall()
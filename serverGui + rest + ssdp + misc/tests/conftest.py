@@ -0,0 +1,17 @@
+# shared pytest setup, the server modules are flat files in the folder above so it goes on the import path
+# every test runs in its own temporary folder so the databases and the price archive (relative paths in constants.py) never touch the real ones
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import connection_pool  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    yield tmp_path
+    connection_pool.close_all_pools()
@@ -0,0 +1,68 @@
+# tests for SQLiteWrapper's transactions and busy retries
+
+import sqlite3
+import pytest
+import connection_pool
+import constants
+from SQLiteWrapper import SQLiteWrapper
+from stockData_manager import stockData_manager
+from userData_manager import userData_manager
+
+
+# a write transaction that keeps the database locked until it is rolled back
+def hold_write_lock(db_file):
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    # already in WAL (like every database the pool has opened), so the pool's connections get as far as BEGIN
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS t (x)")
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute("INSERT INTO t VALUES (1)")
+    return conn
+
+
+def test_run_with_retry_gives_connections_back_when_begin_fails(monkeypatch):
+    monkeypatch.setattr(constants, "sqlite_busy_timeout_ms", 10)
+    db_file = "locked.db"
+    holder = hold_write_lock(db_file)
+    try:
+        for i in range(3):
+            with pytest.raises(sqlite3.OperationalError):
+                SQLiteWrapper.run_with_retry(
+                    db_file, lambda db: db.execute("INSERT INTO t VALUES (2)"), attempts=3, backoff=0.001)
+        pool = connection_pool.get_pool(db_file)
+        # every connection that was checked out came back (and is reused, so only one was ever opened)
+        assert pool.num_open == len(pool.idle)
+        assert pool.num_open <= 1
+    finally:
+        holder.rollback()
+        holder.close()
+
+    # and once the lock is gone the pool still works
+    def insert(db):
+        db.execute("INSERT INTO t VALUES (3)")
+        return "done"
+    assert SQLiteWrapper.run_with_retry(db_file, insert) == "done"
+
+
+def test_exception_inside_transaction_rolls_back_and_releases():
+    db_file = "rollback.db"
+    with SQLiteWrapper(db_file, immediate=True) as db:
+        db.execute("CREATE TABLE t (x)")
+    with pytest.raises(ValueError):
+        with SQLiteWrapper(db_file, immediate=True) as db:
+            db.execute("INSERT INTO t VALUES (1)")
+            raise ValueError()
+    with SQLiteWrapper(db_file) as db:
+        db.execute("SELECT COUNT(*) FROM t")
+        assert db.fetchone()[0] == 0
+    pool = connection_pool.get_pool(db_file)
+    assert pool.num_open == len(pool.idle)
+
+
+def test_migrate_file_brings_both_databases_up_to_date_once():
+    for manager, db_file in ((stockData_manager, "stock_data.db"), (userData_manager, "user_data.db")):
+        manager.migrate_file(db_file)
+        manager.migrate_file(db_file)
+        with manager(db_file) as db:
+            db.execute("PRAGMA user_version")
+            assert db.fetchone()[0] == len(manager.migrations)
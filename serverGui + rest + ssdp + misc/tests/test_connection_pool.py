@@ -0,0 +1,78 @@
+# tests for the per database file sqlite connection pool
+
+import sqlite3
+import threading
+import pytest
+import connection_pool
+from connection_pool import connectionPool
+
+
+def test_released_connections_are_reused_and_the_pool_never_goes_over_its_size():
+    pool = connectionPool("pool.db", max_size=2)
+    first = pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+
+    second = pool.acquire()
+    assert second is not first and pool.num_open == 2
+    # both are checked out, a third waits and then gives up
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.1)
+
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.acquire(timeout=10)))
+    waiter.start()
+    pool.release(second)
+    waiter.join(10)
+    assert got == [second] and pool.num_open == 2
+    pool.release(first)
+    pool.release(second)
+    pool.close()
+
+
+def test_connections_are_in_wal_mode_and_come_back_without_a_transaction():
+    pool = connectionPool("pool.db", max_size=1)
+    conn = pool.acquire()
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.execute("BEGIN")
+    conn.execute("INSERT INTO t VALUES (1)")
+    pool.release(conn)
+
+    # whatever it was doing is rolled back before it is handed out again
+    conn = pool.acquire()
+    assert not conn.in_transaction
+    assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+    pool.release(conn)
+    pool.close()
+
+
+def test_a_broken_or_discarded_connection_is_replaced():
+    pool = connectionPool("pool.db", max_size=1)
+    conn = pool.acquire()
+    conn.close()
+    pool.release(conn)
+    fresh = pool.acquire()
+    assert fresh is not conn
+    fresh.execute("SELECT 1")
+
+    pool.discard(fresh)
+    assert pool.num_open == 0
+    pool.release(pool.acquire())
+    assert pool.num_open == 1
+    pool.close()
+
+
+def test_a_closed_pool_closes_connections_as_they_come_back():
+    pool = connection_pool.get_pool("pool.db")
+    assert connection_pool.get_pool("pool.db") is pool
+    conn = pool.acquire()
+    connection_pool.close_all_pools()
+    with pytest.raises(sqlite3.ProgrammingError):
+        pool.acquire()
+    pool.release(conn)
+    assert pool.num_open == 0
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+    # asking again makes a new pool
+    assert connection_pool.get_pool("pool.db") is not pool
@@ -0,0 +1,209 @@
+# tests for database_manager's history caching, against a provider that doesn't need the internet
+
+import datetime
+import sqlite3
+import numpy as np
+import pandas as pd
+import pytest
+import database_manager
+from market_data_provider import marketDataProvider, marketDataUnavailable, yfinanceProvider, history_columns
+
+
+# hands out bars for first to last (weekdays), anything asked for after last comes back as yfinance's empty frame (which has no Dividends/Stock Splits columns)
+class fakeProvider(marketDataProvider):
+
+    def __init__(self, first, last, today, missing_prices=()):
+        self.first = first
+        self.last = last
+        self.today_date = today
+        self.missing_prices = missing_prices  # days whose bar comes back with NaN prices
+        self.requests = []
+        self.unavailable = False  # True to act like yahoo can't be reached
+        self.tickers = None  # the only tickers that exist, None for every ticker
+        self.splits = {}  # day -> split ratio
+
+    def get_history(self, ticker, start=None, end=None, period=None):
+        self.requests.append((ticker, start, end, period))
+        if self.unavailable:
+            raise marketDataUnavailable(ticker)
+        if self.tickers is not None and ticker not in self.tickers:
+            return pd.DataFrame(columns=history_columns)
+        index = pd.bdate_range(self.first, self.last)
+        if start is not None:
+            index = index[(index >= pd.Timestamp(start)) & (index < pd.Timestamp(end))]
+        if len(index) <= 0:
+            return pd.DataFrame(columns=["Open", "High", "Low", "Close", "Adj Close", "Volume"])
+        close = np.arange(len(index), dtype=float) + 100
+        df = pd.DataFrame({column: 0.0 for column in history_columns}, index=index)
+        df["Open"] = df["High"] = df["Low"] = df["Close"] = close
+        df["Volume"] = 1000.0
+        for day in self.missing_prices:
+            df.loc[day, ["Open", "High", "Low", "Close", "Volume"]] = np.nan
+        for day, ratio in self.splits.items():
+            if day in df.index:
+                df.loc[day, "Stock Splits"] = ratio
+        return df
+
+    def today(self):
+        return self.today_date
+
+
+def test_empty_gap_is_recorded_as_covered():
+    provider = fakeProvider(datetime.datetime(2020, 1, 1), datetime.datetime(2020, 6, 30), datetime.datetime(2020, 7, 15))
+    database = database_manager.database_manager(provider)
+    database.migrate()
+
+    start = datetime.datetime(2020, 1, 1)
+    end = datetime.datetime(2020, 12, 31)
+    database.get_price_history("AAA", start, datetime.datetime(2020, 3, 31))
+    assert len(provider.requests) == 1
+
+    # months later, the bars stopped at the end of june so the top up is a gap with nothing in it
+    provider.today_date = datetime.datetime(2021, 1, 4)
+    history = database.get_price_history("AAA", start, end)
+    assert len(provider.requests) == 2
+    assert history is not None and len(history.days) > 0
+
+    with database_manager.stockData_manager(database_manager.constants.stock_data_database_path) as db:
+        coverage = db.getCoverage("AAA")
+    assert database.find_missing_ranges(coverage, start, end) == []
+
+    # so asking again doesn't go back to the provider
+    database.get_price_history("AAA", start, end)
+    assert len(provider.requests) == 2
+
+
+def test_bars_with_missing_prices_are_dropped_everywhere():
+    missing = [pd.Timestamp(2020, 1, 7), pd.Timestamp(2020, 1, 8)]
+    provider = fakeProvider(datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 31), datetime.datetime(2020, 1, 6), missing)
+    database = database_manager.database_manager(provider)
+    database.migrate()
+    database.get_price_history("AAA", datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 3))
+
+    # the top up (which adds its bars on to the end of the archive and the price store) has the bars with no prices in it
+    provider.today_date = datetime.datetime(2020, 2, 3)
+    history = database.get_price_history("AAA", datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 31))
+    assert len(provider.requests) == 2
+    with database_manager.stockData_manager(database_manager.constants.stock_data_database_path) as db:
+        rows = db.getTickerRows("AAA")
+    # the database, the archive and the price store agree
+    assert [row[0] for row in rows] == history.days.tolist()
+    assert len(rows) == len(pd.bdate_range("2020-01-01", "2020-01-31")) - len(missing)
+    assert not np.isnan(history.columns["close"]).any()
+    archived = database.price_archive.read("AAA")
+    assert archived.days.tolist() == history.days.tolist()
+
+
+def test_insert_only_ignores_bars_we_already_have():
+    database = database_manager.database_manager(fakeProvider(datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 31), datetime.datetime(2020, 2, 3)))
+    database.migrate()
+    row = ("2020-01-02", "AAA", 1.0, 1.0, 1.0, 1.0, 1.0, 0.0, 0.0)
+    with database_manager.stockData_manager(database_manager.constants.stock_data_database_path, immediate=True) as db:
+        db.addKnownTicker("AAA", "2020-01-02", "2020-01-02")
+        db.writeManyTickerDataEntry([row])
+        db.writeManyTickerDataEntry([row])
+        assert len(db.getTickerRows("AAA")) == 1
+        with pytest.raises(sqlite3.IntegrityError):
+            db.writeManyTickerDataEntry([("2020-01-03", "AAA", None, 1.0, 1.0, 1.0, 1.0, 0.0, 0.0)])
+
+
+def test_only_a_ticker_with_no_data_is_remembered_as_invalid():
+    provider = fakeProvider(datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 31), datetime.datetime(2020, 2, 3))
+    provider.tickers = ["AAA"]
+    database = database_manager.database_manager(provider)
+    database.migrate()
+
+    # yahoo not answering isn't an answer, the next request asks again
+    provider.unavailable = True
+    with pytest.raises(marketDataUnavailable):
+        database.does_ticker_exist("AAA")
+    provider.unavailable = False
+    assert database.does_ticker_exist("AAA")
+
+    assert not database.does_ticker_exist("ZZZ")
+    asked = len(provider.requests)
+    assert not database.does_ticker_exist("ZZZ")
+    assert len(provider.requests) == asked
+
+
+def test_daily_top_ups_write_the_archive_without_the_write_lock(monkeypatch):
+    provider = fakeProvider(datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 31), datetime.datetime(2020, 1, 10))
+    database = database_manager.database_manager(provider)
+    database.migrate()
+    database.get_price_history("AAA", datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 8))
+
+    locked = []
+    write_version = database.price_archive.write_version
+
+    def checking_write_version(*args):
+        other = sqlite3.connect(database_manager.constants.stock_data_database_path, timeout=0, isolation_level=None)
+        try:
+            other.execute("BEGIN IMMEDIATE")
+            other.rollback()
+            locked.append(False)
+        except sqlite3.OperationalError:
+            locked.append(True)
+        finally:
+            other.close()
+        return write_version(*args)
+    monkeypatch.setattr(database.price_archive, "write_version", checking_write_version)
+
+    provider.today_date = datetime.datetime(2020, 1, 20)
+    history = database.get_price_history("AAA", datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 17))
+    assert locked == [False]
+    assert database.price_archive.read("AAA").days.tolist() == history.days.tolist()
+
+
+def test_archive_failures_are_logged(monkeypatch, caplog):
+    database = database_manager.database_manager(fakeProvider(datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 31), datetime.datetime(2020, 2, 3)))
+    database.migrate()
+
+    def full_disk(*args):
+        raise OSError("No space left on device")
+    monkeypatch.setattr(database.price_archive, "write_version", full_disk)
+    history = database.get_price_history("AAA", datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 31))
+    # the database still has it
+    assert len(history.days) > 0
+    assert "No space left on device" in caplog.text
+
+
+# acts like yahoo: the bars it has (up to its today) are adjusted for every split up to today, and the provider undoes that with the splits it can see
+class yahooLikeProvider(yfinanceProvider):
+
+    def __init__(self, first, today, splits):
+        self.first = first
+        self.today_date = today
+        self.splits = splits  # day -> split ratio
+
+    def get_history(self, ticker, start=None, end=None, period=None):
+        index = pd.bdate_range(self.first, self.today_date)
+        df = pd.DataFrame({column: 0.0 for column in history_columns}, index=index)
+        factor = np.ones(len(index))
+        for day, ratio in self.splits.items():
+            if day <= self.today_date:
+                df.loc[day, "Stock Splits"] = ratio
+                factor[index < day] /= ratio
+        df["Open"] = df["High"] = df["Low"] = df["Close"] = (np.arange(len(index)) + 100) * factor
+        df["Volume"] = 1000.0
+        if start is not None:
+            df = df[(df.index >= pd.Timestamp(start)) & (df.index < pd.Timestamp(end))]
+        return self.undo_split_adjustment(df)
+
+    def today(self):
+        return self.today_date
+
+
+def test_a_top_up_sees_a_split_that_happens_after_its_range():
+    split_day = datetime.datetime(2020, 1, 15)
+    provider = yahooLikeProvider(datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 9), {split_day: 2.0})
+    database = database_manager.database_manager(provider)
+    database.migrate()
+    database.get_price_history("AAA", datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 8))
+
+    # the split is effective today, the top up only needs up to yesterday
+    provider.today_date = split_day
+    history = database.get_price_history("AAA", datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 14))
+    expected = (np.arange(len(pd.bdate_range("2020-01-01", "2020-01-14"))) + 100).tolist()
+    assert history.columns["close"].tolist() == expected
+    with database_manager.stockData_manager(database_manager.constants.stock_data_database_path) as db:
+        assert [row[4] for row in db.getTickerRows("AAA")] == expected
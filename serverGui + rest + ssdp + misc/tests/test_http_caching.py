@@ -0,0 +1,36 @@
+# tests for the history ETag and Cache-Control headers
+
+import datetime
+import numpy as np
+import http_caching
+from price_adjustments import last_corporate_action
+
+
+def test_old_ranges_are_immutable_unless_adjusted():
+    end = datetime.datetime(2020, 6, 1)
+    today = datetime.datetime(2023, 1, 26)
+    assert "immutable" in http_caching.history_cache_control(end, today, True)
+    assert "immutable" not in http_caching.history_cache_control(end, today, True, adjusted=True)
+    assert "immutable" not in http_caching.history_cache_control(datetime.datetime(2023, 1, 25), today, True)
+
+
+def test_only_a_complete_history_is_kept_for_long():
+    end = datetime.datetime(2020, 6, 1)
+    today = datetime.datetime(2023, 1, 26)
+    assert "immutable" not in http_caching.history_cache_control(end, today, False)
+    assert http_caching.history_cache_control(end, today, False, found=False) == "no-store"
+
+
+def test_adjusted_etag_changes_with_a_new_corporate_action():
+    through = datetime.datetime(2020, 6, 1)
+    params = [("ticker", "AAA"), ("adjusted", "true")]
+    days = np.arange(18000, 18010, dtype=np.int32)
+    columns = {"dividends": np.zeros(10), "stock_splits": np.zeros(10)}
+    assert last_corporate_action(days, columns) == -1
+    before = http_caching.history_etag("/h", params, None, through, last_corporate_action(days, columns))
+
+    columns["stock_splits"][7] = 2.0
+    assert last_corporate_action(days, columns) == 18007
+    after = http_caching.history_etag("/h", params, None, through, last_corporate_action(days, columns))
+    assert before != after
+    assert http_caching.etag_matches('W/' + after + ', "x"', after)
@@ -0,0 +1,90 @@
+# tests for the indicators and their incremental cache
+
+import math
+import numpy as np
+import pandas as pd
+import indicators
+from indicators import indicatorCache, cached_indicators
+from price_history_store import priceHistory, price_columns
+
+
+def history(close, first_day=18000):
+    days = np.arange(first_day, first_day + len(close), dtype=np.int32)
+    columns = {column: np.zeros(len(close)) for column in price_columns}
+    columns["close"] = np.asarray(close, dtype=np.float64)
+    return priceHistory(days, columns, int(days[-1]))
+
+
+def random_close(num, seed=1):
+    return 100 * np.exp(np.cumsum(np.random.default_rng(seed).normal(0, 0.02, size=num)))
+
+
+# wilder's rsi one bar at a time
+def expected_rsi(close, window):
+    values = [math.nan] * len(close)
+    changes = np.diff(close)
+    if len(changes) < window:
+        return values
+    gain = np.maximum(changes[:window], 0).mean()
+    loss = np.maximum(-changes[:window], 0).mean()
+    for i in range(window, len(close)):
+        if i > window:
+            gain = (gain * (window - 1) + max(changes[i - 1], 0)) / window
+            loss = (loss * (window - 1) + max(-changes[i - 1], 0)) / window
+        values[i] = 100.0 if loss == 0 else 100 - 100 / (1 + gain / loss)
+    return values
+
+
+def test_indicators_match_pandas():
+    close = random_close(600)
+    series = pd.Series(close)
+    for window in [1, 5, 20]:
+        expected = {
+            "sma": series.rolling(window).mean(),
+            "ema": series.ewm(span=window, adjust=False).mean(),
+            "rsi": expected_rsi(close, window),
+            "volatility": np.log(series).diff().rolling(window).std() * math.sqrt(252),
+        }
+        for name, (function, default_window) in cached_indicators.items():
+            if name == "volatility" and window == 1:
+                continue
+            values, state = function(close, 0, None, window)
+            assert np.allclose(values, expected[name], equal_nan=True), (name, window)
+
+
+def test_a_long_ema_doesnt_overflow():
+    close = random_close(20000)
+    values, state = indicators.ema(close, 0, None, 3)
+    assert np.allclose(values, pd.Series(close).ewm(span=3, adjust=False).mean())
+
+
+def test_extending_a_history_matches_working_it_out_again():
+    close = random_close(500)
+    for name, (function, window) in cached_indicators.items():
+        cache = indicatorCache()
+        entry = history(close[:10])
+        # a few bars at a time, starting with fewer bars than the window
+        for end in [10, 11, 30, 31, 200, 500]:
+            entry = history(close[:end])
+            values = cache.get("AAA", name, window, entry)
+            assert np.allclose(values, function(close[:end], 0, None, window)[0], equal_nan=True), (name, end)
+        assert cache.get("AAA", name, window, entry) is values
+        assert cache.stats() == {"entries": 1, "hits": 1, "extends": 5, "misses": 1}
+
+
+def test_a_history_that_changed_is_worked_out_again():
+    close = random_close(100)
+    cache = indicatorCache()
+    cache.get("AAA", "ema", 20, history(close[:50]))
+    # a 2 for 1 split on one of the new bars halves the adjusted closes before it, so the old values can't be extended
+    changed = close.copy()
+    changed[:60] /= 2
+    values = cache.get("AAA", "ema", 20, history(changed))
+    assert np.allclose(values, indicators.ema(changed, 0, None, 20)[0])
+    assert cache.stats()["misses"] == 2
+
+
+def test_range_indicators():
+    close = np.array([10.0, 12.0, 9.0, 15.0, 12.0])
+    assert np.allclose(indicators.returns(close), [0, 0.2, -0.1, 0.5, 0.2])
+    assert np.allclose(indicators.drawdown(close), [0, 0, -0.25, 0, -0.2])
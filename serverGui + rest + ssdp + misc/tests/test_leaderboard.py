@@ -0,0 +1,66 @@
+# tests for the leaderboard and its indexable skiplist
+
+import random
+from leaderboard import rankList, leaderboard
+
+
+def test_rank_list_matches_a_sorted_list():
+    random.seed(5)
+    ranks = rankList()
+    expected = []
+    for i in range(3000):
+        if len(expected) > 0 and random.random() < 0.4:
+            key = random.choice(expected)
+            expected.remove(key)
+            assert ranks.remove(key)
+        else:
+            key = (random.random(), str(i))
+            expected.append(key)
+            ranks.insert(key)
+        if i % 50 == 0:
+            expected.sort()
+            assert len(ranks) == len(expected)
+            start = random.randint(0, len(expected))
+            assert ranks.slice(start, 7) == expected[start:start + 7]
+            for key in random.sample(expected, min(5, len(expected))):
+                assert ranks.rank(key) == expected.index(key)
+    expected.sort()
+    assert ranks.slice(0, len(expected) + 10) == expected
+    assert not ranks.remove((2.0, "missing"))
+
+
+def test_rank_list_slice_past_the_end_is_empty():
+    ranks = rankList()
+    assert ranks.slice(0, 5) == []
+    ranks.insert((1, "a"))
+    assert ranks.slice(1, 5) == []
+    assert ranks.slice(0, 0) == []
+
+
+def test_price_changes_only_revalue_holders_and_match_a_rebuild():
+    board = leaderboard()
+    board.load([(1, "ann", 1000), (2, "bob", 1000), (3, "cat", 1500)],
+               [("ann", "AAA", 10), ("bob", "BBB", 5)], 0, {"AAA": 10.0, "BBB": 20.0})
+    assert [username for rank, username, value in board.top(0, 3)] == ["cat", "ann", "bob"]
+
+    revaluations = board.revaluations
+    board.price_changed("AAA", 100.0)
+    # only ann holds AAA
+    assert board.revaluations == revaluations + 1
+    assert board.top(0, 1) == [(1, "ann", 2000.0)]
+    assert board.rank_of("bob") == (3, 1100.0)
+
+    # a trade and a new user picked up from the ledger
+    board.apply_changes([(4, "dan", 50000, {})], [(1, "bob", "BBB", 5, 20.0)])
+    assert board.rank_of("dan") == (1, 50000.0)
+    assert board.rank_of("bob") == (4, 1100.0)
+
+    # applying the same changes twice does nothing
+    board.apply_changes([(4, "dan", 50000, {})], [(1, "bob", "BBB", 5, 20.0)])
+    assert board.size() == 4 and board.rank_of("bob") == (4, 1100.0)
+
+    rebuilt = leaderboard()
+    rebuilt.load([(1, "ann", 1000), (2, "bob", 900), (3, "cat", 1500), (4, "dan", 50000)],
+                 [("ann", "AAA", 10), ("bob", "BBB", 10)], 1, {"AAA": 100.0, "BBB": 20.0})
+    assert rebuilt.top(0, 4) == board.top(0, 4)
+    assert board.rank_of("nobody") is None
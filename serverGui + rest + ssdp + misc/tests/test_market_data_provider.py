@@ -0,0 +1,44 @@
+# tests for telling a ticker with no data apart from yahoo not answering
+
+import pandas as pd
+import pytest
+import requests
+import market_data_provider
+from market_data_provider import yfinanceProvider, marketDataUnavailable
+
+
+class emptyTicker:
+
+    def __init__(self, ticker):
+        self.ticker = ticker
+
+    def history(self, **kwargs):
+        return pd.DataFrame()
+
+
+class fakeResponse:
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def answer_with(monkeypatch, answer):
+    def get(url, **kwargs):
+        if isinstance(answer, Exception):
+            raise answer
+        return fakeResponse(answer)
+    monkeypatch.setattr(market_data_provider.yf, "Ticker", emptyTicker)
+    monkeypatch.setattr(market_data_provider.requests, "get", get)
+
+
+@pytest.mark.parametrize("answer", [200, 404])
+def test_an_empty_history_yahoo_answered_for_is_no_data(monkeypatch, answer):
+    answer_with(monkeypatch, answer)
+    assert len(yfinanceProvider().get_history("ZZZZ", period="max").index) == 0
+
+
+@pytest.mark.parametrize("answer", [requests.ConnectionError("no internet"), 429, 503])
+def test_an_empty_history_yahoo_didnt_answer_for_raises(monkeypatch, answer):
+    answer_with(monkeypatch, answer)
+    with pytest.raises(marketDataUnavailable):
+        yfinanceProvider().get_history("AAPL", period="max")
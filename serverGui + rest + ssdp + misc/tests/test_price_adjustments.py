@@ -0,0 +1,84 @@
+# tests for split and dividend adjusted prices
+
+import numpy as np
+from price_adjustments import adjustmentCache, adjustment_factors, adjustment_from_params
+from price_history_store import priceHistory, price_columns
+
+
+def history(num, dividends=(), splits=(), first_day=18000):
+    days = np.arange(first_day, first_day + num, dtype=np.int32)
+    close = 100 + np.arange(num, dtype=np.float64)
+    columns = {column: close.copy() for column in ["open", "high", "low", "close"]}
+    columns["volume"] = np.full(num, 1000.0)
+    columns["dividends"] = np.zeros(num)
+    columns["stock_splits"] = np.zeros(num)
+    for i, amount in dividends:
+        columns["dividends"][i] = amount
+    for i, ratio in splits:
+        columns["stock_splits"][i] = ratio
+    return priceHistory(days, columns, int(days[-1]))
+
+
+# walks back from the last bar multiplying in every action, yahoo style
+def expected_factors(close, dividends, splits):
+    price_factor = np.ones(len(close))
+    split_factor = np.ones(len(close))
+    price = split = 1.0
+    for i in range(len(close) - 1, -1, -1):
+        price_factor[i] = price
+        split_factor[i] = split
+        if splits[i] != 0:
+            price /= splits[i]
+            split /= splits[i]
+        if dividends[i] != 0 and i > 0:
+            price *= 1 - dividends[i] / close[i - 1]
+    return price_factor, split_factor
+
+
+def test_factors_match_walking_back_through_the_actions():
+    rng = np.random.default_rng(2)
+    close = 50 + rng.random(300) * 10
+    dividends = np.where(rng.random(300) < 0.05, 0.4, 0.0)
+    splits = np.where(rng.random(300) < 0.02, rng.choice([2.0, 0.5, 3.0], 300), 0.0)
+    # a dividend on the first bar has no close before it and is left out
+    dividends[0] = 1.0
+    for actual, expected in zip(adjustment_factors(close, dividends, splits), expected_factors(close, dividends, splits)):
+        assert np.allclose(actual, expected)
+
+
+def test_a_split_and_a_dividend():
+    entry = history(6, dividends=[(4, 1.03)], splits=[(2, 2.0)])
+    adjusted = adjustmentCache().get("AAA", entry, "all")
+    dividend = 1 - 1.03 / 103
+    assert np.allclose(adjusted.columns["close"], [100 / 2 * dividend, 101 / 2 * dividend, 102 * dividend, 103 * dividend, 104, 105])
+    assert np.allclose(adjusted.columns["volume"], [2000, 2000, 1000, 1000, 1000, 1000])
+    assert np.allclose(adjusted.columns["dividends"], [0, 0, 0, 0, 1.03, 0])
+    # only adjusted for the split
+    split_adjusted = adjustmentCache().get("AAA", entry, "split")
+    assert np.allclose(split_adjusted.columns["close"], [50, 50.5, 102, 103, 104, 105])
+    # the bars we have are left alone
+    assert entry.columns["close"].tolist() == [100, 101, 102, 103, 104, 105]
+
+
+def test_new_bars_extend_the_factors_and_new_actions_work_them_out_again():
+    for adjustment in ["all", "split"]:
+        cache = adjustmentCache()
+        actions = {"dividends": [(10, 0.5)], "splits": [(20, 2.0)]}
+        cache.get("AAA", history(30, **actions), adjustment)
+        for num, more in [(31, {}), (40, {}), (50, {"splits": [(45, 3.0)]}), (60, {"dividends": [(55, 0.7)]})]:
+            actions = {kind: actions[kind] + more.get(kind, []) for kind in actions}
+            entry = history(num, **actions)
+            adjusted = cache.get("AAA", entry, adjustment)
+            recomputed = adjustmentCache().get("AAA", entry, adjustment)
+            for column in price_columns:
+                assert np.allclose(adjusted.columns[column], recomputed.columns[column]), (adjustment, num, column)
+            assert cache.get("AAA", entry, adjustment) is adjusted
+        stats = cache.stats()
+        assert stats["extends"] == 2 and stats["misses"] == 3 and stats["hits"] == 4
+
+
+def test_adjustment_from_params():
+    assert adjustment_from_params(False, False) == "split"
+    assert adjustment_from_params(True, False) == "all"
+    assert adjustment_from_params(False, True) == "raw"
+    assert adjustment_from_params(True, True) is None
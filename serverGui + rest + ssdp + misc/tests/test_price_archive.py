@@ -0,0 +1,50 @@
+# tests for the memory mapped price archive
+
+import os
+import numpy as np
+from price_archive import priceArchive, archive_name
+from price_history_store import price_columns
+
+
+def history(num_rows, first_day=18000):
+    days = np.arange(first_day, first_day + num_rows, dtype=np.int32)
+    columns = {column: np.arange(num_rows, dtype=np.float64) + 100 for column in price_columns}
+    return days, columns
+
+
+def test_publishing_a_ticker_keeps_versions_of_tickers_that_start_with_its_name():
+    archive = priceArchive("archive")
+    days, columns = history(5)
+    archive.publish("BRK.B", days, columns, int(days[-1]))
+    archive.publish("BRK", days, columns, int(days[-1]))
+    archive.publish("BRK", *history(6), int(days[-1]) + 1)
+
+    brk_b = archive.read("BRK.B")
+    assert brk_b is not None and len(brk_b.days) == 5
+    assert len(archive.read("BRK").days) == 6
+
+
+def test_archive_names_dont_collide():
+    assert "." not in archive_name("BRK.B")
+    assert archive_name("brk") != archive_name("BRK")
+    assert archive_name("BRK.B") != archive_name("BRK-B")
+
+
+def test_an_append_built_on_an_old_version_isnt_made_current():
+    archive = priceArchive("archive")
+    days, columns = history(5)
+    archive.publish("AAA", days, columns, int(days[-1]))
+    new_days, new_columns = history(2, int(days[-1]) + 1)
+    prepared = archive.prepare_append("AAA", new_days, new_columns, int(new_days[0]), int(new_days[-1]))
+    # not current until it is committed
+    assert len(archive.read("AAA").days) == 5
+
+    # someone else published in the meantime
+    archive.publish("AAA", *history(6), int(days[-1]) + 1)
+    assert not archive.commit_append("AAA", prepared)
+    assert len(archive.read("AAA").days) == 6
+    assert prepared[1] not in os.listdir("archive")
+
+    prepared = archive.prepare_append("AAA", *history(1, int(days[-1]) + 2), int(days[-1]) + 2, int(days[-1]) + 2)
+    assert archive.commit_append("AAA", prepared)
+    assert len(archive.read("AAA").days) == 7
@@ -0,0 +1,23 @@
+# tests for the current price cache
+
+import itertools
+import time
+from quote_cache import quoteCache
+
+
+def test_trades_never_get_a_stale_price():
+    prices = itertools.count(10)
+
+    def fetch_quote(ticker):
+        return float(next(prices))
+
+    cache = quoteCache(fetch_quote, ttl=0.2, stale_ttl=60)
+    assert cache.get("AAA") == 10.0
+    assert cache.get("AAA", allow_stale=False) == 10.0
+
+    time.sleep(0.3)
+    # for display the stale price is served right away
+    assert cache.get("AAA") == 10.0
+    # a trade waits for a fresh one
+    assert cache.get("AAA", allow_stale=False) > 10.0
+    assert cache.stats()["stale_hits"] == 1
@@ -0,0 +1,118 @@
+# tests for resampling daily bars and picking chart points with lttb
+
+import datetime
+import random
+import numpy as np
+import pandas as pd
+from price_history_store import priceHistory, price_columns, date_to_day
+from resampling import resampledHistory, resampleCache, lttb
+
+
+def history(first, last, seed=1):
+    rng = np.random.default_rng(seed)
+    days = np.array([date_to_day(day.to_pydatetime()) for day in pd.bdate_range(first, last)], dtype=np.int32)
+    close = 100 + np.cumsum(rng.normal(size=len(days)))
+    columns = {
+        "open": close + rng.normal(size=len(days)),
+        "high": close + 5,
+        "low": close - 5,
+        "close": close,
+        "volume": rng.integers(100, 1000, size=len(days)).astype(np.float64),
+        "dividends": np.where(rng.random(len(days)) < 0.05, 0.5, 0.0),
+        "stock_splits": np.where(rng.random(len(days)) < 0.03, 2.0, 0.0),
+    }
+    columns["high"][::7] += 10
+    columns["low"][::11] -= 10
+    return priceHistory(days, columns, int(days[-1]))
+
+
+# the bars from lo to hi combined one period at a time with a python loop
+def expected_bars(entry, interval, lo, hi):
+    def period(day):
+        date = datetime.date(1970, 1, 1) + datetime.timedelta(days=int(day))
+        if interval == "week":
+            return date - datetime.timedelta(days=date.weekday())
+        if interval == "month":
+            return (date.year, date.month)
+        return date.year
+    groups = {}
+    for i in range(lo, hi):
+        groups.setdefault(period(entry.days[i]), []).append(i)
+    bars = []
+    for indexes in groups.values():
+        columns = {column: entry.columns[column][indexes] for column in price_columns}
+        splits = [ratio for ratio in columns["stock_splits"] if ratio != 0]
+        bars.append((int(entry.days[indexes[0]]), columns["open"][0], columns["high"].max(), columns["low"].min(),
+                     columns["close"][-1], columns["volume"].sum(), columns["dividends"].sum(),
+                     float(np.prod(splits)) if len(splits) > 0 else 0.0))
+    return bars
+
+
+def test_resampled_bars_match_a_loop_over_the_periods():
+    entry = history("2019-12-20", "2021-02-10")
+    random.seed(3)
+    for interval in ["week", "month", "year"]:
+        resampled = resampledHistory(entry, interval)
+        ranges = [(0, len(entry.days)), (0, 1), (len(entry.days) - 1, len(entry.days))]
+        ranges += [sorted(random.sample(range(len(entry.days) + 1), 2)) for i in range(30)]
+        for lo, hi in ranges:
+            days, columns = resampled.range(lo, hi)
+            bars = list(zip(days.tolist(), *[columns[column].tolist() for column in price_columns]))
+            assert np.allclose(bars, expected_bars(entry, interval, lo, hi)), (interval, lo, hi)
+
+
+def test_an_empty_range_has_no_bars():
+    entry = history("2020-01-01", "2020-03-01")
+    days, columns = resampledHistory(entry, "week").range(5, 5)
+    assert len(days) == 0 and all(len(columns[column]) == 0 for column in price_columns)
+
+
+def test_the_cache_works_bars_out_again_for_a_new_history():
+    cache = resampleCache(max_size=1)
+    entry = history("2020-01-01", "2020-03-01")
+    resampled = cache.get("AAA", "week", entry)
+    assert cache.get("AAA", "week", entry) is resampled
+    assert cache.get("AAA", "week", history("2020-01-01", "2020-03-02")) is not resampled
+    cache.get("BBB", "week", entry)
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 3, "hit_ratio": 0.25}
+
+
+# lttb one point at a time
+def expected_lttb(x, y, points):
+    bucket_size = (len(x) - 2) / (points - 2)
+    picked = [0]
+    for i in range(points - 2):
+        lo = int(np.floor(i * bucket_size)) + 1
+        hi = int(np.floor((i + 1) * bucket_size)) + 1 if i < points - 3 else len(x) - 1
+        next_hi = int(np.floor((i + 2) * bucket_size)) + 1 if i < points - 4 else len(x) - 1
+        if i < points - 3:
+            next_x = np.mean(x[hi:next_hi])
+            next_y = np.mean(y[hi:next_hi])
+        else:
+            next_x = x[-1]
+            next_y = y[-1]
+        previous = picked[-1]
+        areas = [abs((x[previous] - next_x) * (y[j] - y[previous]) - (x[previous] - x[j]) * (next_y - y[previous]))
+                 for j in range(lo, hi)]
+        picked.append(lo + int(np.argmax(areas)))
+    picked.append(len(x) - 1)
+    return picked
+
+
+def test_lttb_matches_picking_one_point_at_a_time():
+    rng = np.random.default_rng(4)
+    for num, points in [(10, 3), (10, 4), (100, 7), (1000, 50), (1001, 999), (5000, 300)]:
+        x = np.arange(num, dtype=np.float64) * 2
+        y = np.cumsum(rng.normal(size=num))
+        assert lttb(x, y, points).tolist() == expected_lttb(x, y, points)
+
+
+def test_lttb_keeps_a_spike():
+    y = np.zeros(1000)
+    y[437] = 50
+    assert 437 in lttb(np.arange(1000), y, 20).tolist()
+
+
+def test_lttb_with_too_few_points_to_pick_from():
+    assert lttb(np.arange(5), np.arange(5), 10).tolist() == [0, 1, 2, 3, 4]
+    assert lttb(np.arange(5), np.arange(5), 2).tolist() == [0, 4]
@@ -0,0 +1,80 @@
+# tests for the rest server's handlers, against a provider that doesn't need the internet
+
+import datetime
+import pandas as pd
+import pytest
+from starlette.testclient import TestClient
+import database_manager
+from test_database_manager import fakeProvider
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # imported here, rest builds its database_manager (and the price archive folder) on import
+    import rest
+    provider = fakeProvider(datetime.datetime(2020, 1, 1), datetime.datetime(2020, 6, 30), datetime.datetime(2021, 1, 4))
+    provider.tickers = ["AAA"]
+    database = database_manager.database_manager(provider)
+    database.migrate()
+    monkeypatch.setattr(rest, "database", database)
+    return TestClient(rest.app)
+
+
+def test_indicator_series_is_json_with_nulls_before_the_window_is_full(client):
+    response = client.get("/get_stock_indicator", params={
+        "ticker": "AAA", "start": "2020-01-01", "end": "2020-01-31", "indicator": "sma", "window": 5})
+    assert response.status_code == 200
+    series = response.json()["AAA"]
+    assert len(series["date"]) == len(series["sma"]) == 23
+    assert series["date"][0] == "2020-01-01"
+    assert series["sma"][:4] == [None] * 4
+    # the fake closes go up by 1 a day from 100
+    assert series["sma"][4] == 102.0
+
+    response = client.get("/get_stock_indicator", params={
+        "ticker": "ZZZ", "start": "2020-01-01", "end": "2020-01-31", "indicator": "sma"})
+    assert response.json() == {"valid": "true", "ZZZ": None}
+
+
+def test_an_unknown_ticker_is_never_cached(client):
+    response = client.get("/get_stock_history_by_ticker", params={"ticker": "ZZZ", "start": "2020-01-01", "end": "2020-01-31"})
+    assert response.status_code == 200
+    assert response.json()["ZZZ"] is None
+    assert response.headers["Cache-Control"] == "no-store"
+    assert "ETag" not in response.headers
+
+
+def test_old_complete_ranges_are_immutable_and_validated_once(client, monkeypatch):
+    import rest
+    validations = []
+    history_validator = rest.database.history_validator
+
+    def counting_validator(*args):
+        validations.append(args)
+        return history_validator(*args)
+    monkeypatch.setattr(rest.database, "history_validator", counting_validator)
+
+    # only raw prices can't change (a new split changes every split adjusted bar before it)
+    params = {"ticker": "AAA", "start": "2020-01-01", "end": "2020-01-31", "raw": "true"}
+    response = client.get("/get_stock_history_by_ticker", params=params)
+    assert "immutable" in response.headers["Cache-Control"]
+    assert len(validations) == 1
+
+    # a conditional request for a range we have all of is answered from the validator alone
+    requests = len(rest.database.provider.requests)
+    response = client.get("/get_stock_history_by_ticker", params=params, headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+    assert "immutable" in response.headers["Cache-Control"]
+    assert len(validations) == 2
+    assert len(rest.database.provider.requests) == requests
+
+
+def test_prices_are_split_adjusted_unless_raw_is_asked_for(client):
+    import rest
+    # a 2 for 1 split on the 2020-01-15 (the fake closes go up by 1 a day from 100, so 110 that day)
+    rest.database.provider.splits = {pd.Timestamp(2020, 1, 15): 2.0}
+
+    params = {"ticker": "AAA", "start": "2020-01-14", "end": "2020-01-15", "format": "columns", "fields": "date,close"}
+    assert client.get("/get_stock_history_by_ticker", params=params).json()["AAA"]["close"] == [54.5, 110.0]
+    assert client.get("/get_stock_history_by_ticker", params=dict(params, raw="true")).json()["AAA"]["close"] == [109.0, 110.0]
+    assert client.get("/get_stock_history_by_ticker", params=dict(params, raw="true", adjusted="true")).json() == {"valid": "false"}
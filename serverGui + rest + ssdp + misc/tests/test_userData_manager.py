@@ -0,0 +1,82 @@
+# tests for the trades ledger in userData_manager
+
+import random
+import constants
+import userData_manager as user_data
+from userData_manager import userData_manager
+
+
+def test_state_at_is_rebuilt_across_snapshots(monkeypatch):
+    monkeypatch.setattr(constants, "ledger_snapshot_interval", 3)
+    clock = [1000]
+    monkeypatch.setattr(user_data, "current_time", lambda: clock[0])
+
+    with userData_manager("user_data.db", immediate=True) as db:
+        db.migrate()
+        id = db.create_user("Ann", "pw")
+
+    random.seed(2)
+    history = []  # (time, balance, positions) after every trade
+    for i in range(20):
+        clock[0] += 10
+        with userData_manager("user_data.db", immediate=True) as db:
+            ticker = random.choice(["AAA", "BBB"])
+            if random.random() < 0.6:
+                db.buy_stock(id, ticker, random.randint(1, 5), random.uniform(1, 20))
+            else:
+                db.sell_stock(id, ticker, random.uniform(1, 20), random.randint(1, 5))
+            balance = db.get_user_balance("ann")
+            positions = {ticker: amount for username, ticker, amount in db.get_user_ticker_data(id) if amount != 0}
+        history.append((clock[0], balance, positions))
+
+    with userData_manager("user_data.db") as db:
+        db.execute("SELECT COUNT(*) FROM position_snapshots WHERE username='ann'")
+        assert db.fetchone()[0] > 2
+        for time, balance, positions in history:
+            # at the trade, and just before the next one
+            assert db.get_user_state_at(id, time) == (balance, positions)
+            assert db.get_user_state_at(id, time + 9) == (balance, positions)
+        assert db.get_user_state_at(id, 1000) == (constants.starting_balance, {})
+        # before the ledger starts, and a user that doesn't exist
+        assert db.get_user_state_at(id, 999) is None
+        assert db.get_user_state_at("missing", 5000) is None
+
+
+def test_a_trade_is_three_statements_and_selling_nothing_does_nothing():
+    with userData_manager("user_data.db", immediate=True) as db:
+        db.migrate()
+        id = db.create_user("Ann", "pw")
+
+    statements = []
+    with userData_manager("user_data.db", immediate=True) as db:
+        db.conn.set_trace_callback(statements.append)
+        try:
+            assert db.buy_stock(id, "AAA", 5, 10.0)
+            assert len(statements) == 3
+            assert db.sell_stock(id, "AAA", 12.0, 2)
+            assert len(statements) == 6
+            assert db.sell_stock(id, "AAA", 12.0, 0) is None
+            assert len(statements) == 6
+        finally:
+            db.conn.set_trace_callback(None)
+
+    with userData_manager("user_data.db") as db:
+        assert [amount for trade_id, time, ticker, amount, price in db.get_user_trades(id)] == [5, -2]
+        assert db.get_user_balance("ann") == constants.starting_balance - 50 + 24
+
+
+def test_trade_counts_are_filled_in_for_an_existing_ledger():
+    with userData_manager("user_data.db", immediate=True) as db:
+        # a user_data.db from before the trade counts
+        for migration in userData_manager.migrations[:2]:
+            migration(db)
+        db.execute("PRAGMA user_version = 2")
+        db.execute("INSERT INTO user_pass_bal (username, password, balance) VALUES ('ann', 'pw', 100)")
+        db.execute("INSERT INTO position_snapshots VALUES ('ann', 1, 0, 100, '{}')")
+        for i in range(3):
+            db.execute("INSERT INTO trades (username, time, ticker, amount, price) VALUES ('ann', 0, 'AAA', 1, 1)")
+    with userData_manager("user_data.db", immediate=True) as db:
+        db.migrate()
+        db.execute("SELECT trades_since_snapshot FROM user_pass_bal WHERE username='ann'")
+        # the trade the snapshot already has isn't counted
+        assert db.fetchone()[0] == 2
@@ -0,0 +1,48 @@
+# tests for the user_data.db group commit queue
+
+import pytest
+from userData_manager import userData_manager
+from write_queue import writeQueue
+
+
+def test_a_failed_intent_doesnt_roll_back_the_rest_of_its_batch():
+    with userData_manager("user_data.db", immediate=True) as db:
+        db.migrate()
+
+    # a window long enough that all three land in one batch
+    writes = writeQueue("user_data.db", userData_manager, window=0.5)
+
+    def half_done(db):
+        db.create_user("bob", "pw")
+        raise ValueError("failed after writing")
+
+    first = writes.submit(lambda db: db.create_user("ann", "pw"))
+    failed = writes.submit(half_done)
+    last = writes.submit(lambda db: db.create_user("cat", "pw"))
+
+    assert first.result(timeout=10) is not None
+    assert last.result(timeout=10) is not None
+    with pytest.raises(ValueError):
+        failed.result(timeout=10)
+
+    stats = writes.stats()
+    assert stats["batches"] == 1
+    assert stats["committed"] == 2 and stats["failed"] == 1
+
+    with userData_manager("user_data.db") as db:
+        assert db.does_user_exist("ann") and db.does_user_exist("cat")
+        # everything the failed intent wrote was rolled back
+        assert not db.does_user_exist("bob")
+        db.execute("SELECT COUNT(*) FROM position_snapshots WHERE username='bob'")
+        assert db.fetchone()[0] == 0
+
+
+def test_cancelled_intents_are_skipped():
+    with userData_manager("user_data.db", immediate=True) as db:
+        db.migrate()
+    writes = writeQueue("user_data.db", userData_manager, window=0.5)
+    cancelled = writes.submit(lambda db: db.create_user("dan", "pw"))
+    assert cancelled.cancel()
+    assert writes.submit(lambda db: db.create_user("eve", "pw")).result(timeout=10) is not None
+    with userData_manager("user_data.db") as db:
+        assert not db.does_user_exist("dan")
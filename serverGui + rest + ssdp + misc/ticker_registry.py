@@ -0,0 +1,80 @@
+# in memory index of the tickers we know about, so checking if a ticker exists doesn't need a database query (or a yahoo request)
+# known tickers come from the known_tickers table in stock_data.db and are kept forever
+# tickers the market data provider had nothing for are remembered as invalid for negative_ttl seconds, so a typo doesn't hit yahoo on every request
+
+import threading
+import time
+import constants
+
+
+class tickerRegistry:
+
+    def __init__(self, negative_ttl=constants.invalid_ticker_ttl):
+        self.negative_ttl = negative_ttl
+        self.known = {}  # ticker -> (first date, last date) as yyyy-mm-dd strings
+        self.invalid = {}  # ticker -> time.monotonic() when we stop believing it is invalid
+        self.loaded = False
+        self.lock = threading.Lock()
+
+        self.known_hits = 0
+        self.invalid_hits = 0
+        self.misses = 0
+
+    # fills the registry from the database the first time it is needed
+    # loader returns a list of (ticker, first date, last date) rows
+    def load_once(self, loader):
+        if self.loaded:
+            return
+        rows = loader()
+        with self.lock:
+            for ticker, first_date, last_date in rows:
+                self.merge(ticker, first_date, last_date)
+            self.loaded = True
+
+    # records that a ticker has bars from first_date to last_date
+    def add(self, ticker, first_date, last_date):
+        with self.lock:
+            self.merge(ticker, first_date, last_date)
+            self.invalid.pop(ticker, None)
+
+    # widens the known range of a ticker (the lock must be held)
+    def merge(self, ticker, first_date, last_date):
+        known = self.known.get(ticker)
+        if known is not None:
+            first_date = min(first_date, known[0])
+            last_date = max(last_date, known[1])
+        self.known[ticker] = (first_date, last_date)
+
+    # returns (first date, last date) for a known ticker, None if we don't know it
+    def get(self, ticker):
+        return self.known.get(ticker)
+
+    # remembers that a ticker doesn't exist (for a while)
+    def mark_invalid(self, ticker):
+        with self.lock:
+            self.invalid[ticker] = time.monotonic() + self.negative_ttl
+
+    # True if the ticker exists, False if it recently didn't, None if we have to go find out
+    def lookup(self, ticker):
+        with self.lock:
+            if ticker in self.known:
+                self.known_hits += 1
+                return True
+            expires = self.invalid.get(ticker)
+            if expires is not None:
+                if time.monotonic() < expires:
+                    self.invalid_hits += 1
+                    return False
+                del self.invalid[ticker]
+            self.misses += 1
+            return None
+
+    def stats(self):
+        with self.lock:
+            return {
+                "known": len(self.known),
+                "invalid": len(self.invalid),
+                "known_hits": self.known_hits,
+                "invalid_hits": self.invalid_hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,137 @@
+# built in exchange calendar (NYSE rules), so we can tell "the market was closed" apart from "we are missing data" without asking yahoo
+# weekends and the regular holidays are computed, one off closures are listed by hand
+# the rules are the modern ones (1971 on), before that every weekday counts as a trading day
+# (that only means we might ask yahoo about a day it has nothing for, never that we skip a day it does have)
+
+import datetime
+from functools import lru_cache
+import numpy as np
+
+# days the exchange closed outside of the normal holiday rules
+special_closures = {
+    datetime.date(1977, 7, 14),  # new york city blackout
+    datetime.date(1985, 9, 27),  # hurricane gloria
+    datetime.date(1994, 4, 27),  # president nixon's funeral
+    datetime.date(2001, 9, 11),  # september 11th
+    datetime.date(2001, 9, 12),
+    datetime.date(2001, 9, 13),
+    datetime.date(2001, 9, 14),
+    datetime.date(2004, 6, 11),  # president reagan's funeral
+    datetime.date(2007, 1, 2),  # president ford's funeral
+    datetime.date(2012, 10, 29),  # hurricane sandy
+    datetime.date(2012, 10, 30),
+    datetime.date(2018, 12, 5),  # president george h.w. bush's funeral
+    datetime.date(2025, 1, 9),  # president carter's funeral
+}
+
+
+# the nth (1 based) given weekday (monday = 0) of a month, n = -1 for the last one
+def nth_weekday(year, month, weekday, n):
+    if n > 0:
+        first = datetime.date(year, month, 1)
+        return first + datetime.timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    if month == 12:
+        last = datetime.date(year, 12, 31)
+    else:
+        last = datetime.date(year, month + 1, 1) - datetime.timedelta(days=1)
+    return last - datetime.timedelta(days=(last.weekday() - weekday) % 7)
+
+
+# easter sunday (anonymous gregorian algorithm), good friday is two days before
+def easter(year):
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return datetime.date(year, month, day + 1)
+
+
+# a holiday that falls on a weekend is taken on the friday before (saturday) or the monday after (sunday)
+def observed(day):
+    if day.weekday() == 5:
+        return day - datetime.timedelta(days=1)
+    if day.weekday() == 6:
+        return day + datetime.timedelta(days=1)
+    return day
+
+
+# all of the holidays the exchange is closed for in a given year
+@lru_cache(maxsize=256)
+def holidays(year):
+    if year < 1971:
+        return frozenset()
+
+    days = set()
+    new_years = datetime.date(year, 1, 1)
+    # new year's day on a saturday is not moved back to friday (that friday is the end of the previous year)
+    if new_years.weekday() != 5:
+        days.add(observed(new_years))
+    if year >= 1998:
+        days.add(nth_weekday(year, 1, 0, 3))  # martin luther king jr. day
+    days.add(nth_weekday(year, 2, 0, 3))  # washington's birthday
+    days.add(easter(year) - datetime.timedelta(days=2))  # good friday
+    days.add(nth_weekday(year, 5, 0, -1))  # memorial day
+    if year >= 2022:
+        days.add(observed(datetime.date(year, 6, 19)))  # juneteenth
+    days.add(observed(datetime.date(year, 7, 4)))  # independence day
+    days.add(nth_weekday(year, 9, 0, 1))  # labor day
+    days.add(nth_weekday(year, 11, 3, 4))  # thanksgiving
+    days.add(observed(datetime.date(year, 12, 25)))  # christmas
+    return frozenset(days)
+
+
+# the rest of the code uses datetime.datetime objects (at midnight), the calendar works with plain dates
+def to_date(day):
+    if isinstance(day, datetime.datetime):
+        return day.date()
+    return day
+
+
+# true if the exchange was (or will be) open on this day
+def is_trading_day(day):
+    day = to_date(day)
+    if day.weekday() >= 5:
+        return False
+    return day not in holidays(day.year) and day not in special_closures
+
+
+# true if there is at least one trading day from start to end (both inclusive)
+def has_trading_day(start, end):
+    start = to_date(start)
+    end = to_date(end)
+    # no closure in the rules above lasts a whole week, so any range that long has one
+    if (end - start).days >= 7:
+        return True
+    day = start
+    while day <= end:
+        if is_trading_day(day):
+            return True
+        day += datetime.timedelta(days=1)
+    return False
+
+
+# the newest trading day before today (its bar is final, today's isn't until the market closes)
+def last_complete_trading_day(today):
+    day = to_date(today) - datetime.timedelta(days=1)
+    while not is_trading_day(day):
+        day -= datetime.timedelta(days=1)
+    return day
+
+
+# every trading day from start to end (both inclusive) as an array of day numbers (days since 1970-01-01, like the price store uses)
+def trading_days(start, end):
+    start = to_date(start)
+    end = to_date(end)
+    if end < start:
+        return np.empty(0, dtype=np.int32)
+    closed = [day for year in range(start.year, end.year + 1) for day in holidays(year)]
+    closed += [day for day in special_closures if start <= day <= end]
+    dates = np.arange(np.datetime64(start), np.datetime64(end) + 1)
+    dates = dates[np.is_busday(dates, holidays=np.array(closed, dtype="datetime64[D]"))]
+    return dates.astype(np.int64).astype(np.int32)
@@ -3,15 +3,23 @@
 # 2023
 # userData_manager is a child of SQliteWrapper
 # this class manages all the interactions between the user_data.db
+#
+# every trade is also written to the trades ledger (append only, never updated), in the same transaction as the balance and holdings change
+# every constants.ledger_snapshot_interval trades a user makes, their balance and holdings are saved in position_snapshots,
+# so what they had at any moment is the snapshot before it plus at most that many trades (see get_user_state_at)
+# times are unix time in milliseconds
 
 
+import json
+import time
 from SQLiteWrapper import SQLiteWrapper
 import constants
 
 
 class userData_manager(SQLiteWrapper):  # inherit SQLiteWrapper
 
-    # create the user_data.db tables
+    # migration 1: create the user_data.db tables
+    # (IF NOT EXISTS so it also applies cleanly to user_data.db files made before migrations existed)
     def create_database(self):
         self.execute(
             """
@@ -38,9 +46,65 @@ class userData_manager(SQLiteWrapper):  # inherit SQLiteWrapper
                     """
         )
 
+    # migration 2: the trades ledger and the position snapshots
+    # we don't know what happened before this, so every existing user starts with a snapshot of what they have now
+    def create_trades_ledger(self):
+        self.execute(
+            """
+                    CREATE TABLE trades
+                    (
+                    id INTEGER PRIMARY KEY,
+                    username text NOT NULL,
+                    time INTEGER NOT NULL,
+                    ticker text NOT NULL,
+                    amount numeric NOT NULL,
+                    price numeric NOT NULL
+                    );
+                    """
+            # amount is positive for a buy and negative for a sell, the balance changed by -amount * price
+        )
+        self.execute(
+            "CREATE INDEX trades_by_user ON trades (username, id)")
+
+        self.execute(
+            """
+                    CREATE TABLE position_snapshots
+                    (
+                    username text NOT NULL,
+                    trade_id INTEGER NOT NULL,
+                    time INTEGER NOT NULL,
+                    balance numeric NOT NULL,
+                    positions text NOT NULL,
+                    PRIMARY KEY (username, trade_id)
+                    );
+                    """
+            # trade_id is the last trade the snapshot includes (0 for none), positions is a json {ticker: amount}
+        )
+
+        now = current_time()
+        self.execute("SELECT username, balance FROM user_pass_bal")
+        for username, balance in self.fetchall():
+            self.execute(
+                "SELECT ticker, amount FROM user_ticker WHERE username=? AND amount != 0", (username,))
+            positions = dict(self.fetchall())
+            self.execute("INSERT INTO position_snapshots (username, trade_id, time, balance, positions) VALUES (?, 0, ?, ?, ?)",
+                         (username, now, balance, json.dumps(positions)))
+
+    # migration 3: how many trades each user has made since their last snapshot, so a trade doesn't have to count them
+    def add_trades_since_snapshot(self):
+        self.execute(
+            "ALTER TABLE user_pass_bal ADD COLUMN trades_since_snapshot INTEGER NOT NULL DEFAULT 0")
+        self.execute("""UPDATE user_pass_bal SET trades_since_snapshot = (
+                            SELECT COUNT(*) FROM trades WHERE trades.username = user_pass_bal.username
+                            AND trades.id > (SELECT COALESCE(MAX(trade_id), 0) FROM position_snapshots WHERE position_snapshots.username = user_pass_bal.username))""")
+
+    # schema migrations in the order they are applied (see SQLiteWrapper.migrate)
+    migrations = [create_database, create_trades_ledger,
+                  add_trades_since_snapshot]
+
     # constructor calls the superconstructor for sqliteWrapper
-    def __init__(self, database_path):
-        super().__init__(database_path)
+    def __init__(self, database_path, immediate=False):
+        super().__init__(database_path, immediate)
 
     # Takes an id and returns the associated username
     def get_user_from_id(self, id):
@@ -60,51 +124,40 @@ class userData_manager(SQLiteWrapper):  # inherit SQLiteWrapper
 
         self.execute(statement, (username, password,
                      constants.starting_balance))
+        # the first snapshot, before any trades
+        self.execute("INSERT INTO position_snapshots (username, trade_id, time, balance, positions) VALUES (LOWER(?), 0, ?, ?, '{}')",
+                     (username, current_time(), constants.starting_balance))
         return self.login_user(username, password)  # when done, login the user
 
-    # buys a stock for a user (adds the stock to the user_ticker table then subtracts the balance)
+    # buys a stock for a user (subtracts the cost from their balance then adds the stock to the user_ticker table)
+    # three statements (the balance, the holding and the ledger entry, see record_trade), meant to run in an immediate transaction (see database_manager.buy_stock):
+    # the balance is only taken if it covers the cost (checked by sqlite in the same statement, so two trades can't both spend the same money),
+    # that statement also hands back the username and the user's trade count for the rest to use
+    # and the holding is created or added to with one upsert
     def buy_stock(self, id, ticker, amount, stockPrice):
-        username = self.get_user_from_id(id)
-        if (username is None):
-            return None
         # if invalid arguments
-        if (amount <= 0 or stockPrice <= 0):
+        if (stockPrice is None or amount <= 0 or stockPrice <= 0):
             return None
-        # add some validation to check if ticker is real!!!
-
-        balance = self.get_user_balance(username)
-
         cost = amount * stockPrice
 
-        # if they can't afford it
-        if (balance is None or balance <= 0 or balance < cost):
-            return None
-
-        # check here if the user already has an entry for a specific ticker, it should just update the amount, not create another entry
-        data = self.get_user_ticker_data(id)
-        already_exists = False
-        if (not data is None):
-            for user_ticker_data in data:
-                if (user_ticker_data[1] == ticker):
-                    data = user_ticker_data
-                    already_exists = True
-        # if they already have an entry for the stock, update it. Otherwise, create it
-        if already_exists:
-            self.execute("UPDATE user_ticker SET amount=? WHERE username=LOWER(?) AND ticker=?",
-                         (data[2] + amount, username, ticker))
-        else:
-            self.execute("INSERT INTO user_ticker (username, ticker, amount) VALUES (LOWER(?), ?, ?)",
-                         (username, ticker, amount))
-
-        # update the users balance to reflect the amount they spent
-        self.set_user_balance(username, balance - cost)
-
-        return True
+        # no row means the user doesn't exist or can't afford it
+        self.execute(
+            """UPDATE user_pass_bal SET balance = balance - ?, trades_since_snapshot = trades_since_snapshot + 1
+                    WHERE id=? AND balance >= ? RETURNING username, trades_since_snapshot""", (cost, id, cost))
+        data = self.fetchone()
+        if data is None:
+            return None
+        username, trades_since_snapshot = data
 
-    # updates the user balance
-    def set_user_balance(self, username, balance):
+        # if they already have an entry for the stock, add to it. Otherwise, create it
         self.execute(
-            "UPDATE user_pass_bal SET balance=? WHERE username=LOWER(?)", (balance, username))
+            """INSERT INTO user_ticker (username, ticker, amount) VALUES (?, ?, ?)
+                    ON CONFLICT (username, ticker) DO UPDATE SET amount = amount + excluded.amount""",
+            (username, ticker, amount))
+
+        self.record_trade(username, trades_since_snapshot,
+                          ticker, amount, stockPrice)
+        return True
 
     # get the user balance
     def get_user_balance(self, username):
@@ -136,31 +189,125 @@ class userData_manager(SQLiteWrapper):  # inherit SQLiteWrapper
         return data
 
     # sell a stock
+    # same idea as buy_stock: the shares are only taken if the user has that many (in the same statement), then the balance goes up
     def sell_stock(self, id, ticker, sellPrice, sellAmount):
+        if (sellPrice is None or sellAmount <= 0):
+            return None
+
+        # no row means the user doesn't exist, doesn't own the stock, or doesn't own that many shares
+        self.execute(
+            """UPDATE user_ticker SET amount = amount - ?
+                    WHERE username=(SELECT username FROM user_pass_bal WHERE id=?) AND ticker=? AND amount >= ?
+                    RETURNING username""",
+            (sellAmount, id, ticker, sellAmount))
+        data = self.fetchone()
+        if data is None:
+            return None
+        username = data[0]
+
+        # update balance
+        self.execute(
+            """UPDATE user_pass_bal SET balance = balance + ?, trades_since_snapshot = trades_since_snapshot + 1
+                    WHERE username=? RETURNING trades_since_snapshot""", (sellAmount * sellPrice, username))
+        trades_since_snapshot = self.fetchone()[0]
+
+        self.record_trade(username, trades_since_snapshot,
+                          ticker, -sellAmount, sellPrice)
+        return True
+
+    # adds a trade to the ledger (amount is negative for a sell), and snapshots the user's positions if it is time to
+    # runs in the trade's transaction, after the balance and holdings were changed (trades_since_snapshot already counts this trade)
+    def record_trade(self, username, trades_since_snapshot, ticker, amount, price):
+        now = current_time()
+        self.execute("INSERT INTO trades (username, time, ticker, amount, price) VALUES (?, ?, ?, ?, ?)",
+                     (username, now, ticker, amount, price))
+        if trades_since_snapshot < constants.ledger_snapshot_interval:
+            return
+
+        trade_id = self.cursor.lastrowid
+        self.execute(
+            "SELECT ticker, amount FROM user_ticker WHERE username=? AND amount != 0", (username,))
+        positions = dict(self.fetchall())
+        self.execute("INSERT INTO position_snapshots (username, trade_id, time, balance, positions) SELECT username, ?, ?, balance, ? FROM user_pass_bal WHERE username=?",
+                     (trade_id, now, json.dumps(positions), username))
+        self.execute(
+            "UPDATE user_pass_bal SET trades_since_snapshot = 0 WHERE username=?", (username,))
+
+    # what a user had at a given time (unix milliseconds): (balance, {ticker: amount}), None if the user doesn't exist or we have no record from that far back
+    # rebuilt from the newest snapshot at or before the time, plus the trades after it
+    def get_user_state_at(self, id, at):
         username = self.get_user_from_id(id)
         if (username is None):
             return None
-        # get all stocks they own
-        user_data = self.get_user_ticker_data(id)
-        user_data = constants.find_first_occurence_in_2D_Array(
-            user_data, ticker)
-        if (user_data is None):
+        self.execute(
+            "SELECT trade_id, balance, positions FROM position_snapshots WHERE username=? AND time <= ? ORDER BY trade_id DESC LIMIT 1", (username, at))
+        snapshot = self.fetchone()
+        if snapshot is None:
             return None
-        num_shares = user_data[2]
+        trade_id, balance, positions = snapshot
+        positions = json.loads(positions)
 
-        # if they don't own the amount they're trying to sell
-        if (num_shares < sellAmount):
+        self.execute(
+            "SELECT ticker, amount, price FROM trades WHERE username=? AND id > ? AND time <= ? ORDER BY id", (username, trade_id, at))
+        for ticker, amount, price in self.fetchall():
+            # the same arithmetic buy_stock/sell_stock did to the balance
+            if amount > 0:
+                balance = balance - amount * price
+            else:
+                balance = balance + -amount * price
+            positions[ticker] = positions.get(ticker, 0) + amount
+        return balance, {ticker: amount for ticker, amount in positions.items() if amount != 0}
+
+    # where a user's ledger starts and the trades after a given trade id: ((time, balance, {ticker: amount}) of their first snapshot, [(trade id, time, ticker, amount, price), ...])
+    # None if the user doesn't exist (or has no snapshot)
+    def get_user_ledger(self, id, after=0):
+        username = self.get_user_from_id(id)
+        if (username is None):
             return None
-
-        # modify the amount
         self.execute(
-            "UPDATE user_ticker SET amount=? WHERE username=LOWER(?) AND ticker=?", (num_shares - sellAmount, username, ticker))
-
-        # update balance
-        self.set_user_balance(username, self.get_user_balance(
-            username) + sellAmount * sellPrice)
+            "SELECT time, balance, positions FROM position_snapshots WHERE username=? ORDER BY trade_id LIMIT 1", (username,))
+        first = self.fetchone()
+        if first is None:
+            return None
+        self.execute(
+            "SELECT id, time, ticker, amount, price FROM trades WHERE username=? AND id > ? ORDER BY id", (username, after))
+        return (first[0], first[1], json.loads(first[2])), self.fetchall()
 
-        return True
+    # a user's trades in the order they happened, as (trade id, time, ticker, amount, price) rows (amount is negative for a sell)
+    # after is a trade id, only trades after it are returned (for paging), limit is the most to return
+    # None if the user doesn't exist
+    def get_user_trades(self, id, after=0, limit=None):
+        username = self.get_user_from_id(id)
+        if (username is None):
+            return None
+        self.execute("SELECT id, time, ticker, amount, price FROM trades WHERE username=? AND id > ? ORDER BY id LIMIT ?",
+                     (username, after, -1 if limit is None else limit))
+        return self.fetchall()
+
+    # everything the leaderboard rebuilds itself from (see leaderboard.py), run inside one transaction so it all lines up:
+    # ([(rowid, username, balance), ...], [(username, ticker, amount), ...], the last trade id, {ticker: the price it last traded at})
+    def get_leaderboard_state(self):
+        self.execute("SELECT rowid, username, balance FROM user_pass_bal")
+        users = self.fetchall()
+        self.execute("SELECT username, ticker, amount FROM user_ticker WHERE amount != 0")
+        holdings = self.fetchall()
+        self.execute("SELECT COALESCE(MAX(id), 0) FROM trades")
+        last_trade_id = self.fetchone()[0]
+        self.execute(
+            "SELECT ticker, price FROM trades WHERE id IN (SELECT MAX(id) FROM trades GROUP BY ticker)")
+        return users, holdings, last_trade_id, dict(self.fetchall())
+
+    # the users created and trades made since the leaderboard last looked (user_pass_bal rowids and trade ids only go up):
+    # ([(rowid, username, balance, {ticker: amount}) as of their first snapshot, ...], [(trade id, username, ticker, amount, price), ...])
+    def get_leaderboard_changes(self, user_rowid, trade_id):
+        self.execute("""SELECT user_pass_bal.rowid, user_pass_bal.username, position_snapshots.balance, position_snapshots.positions
+                        FROM user_pass_bal JOIN position_snapshots ON position_snapshots.username = user_pass_bal.username AND position_snapshots.trade_id = 0
+                        WHERE user_pass_bal.rowid > ? ORDER BY user_pass_bal.rowid""", (user_rowid,))
+        users = [(rowid, username, balance, json.loads(positions))
+                 for rowid, username, balance, positions in self.fetchall()]
+        self.execute(
+            "SELECT id, username, ticker, amount, price FROM trades WHERE id > ? ORDER BY id", (trade_id,))
+        return users, self.fetchall()
 
     # logs in user (gets their unique id)
     def login_user(self, username, password):
@@ -175,3 +322,8 @@ class userData_manager(SQLiteWrapper):  # inherit SQLiteWrapper
             return None
 
         return data[0]  # username
+
+
+# the time trades and snapshots are stamped with, unix time in milliseconds
+def current_time():
+    return int(time.time() * 1000)
@@ -2,9 +2,20 @@
 # J.Bains
 # 2023
 # class that lets us start the uvicorn server (fastapi, rest) as its own thread (so it doesn't override the mainthread, gui)
+# and uvicornWorkerPool, which runs the rest server in several worker processes that share one listening socket
 
+import logging
+import multiprocessing
 import threading
+import time
 import uvicorn
+import constants
+
+logger = logging.getLogger(__name__)
+
+multiprocessing.allow_connection_pickling()  # lets us hand the listening socket to the worker processes
+# spawn (instead of fork) so workers start clean (no copied sqlite connections or threads from the gui process), same as uvicorn's own --workers
+spawn = multiprocessing.get_context("spawn")
 
 
 class uvicornServer(uvicorn.Server):
@@ -15,3 +26,81 @@ class uvicornServer(uvicorn.Server):
     def stop(self):
         self.should_exit = True
         self.thread.join()
+
+
+# entry point of a worker process (needs to be a top level function so it can be pickled over to the new process)
+def run_worker(config, sockets, stop_event):
+    config.configure_logging()  # logging has to be set up again in each process
+    server = uvicorn.Server(config=config)
+
+    # uvicorn finishes the requests it is working on and exits once should_exit is set
+    # we use an event instead of a signal so this also drains properly on windows (where terminate() just kills the process)
+    def wait_for_stop():
+        stop_event.wait()
+        server.should_exit = True
+
+    threading.Thread(target=wait_for_stop, daemon=True).start()
+    server.run(sockets=sockets)
+
+
+# runs config.workers copies of the rest server as separate processes so we can use more than one core
+# the parent binds the socket once and every worker accepts connections from it
+# has the same start/stop methods as uvicornServer so serverManager can use either one
+class uvicornWorkerPool:
+
+    def __init__(self, config):
+        self.config = config
+        self.processes = []
+        self.stop_events = []
+        self.restarts = 0
+
+    def start(self):
+        self.socket = self.config.bind_socket()
+        self.should_exit = threading.Event()
+        for i in range(self.config.workers):
+            self.processes.append(None)
+            self.stop_events.append(None)
+            self.spawn_worker(i)
+
+        # supervisor thread that restarts any worker that crashes
+        self.supervisor = threading.Thread(target=self.supervise, daemon=True)
+        self.supervisor.start()
+
+    # starts the worker for slot i
+    # every worker gets its own stop event, a worker that gets killed while waiting on a shared one would leave it stuck (set() waits on every waiter)
+    def spawn_worker(self, i):
+        self.stop_events[i] = spawn.Event()
+        self.processes[i] = spawn.Process(target=run_worker, args=(
+            self.config, [self.socket], self.stop_events[i]))
+        self.processes[i].start()
+
+    # checks on the workers every so often and replaces the ones that died (as long as we aren't shutting down)
+    def supervise(self):
+        while not self.should_exit.wait(constants.rest_worker_check_interval):
+            for i, process in enumerate(self.processes):
+                if not process.is_alive() and not self.should_exit.is_set():
+                    logger.warning("rest worker %s exited with code %s, restarting it",
+                                   process.pid, process.exitcode)
+                    process.join()
+                    self.spawn_worker(i)
+                    self.restarts += 1
+
+    def stop(self):
+        # stop restarting workers, then tell every worker to stop accepting and finish what it is doing
+        self.should_exit.set()
+        self.supervisor.join()
+        for stop_event in self.stop_events:
+            stop_event.set()
+
+        deadline = time.monotonic() + constants.rest_worker_shutdown_timeout
+        for process in self.processes:
+            process.join(max(0, deadline - time.monotonic()))
+        # anything that still hasn't exited gets killed
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+        self.processes = []
+        self.stop_events = []
+        self.socket.close()
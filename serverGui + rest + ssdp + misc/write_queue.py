@@ -0,0 +1,146 @@
+# group commit for user_data.db
+# every trade used to commit its own transaction (and wait on its own fsync), when a whole class trades at once the commits are what limits us
+# instead the handlers hand their writes ("intents", a function that takes a userData_manager) to one writer thread,
+# which runs everything that arrives within window seconds (up to max_batch intents) in one transaction and commits them together
+# each intent runs in its own SAVEPOINT, so one that fails (raises) is rolled back on its own and the rest of the batch still commits
+# every caller gets a future that resolves with what its intent returned (or the exception it raised) once the batch has committed
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import constants
+
+logger = logging.getLogger(__name__)
+
+
+class writeQueue:
+
+    # manager_class is the SQLiteWrapper child to open db_file with (i.e userData_manager)
+    def __init__(self, db_file, manager_class, window=constants.write_queue_window, max_batch=constants.write_queue_max_batch):
+        self.db_file = db_file
+        self.manager_class = manager_class
+        self.window = window
+        self.max_batch = max_batch
+        self.intents = queue.Queue()  # (fn, future, time it was submitted)
+        self.thread = None
+        self.lock = threading.Lock()
+
+        self.batches = 0
+        self.committed = 0
+        self.failed = 0
+        self.largest_batch = 0
+        self.total_batch_time = 0.0  # seconds spent running and committing batches
+        self.max_batch_time = 0.0
+        self.total_wait_time = 0.0  # seconds intents spent queued before their batch started
+        self.last_batch_size = 0
+        self.last_batch_time = 0.0
+
+    # queues fn(db) to run in the next batch, returns a concurrent.futures.Future for its result
+    # fn must only touch the database (if the batch has to be retried it runs again)
+    def submit(self, fn):
+        self.start()
+        future = Future()
+        self.intents.put((fn, future, time.monotonic()))
+        return future
+
+    # submit, then wait for the result without blocking the event loop
+    async def run(self, fn):
+        return await asyncio.wrap_future(self.submit(fn))
+
+    # starts the writer thread the first time there is something to write
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.loop, name="write-queue", daemon=True)
+                self.thread.start()
+
+    def loop(self):
+        while True:
+            batch = [self.intents.get()]
+            # the batch closes window seconds after its first intent arrived, or when it is full
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.intents.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.run_batch(batch)
+
+    # runs a batch in one transaction, then resolves the futures
+    def run_batch(self, batch):
+        # an intent whose caller already gave up (its future was cancelled) is dropped, after this they can't be cancelled any more
+        batch = [intent for intent in batch if intent[1].set_running_or_notify_cancel()]
+        if len(batch) <= 0:
+            return
+        started = time.monotonic()
+        try:
+            results = self.manager_class.run_with_retry(
+                self.db_file, lambda db: self.apply(db, batch))
+        except Exception as e:
+            # the whole transaction failed (i.e the database stayed locked through every retry), nothing in it was written
+            logger.warning("write queue batch of %d failed: %s", len(batch), e)
+            results = [(None, e)] * len(batch)
+        elapsed = time.monotonic() - started
+
+        with self.lock:
+            self.batches += 1
+            self.largest_batch = max(self.largest_batch, len(batch))
+            self.total_batch_time += elapsed
+            self.max_batch_time = max(self.max_batch_time, elapsed)
+            self.total_wait_time += sum(started - submitted for fn, future, submitted in batch)
+            self.last_batch_size = len(batch)
+            self.last_batch_time = elapsed
+            for result, error in results:
+                if error is None:
+                    self.committed += 1
+                else:
+                    self.failed += 1
+
+        for (fn, future, submitted), (result, error) in zip(batch, results):
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    # runs every intent of a batch inside the transaction, each in its own savepoint, returns a (result, exception) for each
+    def apply(self, db, batch):
+        results = []
+        for fn, future, submitted in batch:
+            db.execute("SAVEPOINT intent")
+            try:
+                result = fn(db)
+            except Exception as e:
+                db.execute("ROLLBACK TO intent")
+                db.execute("RELEASE intent")
+                results.append((None, e))
+                continue
+            db.execute("RELEASE intent")
+            results.append((result, None))
+        return results
+
+    # batch sizes and how long batches take, to tune window and max_batch
+    def stats(self):
+        with self.lock:
+            intents = self.committed + self.failed
+            return {
+                "window": self.window,
+                "max_batch": self.max_batch,
+                "queued": self.intents.qsize(),
+                "batches": self.batches,
+                "committed": self.committed,
+                "failed": self.failed,
+                "average_batch_size": intents / self.batches if self.batches > 0 else None,
+                "largest_batch": self.largest_batch,
+                "last_batch_size": self.last_batch_size,
+                "average_batch_ms": self.total_batch_time / self.batches * 1000 if self.batches > 0 else None,
+                "max_batch_ms": self.max_batch_time * 1000,
+                "last_batch_ms": self.last_batch_time * 1000,
+                "average_queue_wait_ms": self.total_wait_time / intents * 1000 if intents > 0 else None,
+            }